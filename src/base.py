@@ -3,19 +3,39 @@ Quick and dirty setup for managing Groq models. Handles API key, model selection
 and conversation history config. Uses Groq and AsyncGroq clients.
 """
 
-import base64
+import asyncio
+import functools
+import itertools
 import os
 import random
 import sys
+import threading
+import time
 from datetime import datetime, timedelta
 from enum import Enum
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
 
+import httpx
 from dotenv import load_dotenv
 from groq import APIError, AsyncGroq, BadRequestError, Groq
 
+from cache import (
+    AnswerCache,
+    MemoryAnswerCache,
+    RedisAnswerCache,
+    cache_key,
+    context_digest,
+)
+from coalesce import SingleFlight, single_flight as shared_single_flight
+from context import ContextBuilder, is_follow_up, previous_exchange
 from errors.model import ModelError
+from errors.redis import RedisErrors
 from history import CompletionHistory
+from scheduler import RequestScheduler
+from semantic import SemanticIndex
+from telemetry import telemetry
+from tools import ToolRegistry, tool_registry as shared_tool_registry
+from vision import image_encoder
 
 
 load_dotenv()
@@ -33,6 +53,88 @@ class AvailableGroqModels(Enum):
     TOOL_USE_LARGE = "llama3-groq-70b-8192-tool-use-preview"  # Bigger tool-helper
 
 
+class ModelMode(Enum):
+    """
+    How Model.ask() serves a request. See the README for the full pitch.
+    """
+
+    ONLINE = "online"  # No cache-checking nonsense, just generates
+    DATA = "data"  # Cached answers first, generates only if needed
+    OFFLINE = "offline"  # Cache or bust, never generates
+
+
+CONFIRMATION_PROMPTS = [
+    "I’m not sure about that one. Want me to generate an answer?",
+    "I don’t know yet... should I look it up for you?",
+    "Hmm, I don’t have that info right now. Want me to figure it out?",
+    "I’m not sure off the top of my head. Should I try generating an answer?",
+    "Good question! I don’t know yet—want me to dive in and generate something?",
+    "I don’t have the answer handy. Should I find or generate it for you?",
+    "I’m blanking on this one... want me to take a shot at generating an answer?",
+    "Not sure yet. Should I look into it and generate a response?",
+]
+
+OFFLINE_PROMPTS = [
+    "I don’t have that one saved, and I’m offline right now.",
+    "Nothing on that in my notes, and I can’t look it up while offline.",
+]
+
+FAILURE_PROMPTS = [
+    "Sorry, I couldn’t come up with an answer right now.",
+]
+
+
+class ModeStats:
+    """
+    Hit/miss/latency counters for each ModelMode.
+    """
+
+    def __init__(self) -> None:
+        self.counters: Dict[ModelMode, Dict[str, float]] = {
+            mode: {
+                "requests": 0,
+                "hits": 0,
+                "misses": 0,
+                "generated": 0,
+                "latency_total": 0.0,
+                "latency_max": 0.0,
+            }
+            for mode in ModelMode
+        }
+
+    def record(self, mode: ModelMode, outcome: str, seconds: float) -> None:
+        """
+        Counts one request.
+        - mode (ModelMode): The mode it was served in.
+        - outcome (str): "hit", "miss" or "generated".
+        - seconds (float): How long it took.
+        """
+        counters = self.counters[mode]
+        counters["requests"] += 1
+        counters["hits" if outcome == "hit" else "misses"] += 1
+        if outcome == "generated":
+            counters["generated"] += 1
+
+        counters["latency_total"] += seconds
+        counters["latency_max"] = max(counters["latency_max"], seconds)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        - Returns (dict): Counters per mode, plus hit rate and average latency.
+        """
+        summary = {}
+        for mode, counters in self.counters.items():
+            requests = counters["requests"]
+            summary[mode.value] = {
+                **counters,
+                "hit_rate": counters["hits"] / requests if requests else 0.0,
+                "latency_avg": (
+                    counters["latency_total"] / requests if requests else 0.0
+                ),
+            }
+        return summary
+
+
 class Model:
     """
     Handles setting up a Groq model client. Can be async or sync, depends on what you pass in.
@@ -45,38 +147,103 @@ class Model:
         history_directory: str = "conversations",
         history_interval_hours: int = 6,
         llm_model: str = AvailableGroqModels.DEFAULT,
+        answer_cache: Optional[AnswerCache] = None,
+        mode: ModelMode = ModelMode.DATA,
+        confirm_generation: bool = True,
+        http_client: Optional[httpx.AsyncClient] = None,
+        history: Optional[CompletionHistory] = None,
+        client: Optional[Groq | AsyncGroq] = None,
+        tool_registry: Optional[ToolRegistry] = None,
+        max_tool_rounds: int = 4,
+        context_builder: Optional[ContextBuilder] = None,
+        semantic_index: Optional[SemanticIndex] = None,
+        semantic_cutoff: float = 0.7,
+        flights: Optional[SingleFlight] = None,
+        scheduler: Optional[RequestScheduler] = None,
+        base_url: Optional[str] = None,
     ) -> None:
         """
         Sets up the model client. Exits hard if the API key isn't set.
+        History and client can be built ahead of time (see create_history and
+        create_client), e.g. in parallel at startup, and handed in ready to go.
 
         Args:
             asynchronous (bool): Use async client if True, sync otherwise.
             history_directory (str): Where to dump history files. Defaults to 'conversations'.
             history_interval_hours (int): How often to rotate history files. Defaults to 6 hours.
             llm_model (str): Which Groq model to use. Defaults to DEFAULT.
+            answer_cache (AnswerCache, optional): Where to cache answers. Uses Redis if
+                REDIS_URL is set and reachable, an in-process LRU otherwise.
+            mode (ModelMode): ONLINE, DATA or OFFLINE. Defaults to DATA.
+            confirm_generation (bool): In DATA mode, ask before generating on a miss.
+            http_client (httpx.AsyncClient, optional): Pooled HTTP client for the async
+                Groq client. Pass the same one to several models to share connections.
+            history (CompletionHistory, optional): Already loaded history to use.
+            client (Groq | AsyncGroq, optional): Already built client to use.
+            tool_registry (ToolRegistry, optional): Where tools passed by name are looked
+                up. Defaults to the shared registry in tools.py.
+            max_tool_rounds (int): How many times in a row tool calls get run locally and
+                sent back before giving up on a final answer.
+            context_builder (ContextBuilder, optional): Picks the earlier turns that go
+                out with each question, within the model's context window.
+            semantic_index (SemanticIndex, optional): Paraphrase index lookups fall back
+                on. Defaults to one saved in the history directory.
+            semantic_cutoff (float): How similar (cosine, 0-1) a past question has to
+                be for its answer to get reused.
+            flights (SingleFlight, optional): Where identical in-flight requests get
+                coalesced. Defaults to the one every Model in the process shares.
+            scheduler (RequestScheduler, optional): Rate limiting, retries and model
+                fallback around the client. Defaults to a new one on this client.
+            base_url (str, optional): Where to send requests, e.g. a local mock server.
+                Only used when the client gets built here.
         """
-        self.api_key = os.environ.get("GROQ_SECRET_KEY")
-        if not self.api_key:
-            print(ModelError.NO_API_KEY)
-            sys.exit(1)  # Hard exit, no API key = no fun
+        self.http_client: Optional[httpx.AsyncClient] = None
+        if client is None:
+            if asynchronous:
+                self.http_client = http_client or Model.create_http_client()
+            client = Model.create_client(asynchronous, self.http_client, base_url)
+        else:
+            self.http_client = http_client
 
-        self.client: Groq | AsyncGroq = (
-            Groq(api_key=self.api_key)
-            if not asynchronous
-            else AsyncGroq(api_key=self.api_key)
-        )
+        self.api_key = client.api_key
+        self.client: Groq | AsyncGroq = client
+
+        self._inflight: Set[asyncio.Future] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._generation = 0  # bumped by cancel(), sync streams stop when it changes
+        # aask() does its history work on worker threads, one at a time
+        self._state_lock = threading.Lock()
 
         self.model = llm_model
+        self.mode = mode
+        self.confirm_generation = confirm_generation
+        self.stats = ModeStats()
         self.history_directory = history_directory
         self.history_interval_hours = history_interval_hours
 
-        self.history = CompletionHistory(
-            debug=True,
-            history_directory=self.history_directory,
-            new_history_interval=timedelta(self.history_interval_hours),
+        self.history = history or Model.create_history(
+            self.history_directory, self.history_interval_hours
         )
 
+        self.answer_cache = answer_cache or Model.create_answer_cache()
+
+        self.tools = tool_registry or shared_tool_registry
+        self.max_tool_rounds = max_tool_rounds
+        self.context = context_builder or ContextBuilder()
+
+        # an empty index is falsy, so check for None
+        self.semantic = (
+            semantic_index
+            if semantic_index is not None
+            else Model.create_semantic_index(self.history_directory, self.history)
+        )
+        self.semantic_cutoff = semantic_cutoff
+
+        self.flights = flights or shared_single_flight
+        self.scheduler = scheduler or RequestScheduler(self.client)
+
         self.model_awaiting_confirmation = False
+        self.model_pending_question: Optional[str] = None
         self.model_deny_words = [
             "no",
             "nope",
@@ -88,16 +255,19 @@ class Model:
     def completion(
         self,
         question: str,
-        tools: Optional[List[Dict[str, Any]]] = None,
+        tools: Optional[List[str | Dict[str, Any]]] = None,
         additional_context: Optional[str] = None,
         code: bool = False,
         image_path: Optional[str] = None,
     ) -> Optional[str]:
         """
         Generates a response based on the model type and input parameters.
+        Tool calls the model makes get run locally (in parallel) if the tools have
+        handlers registered, and the results go back to the model for the final answer.
 
         - question (str): The user's input question or prompt.
-        - tools (list of dict, optional): List of tools with their names and parameters.
+        - tools (list of str | dict, optional): Names of registered tools, or full tool
+          definitions with their names and parameters.
         - additional_context (str, optional): Additional context for the model.
         - code (str, optional): Prefilled code snippet for code generation tasks.
         - image_path (str, optional): Path to an image file for vision models.
@@ -152,6 +322,24 @@ class Model:
           print(answer)
 
 
+        ```
+        ---
+        ```python
+
+
+          # Registering a tool once, with a handler, and using it by name
+
+          @tool_registry.tool(
+              description="Fetch weather for a specific location.",
+              parameters=[{"name": "location", "type": "string", "required": True}],
+          )
+          def get_weather(location: str) -> dict:
+              return {"location": location, "forecast": "sunny"}
+
+          model = Model(llm_model=AvailableGroqModels.TOOL_USE)
+          answer = model.completion("What's the weather in Oslo?", tools=["get_weather"])
+
+
         ```
         ---
         ```python
@@ -169,104 +357,577 @@ class Model:
 
         ```
         """
+        cacheable = not tools and not image_path
+        key = self._answer_key(question, additional_context, code)
+        if cacheable and self.mode is not ModelMode.ONLINE:
+            cached = self.answer_cache.get(key)
+            if cached:
+                return cached["answer"]
+
+        if isinstance(self.client, AsyncGroq):
+            raise RuntimeError(
+                "model - completion() needs a sync client, use acompletion() when asynchronous=True"
+            )
+
         try:
-            messages = [{"role": "user", "content": question}]
-
-            if additional_context:
-                messages.insert(0, {"role": "system", "content": additional_context})
-
-            if code:
-                messages.append(
-                    {"role": "assistant", "content": "```"}
-                )  # Gonna use prompt prefilling to force the model to spit out code output only
-
-            prepared_tools = []
-            if tools:
-                for tool in tools:
-                    prepared_tool = {
-                        "type": "function",
-                        "function": {
-                            "name": tool["tool_name"],
-                            "description": tool.get("description", ""),
-                            "parameters": {
-                                "type": "object",
-                                "properties": {
-                                    param["name"]: {
-                                        "type": param["type"],
-                                        "description": param.get("description", ""),
-                                    }
-                                    for param in tool.get("tool_parameters", [])
-                                },
-                                "required": [
-                                    param["name"]
-                                    for param in tool.get("tool_parameters", [])
-                                    if param.get("required", False)
-                                ],
-                            },
-                        },
-                    }
-                    prepared_tools.append(prepared_tool)
-
-            if (
-                self.model
-                in {AvailableGroqModels.VISION, AvailableGroqModels.TOOL_USE_LARGE}
-                and image_path
-            ):
-                with open(image_path, "rb") as img_file:
-                    image_data = base64.b64encode(img_file.read()).decode("utf-8")
-                messages.append(
-                    {
-                        "role": "user",
-                        "content": {
-                            "type": "text",
-                            "text": question,
-                        },
-                        "attachments": [
-                            {
-                                "type": "image_url",
-                                "image_url": f"data:image/jpeg;base64,{image_data}",
-                            }
-                        ],
-                    }
-                )
+            request = self._prepare_request(
+                question, tools, additional_context, code, image_path
+            )
+        except (OSError, ValueError) as e:
+            telemetry.debug("model", "couldn't build the request: %s", e)
+            return None
 
-            if tools:
-                response = self.client.chat.completions.create(
-                    messages=messages,
-                    model=self.model.value,
-                    tools=prepared_tools if prepared_tools else None,
-                    tool_choice="auto" if prepared_tools else None,
-                )
-            else:
-                response = self.client.chat.completions.create(
-                    messages=messages, model=self.model.value
-                )
+        try:
+            response = self._create(request)
+
+            # ad-hoc tool definitions only exist for this call
+            tools_in_scope = self.tools.scoped(tools) if tools else self.tools
+            for _ in range(self.max_tool_rounds if tools else 0):
+                follow_up = tools_in_scope.follow_up(response)
+                if follow_up is None:
+                    break
+                request["messages"] = request["messages"] + follow_up
+                response = self._create(request)
+
+            return self._read_answer(response, key if cacheable else None)
 
-            if response.choices and response.choices[0].message:
-                return response.choices[0].message.content.strip()
+        except BadRequestError as e:
+            telemetry.debug("model", "Invalid request: %s", e)
+            return None
+        except APIError as e:
+            telemetry.debug("model", "API error occurred: %s", e)
             return None
 
+    async def acompletion(
+        self,
+        question: str,
+        tools: Optional[List[str | Dict[str, Any]]] = None,
+        additional_context: Optional[str] = None,
+        code: bool = False,
+        image_path: Optional[str] = None,
+    ) -> Optional[str]:
+        """
+        Async version of completion(). Needs asynchronous=True.
+        Runs as its own task so cancel() can abort it mid-request, e.g. when the user
+        starts talking over the answer. A cancelled request raises CancelledError.
+        The cache probe, context building and tool calls run on worker threads, so
+        they don't block the event loop.
+
+        - question (str): The user's input question or prompt.
+        - tools (list of str | dict, optional): Names of registered tools, or full tool
+          definitions with their names and parameters.
+        - additional_context (str, optional): Additional context for the model.
+        - code (bool): Prefill the reply with a code fence to get code only.
+        - image_path (str, optional): Path to an image file for vision models.
+        - Returns (str | None): The generated response or None if an error occurs.
+        """
+        if not isinstance(self.client, AsyncGroq):
+            raise RuntimeError(
+                "model - acompletion() needs an async client, pass asynchronous=True"
+            )
+
+        cacheable = not tools and not image_path
+        self._loop = asyncio.get_running_loop()
+        try:
+            key, cached, request = await asyncio.to_thread(
+                self._locked,
+                self._probe,
+                question,
+                tools,
+                additional_context,
+                code,
+                image_path,
+            )
+        except (OSError, ValueError) as e:
+            telemetry.debug("model", "couldn't build the request: %s", e)
+            return None
+        if cached is not None:
+            return cached
+
+        task = asyncio.ensure_future(self._acreate(request))
+        self._inflight.add(task)
+
+        try:
+            response = await task
+
+            tools_in_scope = self.tools.scoped(tools) if tools else self.tools
+            for _ in range(self.max_tool_rounds if tools else 0):
+                follow_up = await asyncio.to_thread(tools_in_scope.follow_up, response)
+                if follow_up is None:
+                    break
+                request["messages"] = request["messages"] + follow_up
+
+                self._inflight.discard(task)
+                task = asyncio.ensure_future(self._acreate(request))
+                self._inflight.add(task)
+                response = await task
+
+            return self._read_answer(response, key if cacheable else None)
         except BadRequestError as e:
-            print(f"Invalid request: {e}")
+            telemetry.debug("model", "Invalid request: %s", e)
             return None
         except APIError as e:
-            print(f"API error occurred: {e}")
+            telemetry.debug("model", "API error occurred: %s", e)
             return None
+        finally:
+            self._inflight.discard(task)
 
-    def ask(self, text: str = None) -> str:
+    def _probe(
+        self,
+        question: str,
+        tools: Optional[List[str | Dict[str, Any]]] = None,
+        additional_context: Optional[str] = None,
+        code: bool = False,
+        image_path: Optional[str] = None,
+    ) -> Tuple[str, Optional[str], Optional[Dict[str, Any]]]:
         """
-        Handles user input, checks history for similar requests, and generates responses.
+        acompletion()'s blocking part: the cache lookup, and on a miss building the
+        request (history search included). Takes the same inputs as completion().
+        - Returns (Tuple[str, str | None, dict | None]): The cache key, then either
+          the cached answer or the request to send.
+        """
+        key = self._answer_key(question, additional_context, code)
+        if not tools and not image_path and self.mode is not ModelMode.ONLINE:
+            cached = self.answer_cache.get(key)
+            if cached:
+                return key, cached["answer"], None
 
-        - text (str): The user's input question or prompt.
+        request = self._prepare_request(
+            question, tools, additional_context, code, image_path
+        )
+        return key, None, request
 
-        What it does:
-        - If the history interval has passed, clears and starts a new history.
-        - If awaiting confirmation, checks for deny words or generates a response.
-        - Searches conversation history for similar inputs and reuses answers if found.
-        - If no history match, offers to generate a new answer and sets confirmation state.
+    def _create(self, request: Dict[str, Any]) -> Any:
         """
-        assert text is not None, "Model.ask() was called without input."
+        Sends a chat completion through the scheduler, or waits on an identical one
+        that's already out.
+        - request (dict): Keyword arguments for chat.completions.create().
+        - Returns (Any): The chat completion.
+        """
+        with telemetry.span("groq.completion", model=request["model"]):
+            return self.flights.call(
+                request, functools.partial(self.scheduler.create, **request)
+            )
+
+    async def _acreate(self, request: Dict[str, Any]) -> Any:
+        """
+        Async version of _create(). Cancelling it only cancels the request itself if
+        nobody else is waiting on it.
+        """
+        with telemetry.span("groq.completion", model=request["model"]):
+            return await self.flights.acall(
+                request, functools.partial(self.scheduler.acreate, **request)
+            )
+
+    def cancel(self) -> None:
+        """
+        Aborts every in-flight request: async ones get cancelled, sync streams stop
+        at their next chunk and close the connection. Safe to call from any thread, so
+        the speech callbacks can use it for barge-in.
+        """
+        self._generation += 1
+
+        if self._loop is None or self._loop.is_closed():
+            return
+
+        def cancel_all() -> None:
+            for task in list(self._inflight):
+                task.cancel()
+
+        try:
+            if asyncio.get_running_loop() is self._loop:
+                cancel_all()
+                return
+        except RuntimeError:
+            pass  # not on the event loop thread
+
+        self._loop.call_soon_threadsafe(cancel_all)
+
+    @staticmethod
+    def create_http_client() -> httpx.AsyncClient:
+        """
+        Builds the pooled HTTP client the async Groq client runs on.
+        - Returns (httpx.AsyncClient): A client with keep-alive connections.
+        """
+        return httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=16),
+            timeout=httpx.Timeout(60.0, connect=5.0),
+        )
+
+    @staticmethod
+    def create_client(
+        asynchronous: bool = False,
+        http_client: Optional[httpx.AsyncClient] = None,
+        base_url: Optional[str] = None,
+    ) -> Groq | AsyncGroq:
+        """
+        Builds a Groq client. Exits hard if the API key isn't set.
+        The client doesn't retry on its own, RequestScheduler does that.
+        - asynchronous (bool): Build an AsyncGroq client instead.
+        - http_client (httpx.AsyncClient, optional): Pooled HTTP client for AsyncGroq.
+        - base_url (str, optional): API base URL. Defaults to Groq's (or GROQ_BASE_URL).
+        - Returns (Groq | AsyncGroq): The client.
+        """
+        api_key = os.environ.get("GROQ_SECRET_KEY")
+        if not api_key:
+            print(ModelError.NO_API_KEY)
+            sys.exit(1)  # Hard exit, no API key = no fun
+
+        if asynchronous:
+            return AsyncGroq(
+                api_key=api_key,
+                http_client=http_client,
+                base_url=base_url,
+                max_retries=0,
+            )
+        return Groq(api_key=api_key, base_url=base_url, max_retries=0)
+
+    @staticmethod
+    def create_answer_cache() -> AnswerCache:
+        """
+        Builds the default answer cache: Redis if REDIS_URL is set and reachable,
+        an in-process LRU otherwise.
+        - Returns (AnswerCache): The cache.
+        """
+        if os.environ.get("REDIS_URL"):
+            try:
+                return RedisAnswerCache(url=os.environ["REDIS_URL"])
+            except ConnectionError:
+                telemetry.debug("cache", RedisErrors.CONNECTION.value)
+
+        return MemoryAnswerCache()
+
+    @staticmethod
+    def create_history(
+        history_directory: str = "conversations",
+        history_interval_hours: int = 6,
+        journal: bool = False,
+        lazy_load: bool = False,
+    ) -> CompletionHistory:
+        """
+        Loads conversation history the way Model uses it.
+        - history_directory (str): Where history files live.
+        - history_interval_hours (int): How often to rotate history files.
+        - journal (bool): Append turns to JSONL journals instead of rewriting JSON
+          files. Existing JSON files still load, new turns go to a journal.
+        - lazy_load (bool): Index history files instead of loading them into memory.
+        - Returns (CompletionHistory): The history.
+        """
+        return CompletionHistory(
+            debug=True,
+            history_directory=history_directory,
+            new_history_interval=timedelta(history_interval_hours),
+            journal=journal,
+            lazy_load=lazy_load,
+        )
+
+    @staticmethod
+    def create_semantic_index(
+        history_directory: str = "conversations",
+        history: Optional[CompletionHistory] = None,
+    ) -> SemanticIndex:
+        """
+        Loads the paraphrase index saved next to the history files. A brand new index
+        gets filled from the request/answer pairs already in history.
+        - history_directory (str): Where history files live.
+        - history (CompletionHistory, optional): History to fill a new index from.
+        - Returns (SemanticIndex): The index.
+        """
+        # its own subdirectory, so the history loader doesn't pick its files up
+        index = SemanticIndex(os.path.join(history_directory, "semantic"))
+        if len(index) == 0 and history is not None:
+            # in lazy mode the older entries are only in the archive
+            archived = (
+                (entry for _, entry in history.archive)
+                if history.archive is not None
+                else ()
+            )
+            index.add_many(
+                (entry.get("request"), entry.get("answer"))
+                for entry in itertools.chain(archived, history.conversation_history)
+                if isinstance(entry.get("request"), str)
+                and isinstance(entry.get("answer"), str)
+            )
+        return index
+
+    async def aclose(self) -> None:
+        """
+        Closes the pooled HTTP client behind the async Groq client, and the
+        scheduler's hedging threads.
+        """
+        self.scheduler.close()
+        if self.http_client is not None:
+            await self.http_client.aclose()
+
+    def _prepare_request(
+        self,
+        question: str,
+        tools: Optional[List[str | Dict[str, Any]]] = None,
+        additional_context: Optional[str] = None,
+        code: bool = False,
+        image_path: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        Builds the keyword arguments for a chat completions call.
+        Takes the same inputs as completion().
+        - Returns (dict): Messages, model, and tool settings if there are tools.
+        """
+        messages = self._build_messages(question, additional_context, code)
+
+        # compiled once per tool by the registry, not rebuilt on every call
+        prepared_tools = self.tools.schemas(tools) if tools else []
 
+        if (
+            self.model
+            in {AvailableGroqModels.VISION, AvailableGroqModels.TOOL_USE_LARGE}
+            and image_path
+        ):
+            # sniffed, scaled down and cached, so asking about it again is cheap
+            image = image_encoder.encode(image_path)
+            messages.append(
+                {
+                    "role": "user",
+                    "content": {
+                        "type": "text",
+                        "text": question,
+                    },
+                    "attachments": [
+                        {
+                            "type": "image_url",
+                            "image_url": image.url,
+                        }
+                    ],
+                }
+            )
+
+        request = {"messages": messages, "model": self.model.value}
+        if tools:
+            request["tools"] = prepared_tools if prepared_tools else None
+            request["tool_choice"] = "auto" if prepared_tools else None
+
+        return request
+
+    def _read_answer(self, response: Any, key: Optional[str] = None) -> Optional[str]:
+        """
+        Pulls the answer text out of a chat completion and caches it, unless a
+        fallback model wrote it (see RequestScheduler), since the key is this model's.
+        - response (Any): The chat completion.
+        - key (str, optional): Answer cache key, or None to skip caching.
+        - Returns (str | None): The answer, or None if there isn't one.
+        """
+        if response.choices and response.choices[0].message:
+            answer = (response.choices[0].message.content or "").strip()
+            if key and answer and self._answered_here(response):
+                self.answer_cache.set(key, answer)
+            return answer
+        return None
+
+    def _answered_here(self, response: Any) -> bool:
+        """
+        - response (Any): A chat completion or stream chunk.
+        - Returns (bool): Whether this model answered, and not a fallback.
+        """
+        return getattr(response, "model", None) in (None, self.model.value)
+
+    def _build_messages(
+        self,
+        question: str,
+        additional_context: Optional[str] = None,
+        code: bool = False,
+    ) -> List[Dict[str, Any]]:
+        """
+        Builds the chat messages for a plain text request. Recent turns, and older
+        ones that look relevant, go in ahead of the question (see ContextBuilder).
+        - question (str): The user's input question or prompt.
+        - additional_context (str, optional): Goes in as the system prompt.
+        - code (bool): Prefill the reply with a code fence to get code only.
+        - Returns (List[dict]): Messages ready for the chat completions API.
+        """
+        messages = self.context.build(
+            self.history, question, self.model.value, additional_context
+        )
+        messages.append({"role": "user", "content": question})
+
+        if additional_context:
+            messages.insert(0, {"role": "system", "content": additional_context})
+
+        if code:
+            messages.append(
+                {"role": "assistant", "content": "```"}
+            )  # Gonna use prompt prefilling to force the model to spit out code output only
+
+        return messages
+
+    def stream_completion(
+        self,
+        question: str,
+        additional_context: Optional[str] = None,
+        code: bool = False,
+    ) -> Iterator[str]:
+        """
+        Same as completion() for plain text requests, but yields the answer in pieces
+        as Groq streams it back. The full answer still lands in the answer cache.
+        A cache hit comes back as one single piece.
+        The stream goes through the scheduler, so it gets rate limiting, retries and
+        fallback until it starts. Streams can't be shared, so identical ones in
+        flight don't get coalesced.
+
+        - question (str): The user's input question or prompt.
+        - additional_context (str, optional): Additional context for the model.
+        - code (bool): Prefill the reply with a code fence to get code only.
+        - Yields (str): Text deltas, in order.
+        """
+        if isinstance(self.client, AsyncGroq):
+            raise RuntimeError(
+                "model - stream_completion() needs a sync client, use aask() when asynchronous=True"
+            )
+
+        key = self._answer_key(question, additional_context, code)
+        if self.mode is not ModelMode.ONLINE:
+            cached = self.answer_cache.get(key)
+            if cached:
+                yield cached["answer"]
+                return
+
+        parts = []
+        started = time.perf_counter()
+        generation = self._generation
+        stream = None
+        fallback = False
+        try:
+            stream = self.scheduler.create(
+                messages=self._build_messages(question, additional_context, code),
+                model=self.model.value,
+                stream=True,
+            )
+
+            for chunk in stream:
+                if self._generation != generation:
+                    return  # cancelled, don't cache half an answer
+
+                if not chunk.choices:
+                    continue
+
+                fallback = fallback or not self._answered_here(chunk)
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if not parts:
+                        telemetry.observe(
+                            "groq.first_token",
+                            time.perf_counter() - started,
+                            model=self.model.value,
+                        )
+                    parts.append(delta)
+                    yield delta
+
+        except BadRequestError as e:
+            telemetry.debug("model", "Invalid request: %s", e)
+            return
+        except APIError as e:
+            telemetry.debug("model", "API error occurred: %s", e)
+            return
+        finally:
+            if stream is not None:
+                stream.close()  # stops the download if we bailed out early
+
+        answer = "".join(parts).strip()
+        if answer and not fallback:
+            self.answer_cache.set(key, answer)
+
+    def _answer_key(
+        self,
+        question: str,
+        additional_context: Optional[str] = None,
+        code: bool = False,
+    ) -> str:
+        """
+        Builds the answer cache key for a question asked of this model: the
+        normalized question, the model and the system prompt. Follow-ups ("and
+        tomorrow?") also get the exchange before them in the key, so they only hit
+        answers given after the same exchange. Cheap, nothing gets built for it.
+        - question (str): The user's question.
+        - additional_context (str, optional): System prompt sent along with it.
+        - code (bool): Whether the answer was forced into code-only output.
+        - Returns (str): The cache key.
+        """
+        extra = {}
+        if is_follow_up(question):
+            digest = context_digest(previous_exchange(self.history))
+            if digest:
+                extra["context"] = digest
+
+        return cache_key(
+            question,
+            model=self.model.value,
+            additional_context=additional_context,
+            code=code,
+            **extra,
+        )
+
+    def _reply(self, response: str, outcome: str, started: float) -> str:
+        """
+        Records the assistant's turn, saves history and updates the mode stats.
+        - response (str): What the assistant says back.
+        - outcome (str): "hit", "miss" or "generated", for the stats.
+        - started (float): perf_counter() value from when the request came in.
+        - Returns (str): The response, so callers can return this directly.
+        """
+        self.history.conversation_history.append(
+            {"role": "assistant", "content": response}
+        )
+        self.history.save()
+
+        self.stats.record(self.mode, outcome, time.perf_counter() - started)
+        return response
+
+    def lookup(self, text: str) -> Optional[str]:
+        """
+        Looks for an answer we already have. Answer cache first, then history, then
+        past questions that mean the same thing (see SemanticIndex).
+        - text (str): The user's question.
+        - Returns (str | None): The stored answer, or None if nothing matched.
+        """
+        cached = self.answer_cache.get(self._answer_key(text))
+        if cached:
+            return cached["answer"]
+
+        found_in_history = self.history.search_by_text(text)
+
+        if found_in_history:
+            telemetry.debug(
+                "model",
+                "found similar requests: %s",
+                ", ".join(str(entry.get("request")) for entry in found_in_history),
+            )
+
+            found_question = found_in_history[0].get("request")
+            found_answer = found_in_history[0].get("answer")
+
+            if found_question and found_answer:
+                return found_answer
+
+        # search confirms after picking the closest k, so the runners-up are what's
+        # left when the closest one has different numbers or names in it
+        for score, entry in self.semantic.search(
+            text, k=3, cutoff=self.semantic_cutoff
+        ):
+            if entry.get("answer"):
+                telemetry.debug(
+                    "model", "found a paraphrase (%.2f): %s", score, entry["request"]
+                )
+                return entry["answer"]
+
+        return None
+
+    def _route(self, text: str, started: float) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Does everything ask() does short of generating: rotation, confirmation state,
+        and the mode-specific lookups.
+        - text (str): The user's input.
+        - started (float): perf_counter() value from when the request came in.
+        - Returns (Tuple[str | None, str | None]): Either a finished reply, or the
+          question that still needs generating.
+        """
         if (
             self.history.updated_at
             and datetime.now() - self.history.updated_at
@@ -279,69 +940,167 @@ class Model:
         text = text.strip()
 
         if self.model_awaiting_confirmation:
+            question = self.model_pending_question or text
+            self.model_awaiting_confirmation = False
+            self.model_pending_question = None
+
             if any(
                 deny_word in text.strip().lower().split()
                 for deny_word in self.model_deny_words
             ):
-                response = "Okay."
-                self.history.conversation_history.append(
-                    {"role": "assistant", "content": response}
+                return self._reply("Okay.", "miss", started), None
+
+            # TODO: I need a way to tell the model whether or not I want to use tools, or look at an image
+            return None, question
+
+        self.history.conversation_history.append({"role": "user", "content": text})
+
+        if self.mode is not ModelMode.ONLINE:
+            found_answer = self.lookup(text)
+            if found_answer:
+                return self._reply(found_answer, "hit", started), None
+
+            if self.mode is ModelMode.OFFLINE:
+                return (
+                    self._reply(random.choice(OFFLINE_PROMPTS), "miss", started),
+                    None,
                 )
 
-                self.history.save()
-                self.model_awaiting_confirmation = False
-                return response
-            else:
-                response = self.completion(text)
-                # TODO: I need a way to tell the model whether or not I want to use tools, or look at an image
+            if self.confirm_generation:
+                # otherwise, we haven't found the question or answer
+                self.model_awaiting_confirmation = True
+                self.model_pending_question = text
+                return (
+                    self._reply(random.choice(CONFIRMATION_PROMPTS), "miss", started),
+                    None,
+                )
 
-                if response:
-                    self.history.conversation_history.append(
-                        {"role": "assistant", "content": response}
-                    )
+        return None, text
 
-                    self.history.save()
-                    self.model_awaiting_confirmation = False
+    def ask(self, text: str = None) -> str:
+        """
+        Handles user input, checks history for similar requests, and generates responses.
+        What happens depends on the mode:
 
-                    return response
+        - ONLINE: Skips every lookup and generates right away.
+        - DATA: Serves from the answer cache or history, generates on a miss. Asks
+          before generating first if confirm_generation is set.
+        - OFFLINE: Serves from the answer cache or history, never generates.
 
-        self.history.conversation_history.append({"role": "user", "content": text})
+        - text (str): The user's input question or prompt.
 
-        found_in_history = self.history.search_by_text(text)
+        What it does:
+        - If the history interval has passed, clears and starts a new history.
+        - If awaiting confirmation, checks for deny words or generates a response.
+        - Routes the request according to the mode, and tracks hits/misses/latency.
+        """
+        assert text is not None, "Model.ask() was called without input."
 
-        if found_in_history:
+        started = time.perf_counter()
+        reply, question = self._route(text, started)
+        if reply is not None:
+            return reply
 
-            print(f"model - found similar requests: {", ".join(found_in_history)}")
+        response = self.completion(question)
+        if not response:
+            return self._reply(random.choice(FAILURE_PROMPTS), "miss", started)
 
-            found_question = found_in_history[0].get("request")
-            found_answer = found_in_history[0].get("answer")
+        self.semantic.add(question, response)
+        return self._reply(response, "generated", started)
 
-            if found_question and found_answer:
-                self.history.conversation_history.append(
-                    {"role": "assistant", "content": found_answer}
-                )
-                self.history.save()
-                return found_answer
+    def ask_stream(self, text: str = None) -> Iterator[str]:
+        """
+        Streaming version of ask(). Canned replies and cache hits come back as one
+        piece, generated answers come back as they're produced. History and stats
+        get updated once the answer is complete. If cancel() gets called meanwhile,
+        it stops early and nothing about the answer gets recorded.
 
-        # otherwise, we haven't found the question or answer
-        response = random.choice(
-            [
-                "I’m not sure about that one. Want me to generate an answer?",
-                "I don’t know yet... should I look it up for you?",
-                "Hmm, I don’t have that info right now. Want me to figure it out?",
-                "I’m not sure off the top of my head. Should I try generating an answer?",
-                "Good question! I don’t know yet—want me to dive in and generate something?",
-                "I don’t have the answer handy. Should I find or generate it for you?",
-                "I’m blanking on this one... want me to take a shot at generating an answer?",
-                "Not sure yet. Should I look into it and generate a response?",
-            ]
-        )
+        - text (str): The user's input question or prompt.
+        - Yields (str): The reply, in pieces.
+        """
+        assert text is not None, "Model.ask_stream() was called without input."
 
-        self.history.conversation_history.append(
-            {"role": "assistant", "content": response}
+        started = time.perf_counter()
+        reply, question = self._route(text, started)
+        if reply is not None:
+            yield reply
+            return
+
+        generation = self._generation
+        parts = []
+        deltas = self.stream_completion(question)
+        for delta in deltas:
+            if self._generation != generation:
+                deltas.close()
+                return
+
+            parts.append(delta)
+            yield delta
+
+        if self._generation != generation:
+            return
+
+        response = "".join(parts).strip()
+        if not response:
+            failure = random.choice(FAILURE_PROMPTS)
+            self._reply(failure, "miss", started)
+            yield failure
+            return
+
+        self.semantic.add(question, response)
+        self._reply(response, "generated", started)
+
+    def _locked(self, function, *args) -> Any:
+        """
+        Runs a function while holding the state lock, for aask()'s worker threads.
+        """
+        with self._state_lock:
+            return function(*args)
+
+    def close_history(self) -> None:
+        """
+        Closes the history, once aask()'s worker threads are done writing to it.
+        """
+        with self._state_lock:
+            self.history.close()
+
+    def _generated(self, question: str, response: str, started: float) -> str:
+        """
+        Remembers a freshly generated answer and records it.
+        """
+        self.semantic.add(question, response)
+        return self._reply(response, "generated", started)
+
+    async def aask(self, text: str = None) -> str:
+        """
+        Async version of ask(). Needs asynchronous=True. Lookups and history updates
+        are the same, but they run on a worker thread (one at a time per model) so
+        history search and saving don't stall the event loop. If the request gets
+        cancelled while generating (see cancel()), the answer isn't recorded and
+        CancelledError propagates.
+
+        - text (str): The user's input question or prompt.
+        - Returns (str): The reply.
+        """
+        assert text is not None, "Model.aask() was called without input."
+
+        started = time.perf_counter()
+        reply, question = await asyncio.to_thread(
+            self._locked, self._route, text, started
         )
+        if reply is not None:
+            return reply
 
-        self.history.save()
+        response = await self.acompletion(question)
+        if not response:
+            return await asyncio.to_thread(
+                self._locked,
+                self._reply,
+                random.choice(FAILURE_PROMPTS),
+                "miss",
+                started,
+            )
 
-        self.model_awaiting_confirmation = True
-        return response
+        return await asyncio.to_thread(
+            self._locked, self._generated, question, response, started
+        )
@@ -0,0 +1,787 @@
+"""
+Benchmarks for the hot paths: history loading, saving and searching, markdown
+formatting, the audio callback, Vosk recognition, and the whole ask -> speak loop
+against a mocked Groq API. Everything runs on synthetic data made from a fixed seed,
+so numbers from two commits can be compared directly. Results come out as JSON.
+
+Usage:
+    python src/bench.py --output before.json
+    python src/bench.py --output after.json --compare before.json
+    python src/bench.py --only history --sizes 100000,1000000
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import httpx
+import numpy
+from groq import Groq
+
+from base import Model, ModelMode
+from cache import MemoryAnswerCache
+from coalesce import SingleFlight
+from history import CompletionHistory
+from semantic import SemanticIndex
+from telemetry import telemetry
+from text import Formatter, SentenceSplitter, to_speech_text
+
+
+_THINGS = (
+    "the moon",
+    "a sourdough starter",
+    "python generators",
+    "the french revolution",
+    "solar panels",
+    "a vosk model",
+    "redis",
+    "black holes",
+    "my bike chain",
+    "the stock market",
+    "tomato plants",
+    "a mechanical keyboard",
+    "jazz chords",
+    "the linux kernel",
+    "coffee beans",
+    "a marathon",
+    "the printing press",
+    "electric cars",
+    "honey bees",
+    "a json parser",
+    "the roman empire",
+    "wifi",
+)
+_VERBS = (
+    "fix",
+    "explain",
+    "clean",
+    "compare",
+    "speed up",
+    "learn",
+    "plant",
+    "store",
+    "measure",
+    "build",
+    "replace",
+    "debug",
+    "cook",
+    "train for",
+    "back up",
+)
+_QUESTIONS = (
+    "what is {thing}",
+    "how do I {verb} {thing}",
+    "can you {verb} {thing} for me",
+    "why does {thing} matter",
+    "tell me something about {thing}",
+    "what's the best way to {verb} {thing}",
+    "how long does it take to {verb} {thing}",
+    "is it hard to {verb} {thing}",
+)
+_SENTENCES = (
+    "It mostly comes down to {thing}, and that's easier than it sounds.",
+    "Start small: {verb} one part first, then the rest.",
+    "Most people overthink {thing}.",
+    "The short answer is yes, but {thing} has a few catches.",
+    "You'll want about {n} minutes for it.",
+    "If you {verb} it every {n} days, it holds up fine.",
+)
+
+
+def _phrase(rng: random.Random, template: str) -> str:
+    return template.format(
+        thing=rng.choice(_THINGS), verb=rng.choice(_VERBS), n=rng.randint(2, 90)
+    )
+
+
+def history_corpus(turns: int, seed: int = 0) -> List[dict]:
+    """
+    Makes up a conversation history, in the request/answer format the search indexes.
+    - turns (int): How many question -> answer turns.
+    - seed (int): Same seed, same corpus.
+    - Returns (List[dict]): The entries, oldest first.
+    """
+    rng = random.Random(seed)
+    started = datetime(2024, 1, 1)
+
+    return [
+        {
+            "request": f"{_phrase(rng, rng.choice(_QUESTIONS))} {turn}",
+            "answer": " ".join(
+                _phrase(rng, rng.choice(_SENTENCES)) for _ in range(rng.randint(1, 3))
+            ),
+            "timestamp": (started + timedelta(seconds=turn * 30)).isoformat(),
+        }
+        for turn in range(turns)
+    ]
+
+
+def markdown_corpus(count: int, seed: int = 0) -> List[str]:
+    """
+    Makes up LLM-style markdown answers: headers, emphasis, lists, links, inline code
+    and fenced code blocks, in varying amounts.
+    - count (int): How many answers.
+    - seed (int): Same seed, same corpus.
+    - Returns (List[str]): The answers. They're all different, so no cache helps.
+    """
+    rng = random.Random(seed)
+    answers = []
+
+    for number in range(count):
+        blocks = [f"## {_phrase(rng, rng.choice(_QUESTIONS)).capitalize()} ({number})"]
+        for _ in range(rng.randint(1, 4)):
+            kind = rng.random()
+            if kind < 0.4:
+                sentence = _phrase(rng, rng.choice(_SENTENCES))
+                blocks.append(
+                    f"{sentence} **{rng.choice(_THINGS)}** is *usually* fine, "
+                    f"see [the docs](https://example.com/{number}) or run `{rng.choice(_VERBS)}`."
+                )
+            elif kind < 0.7:
+                blocks.append(
+                    "\n".join(
+                        f"{i + 1}. {_phrase(rng, rng.choice(_SENTENCES))}"
+                        for i in range(rng.randint(2, 5))
+                    )
+                )
+            elif kind < 0.85:
+                blocks.append(
+                    "\n".join(
+                        f"- _{rng.choice(_THINGS)}_: {_phrase(rng, rng.choice(_SENTENCES))}"
+                        for _ in range(rng.randint(2, 4))
+                    )
+                )
+            else:
+                blocks.append(
+                    f"```python\ndef step_{number}():\n    return {rng.randint(0, 99)}\n```"
+                )
+        answers.append("\n\n".join(blocks))
+
+    return answers
+
+
+def pcm_fixture(seconds: float, sample_rate: int = 16000, seed: int = 0) -> bytes:
+    """
+    Makes up microphone audio: room noise with bursts of voice-like sound (a few
+    harmonics of a wobbling pitch, with a syllable-rate envelope) in between.
+    - seconds (float): How long.
+    - sample_rate (int): Samples per second.
+    - seed (int): Same seed, same audio.
+    - Returns (bytes): 16-bit mono PCM.
+    """
+    rng = numpy.random.default_rng(seed)
+    length = int(seconds * sample_rate)
+    t = numpy.arange(length) / sample_rate
+
+    audio = rng.normal(0, 60, length)  # about -55 dBFS of noise
+
+    position = int(rng.uniform(0.5, 1.5) * sample_rate)
+    while position < length:
+        burst = min(int(rng.uniform(0.8, 2.5) * sample_rate), length - position)
+        span = t[position : position + burst]
+        pitch = rng.uniform(100, 220) * (1 + 0.05 * numpy.sin(2 * numpy.pi * 3 * span))
+        phase = 2 * numpy.pi * numpy.cumsum(pitch) / sample_rate
+        voice = sum(numpy.sin(phase * k) / k for k in range(1, 6))
+        envelope = 0.5 + 0.5 * numpy.sin(2 * numpy.pi * 4 * span) ** 2
+        audio[position : position + burst] += 6000 * voice * envelope
+
+        position += burst + int(rng.uniform(0.8, 2.0) * sample_rate)
+
+    return numpy.clip(audio, -32768, 32767).astype(numpy.int16).tobytes()
+
+
+def write_history(
+    directory: str, entries: List[dict], journal: bool, per_file: int
+) -> None:
+    """
+    Writes a corpus out the way CompletionHistory would have, split over several files.
+    - directory (str): History directory. Gets created.
+    - entries (List[dict]): The corpus.
+    - journal (bool): JSONL journals instead of JSON arrays.
+    - per_file (int): Entries per file.
+    """
+    os.makedirs(directory, exist_ok=True)
+    started = datetime(2024, 1, 1)
+
+    for number, start in enumerate(range(0, len(entries), per_file)):
+        stamp = (started + timedelta(hours=number)).strftime("%Y%m%d_%H%M%S")
+        chunk = entries[start : start + per_file]
+        with open(
+            os.path.join(directory, f"c_{stamp}{'.jsonl' if journal else '.json'}"),
+            "w",
+            encoding="UTF-8",
+        ) as f:
+            if journal:
+                f.writelines(json.dumps(entry) + "\n" for entry in chunk)
+            else:
+                json.dump(chunk, f, indent=4)
+
+    # recent enough that saving doesn't rotate to a new file
+    with open(os.path.join(directory, "h.timestamp"), "w", encoding="UTF-8") as f:
+        f.write(datetime.now().isoformat())
+
+
+def write_wave(path: str, pcm: bytes, sample_rate: int = 16000) -> None:
+    """
+    Saves a PCM fixture as a WAV file, e.g. for transcribe.py.
+    """
+    with wave.open(path, "wb") as wave_file:
+        wave_file.setnchannels(1)
+        wave_file.setsampwidth(2)
+        wave_file.setframerate(sample_rate)
+        wave_file.writeframes(pcm)
+
+
+def summarize(seconds: Iterable[float]) -> Dict[str, float]:
+    """
+    - seconds (Iterable[float]): Timings.
+    - Returns (dict): n, min, mean, p50, p95 and max, in ms. All zeros without timings.
+    """
+    ms = numpy.sort(numpy.fromiter(seconds, dtype=numpy.float64)) * 1000
+    if not len(ms):
+        return {"n": 0, "min": 0.0, "mean": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+
+    return {
+        "n": len(ms),
+        "min": float(ms[0]),
+        "mean": float(ms.mean()),
+        "p50": float(numpy.percentile(ms, 50)),
+        "p95": float(numpy.percentile(ms, 95)),
+        "max": float(ms[-1]),
+    }
+
+
+def measure(
+    function: Callable[[], Any],
+    repeat: int = 5,
+    warmup: int = 1,
+    setup: Optional[Callable[[], Any]] = None,
+) -> Dict[str, float]:
+    """
+    Times a function a few times over, with garbage collection out of the way.
+    - function (Callable): What to time.
+    - repeat (int): Timed runs.
+    - warmup (int): Untimed runs first.
+    - setup (Callable, optional): Runs before every run, untimed.
+    - Returns (dict): See summarize().
+    """
+    for _ in range(warmup):
+        if setup:
+            setup()
+        function()
+
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        gc.collect()
+        gc.disable()
+        try:
+            started = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - started)
+        finally:
+            gc.enable()
+    return summarize(timings)
+
+
+class Results:
+    """
+    Collects benchmark results and prints them as they come in.
+    """
+
+    def __init__(self) -> None:
+        self.results: List[dict] = []
+
+    def add(
+        self, name: str, params: Dict[str, Any], ms: Dict[str, float], **extra
+    ) -> None:
+        self.results.append({"name": name, "params": params, "ms": ms, **extra})
+        shown = " ".join(f"{key}={value}" for key, value in params.items())
+        print(
+            f"bench - {name:<32} {shown:<32} p50 {ms['p50']:10.3f}ms  p95 {ms['p95']:10.3f}ms",
+            file=sys.stderr,
+        )
+
+
+def bench_history(
+    results: Results, turns: int, directory: str, repeat: int, seed: int
+) -> None:
+    """
+    CompletionHistory at a given size: loading (JSON arrays, JSONL journals, lazy),
+    the first search (which builds the index), warm searches that hit and miss, and
+    saving a new turn in both formats.
+    """
+    entries = history_corpus(turns, seed)
+    rng = random.Random(seed)
+    hit = entries[rng.randrange(turns)]["request"].replace("the", "teh", 1)
+    miss = "quantum origami for hamsters"
+
+    arrays = os.path.join(directory, f"arrays_{turns}")
+    journals = os.path.join(directory, f"journals_{turns}")
+    write_history(arrays, entries, journal=False, per_file=1000)
+    write_history(journals, entries, journal=True, per_file=1000)
+    del entries
+
+    loads = {
+        "json": lambda: CompletionHistory(debug=False, history_directory=arrays),
+        "jsonl": lambda: CompletionHistory(
+            debug=False, history_directory=journals, journal=True
+        ),
+        "lazy": lambda: CompletionHistory(
+            debug=False, history_directory=journals, journal=True, lazy_load=True
+        ),
+    }
+    for kind, load in loads.items():
+        results.add(
+            "history.load_recent_conversations",
+            {"turns": turns, "format": kind},
+            measure(load, repeat=repeat, warmup=0),
+        )
+
+    for kind, load in loads.items():
+        if kind == "json":
+            continue
+
+        history = load()
+        results.add(
+            "history.search_by_text.first",
+            {"turns": turns, "format": kind},
+            measure(lambda: history.search_by_text(hit), repeat=1, warmup=0),
+        )
+        for query, text in (("hit", hit), ("miss", miss)):
+            results.add(
+                "history.search_by_text",
+                {"turns": turns, "format": kind, "query": query},
+                measure(lambda: history.search_by_text(text), repeat=repeat),
+            )
+        history.close()
+
+    for kind, history in (
+        ("json", CompletionHistory(debug=False, history_directory=arrays)),
+        ("jsonl", loads["jsonl"]()),
+    ):
+
+        def append() -> None:
+            history.conversation_history.append(
+                {"request": "one more question", "answer": "one more answer"}
+            )
+
+        results.add(
+            "history.save",
+            {"turns": turns, "format": kind},
+            measure(history.save, repeat=repeat, setup=append),
+        )
+        history.close()
+
+
+def bench_formatter(results: Results, answers: List[str], repeat: int) -> None:
+    """
+    Formatter.format over the markdown corpus, cold (nothing cached) and warm (every
+    answer seen before, like a repeated reply).
+    """
+
+    def format_all() -> None:
+        for answer in answers:
+            Formatter(answer).format()
+
+    params = {"answers": len(answers)}
+    results.add(
+        "text.format.cold",
+        params,
+        measure(format_all, repeat=repeat, warmup=0, setup=to_speech_text.cache_clear),
+    )
+    results.add("text.format.warm", params, measure(format_all, repeat=repeat))
+
+
+def bench_audio_callback(
+    results: Results, pcm: bytes, model_path: str, block_frames: int
+) -> None:
+    """
+    SpeechInputManager.audio_callback, one call per block of the PCM fixture, as
+    PortAudio would call it. Per-block timings, since the worst block is what drops audio.
+    """
+    try:
+        # needs PortAudio, only import it when used
+        from speech import SpeechInputManager
+    except OSError as e:
+        print(f"bench - no PortAudio ({e}), skipping the callback", file=sys.stderr)
+        return
+
+    synth = SpeechInputManager(model=model_path)
+    block = block_frames * 2
+    blocks = [pcm[i : i + block] for i in range(0, len(pcm) - block + 1, block)]
+
+    for data in blocks[:50]:  # let the noise floor settle
+        synth.audio_callback(data)
+
+    timings = []
+    gc.disable()
+    try:
+        for data in blocks:
+            started = time.perf_counter()
+            synth.audio_callback(data)
+            timings.append(time.perf_counter() - started)
+    finally:
+        gc.enable()
+
+    results.add(
+        "speech.audio_callback",
+        {"blocks": len(blocks), "block_frames": block_frames},
+        summarize(timings),
+        queued=synth.audio_queue.qsize(),
+    )
+    synth.dispatcher.stop()
+
+
+def bench_recognition(
+    results: Results, pcm: bytes, model_path: str, sample_rate: int
+) -> None:
+    """
+    Vosk AcceptWaveform over the PCM fixture in 0.1s chunks. Needs a real Vosk model.
+    """
+    import vosk
+
+    from startup import vosk_models
+
+    vosk.SetLogLevel(-1)
+    recognizer = vosk_models.recognizer(model_path, sample_rate)
+    chunk = int(sample_rate * 0.1) * 2
+    chunks = [pcm[i : i + chunk] for i in range(0, len(pcm), chunk)]
+
+    timings = []
+    for data in chunks:
+        started = time.perf_counter()
+        recognizer.AcceptWaveform(data)
+        timings.append(time.perf_counter() - started)
+    recognizer.FinalResult()
+
+    audio_seconds = len(pcm) / 2 / sample_rate
+    results.add(
+        "vosk.accept_waveform",
+        {"chunks": len(chunks), "chunk_seconds": 0.1},
+        summarize(timings),
+        real_time_factor=sum(timings) / audio_seconds,
+    )
+
+
+def mock_groq(
+    answers: List[str], latency: float = 0.0, chunk_delay: float = 0.0
+) -> Groq:
+    """
+    A real Groq client whose HTTP transport answers locally, so the whole SDK path
+    (request building, parsing, streaming) runs, minus the network.
+    - answers (List[str]): Replies to hand out, in turn.
+    - latency (float): Seconds before the first byte of every response.
+    - chunk_delay (float): Seconds between streamed chunks.
+    - Returns (Groq): The client.
+    """
+    served = [0]
+
+    def completion(content: str, model: str) -> dict:
+        return {
+            "id": f"bench-{served[0]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+
+    def stream(content: str, model: str) -> Iterable[bytes]:
+        words = content.split(" ")
+        for start in range(0, len(words), 4):
+            if start and chunk_delay:
+                time.sleep(chunk_delay)
+            piece = " ".join(words[start : start + 4]) + " "
+            chunk = {
+                "id": f"bench-{served[0]}",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {"index": 0, "delta": {"content": piece}, "finish_reason": None}
+                ],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n".encode("UTF-8")
+        yield b"data: [DONE]\n\n"
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        content = answers[served[0] % len(answers)]
+        served[0] += 1
+
+        if latency:
+            time.sleep(latency)
+        if body.get("stream"):
+            return httpx.Response(
+                200,
+                headers={"content-type": "text/event-stream"},
+                content=stream(content, body["model"]),
+            )
+        return httpx.Response(200, json=completion(content, body["model"]))
+
+    return Groq(
+        api_key="bench",
+        base_url="http://groq.bench",
+        http_client=httpx.Client(transport=httpx.MockTransport(handler)),
+        max_retries=0,
+    )
+
+
+class StubSynthesizer:
+    """
+    Stands in for SpeechInputManager's speaking side: splits and formats streamed
+    text exactly like synthesize_stream() does, but "renders" silence of about the
+    right length instead of running festival, and never plays anything.
+    """
+
+    def __init__(
+        self, sample_rate: int = 16000, chars_per_second: float = 15.0
+    ) -> None:
+        self.sample_rate = sample_rate
+        self.chars_per_second = chars_per_second
+        self.first_audio: Optional[float] = None
+
+    def _render(self, sentence: str) -> None:
+        text = Formatter(sentence).format()
+        frames = int(len(text) / self.chars_per_second * self.sample_rate)
+        numpy.zeros((frames, 1), dtype=numpy.int16)
+        if self.first_audio is None:
+            self.first_audio = time.perf_counter()
+
+    def synthesize_stream(self, chunks: Iterable[str]) -> None:
+        self.first_audio = None
+        splitter = SentenceSplitter()
+
+        for chunk in chunks:
+            for sentence in splitter.feed(chunk):
+                self._render(sentence)
+
+        rest = splitter.flush()
+        if rest:
+            self._render(rest)
+
+
+def bench_loop(
+    results: Results,
+    answers: List[str],
+    questions: int,
+    directory: str,
+    latency: float,
+    chunk_delay: float,
+    seed: int,
+) -> None:
+    """
+    The full ask -> speak loop from main.py: Model.ask_stream() into the stub
+    synthesizer, against the mocked Groq API, plus plain Model.ask(). Every question
+    is new, so every one goes out to "Groq". Also reports the telemetry stages.
+    """
+    rng = random.Random(seed)
+    asked = [
+        f"{_phrase(rng, rng.choice(_QUESTIONS))} number {n}" for n in range(questions)
+    ]
+
+    model = Model(
+        history=CompletionHistory(
+            debug=False, history_directory=os.path.join(directory, "loop"), journal=True
+        ),
+        client=mock_groq(answers, latency, chunk_delay),
+        answer_cache=MemoryAnswerCache(),
+        mode=ModelMode.ONLINE,
+        semantic_index=SemanticIndex(None),
+        flights=SingleFlight(),
+    )
+    synth = StubSynthesizer()
+    telemetry.histograms.clear()
+
+    first_audio, spoken = [], []
+    for question in asked:
+        started = time.perf_counter()
+        synth.synthesize_stream(model.ask_stream(text=question))
+        spoken.append(time.perf_counter() - started)
+        first_audio.append(synth.first_audio - started)
+
+    params = {"questions": questions, "latency": latency, "chunk_delay": chunk_delay}
+    results.add("loop.ask_stream.first_audio", params, summarize(first_audio))
+    results.add(
+        "loop.ask_stream.total", params, summarize(spoken), stages=telemetry.summary()
+    )
+
+    if questions > 1:  # one question goes to the warmup run
+        answered = iter([f"{question} again" for question in asked])
+        results.add(
+            "loop.ask",
+            params,
+            measure(lambda: model.ask(text=next(answered)), repeat=questions - 1),
+        )
+    model.history.close()
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline: dict, current: dict) -> None:
+    """
+    Prints the p50 change of every benchmark both runs have.
+    - baseline (dict): Results loaded from an earlier run.
+    - current (dict): Results from this run.
+    """
+
+    def keyed(run: dict) -> Dict[str, dict]:
+        return {
+            f"{result['name']} {json.dumps(result['params'], sort_keys=True)}": result
+            for result in run["results"]
+        }
+
+    before = keyed(baseline)
+    print(
+        f"bench - compared against {baseline['meta'].get('commit')} (p50)",
+        file=sys.stderr,
+    )
+    for key, result in keyed(current).items():
+        if key not in before:
+            continue
+
+        old, new = before[key]["ms"]["p50"], result["ms"]["p50"]
+        change = (new - old) / old * 100 if old else 0.0
+        print(
+            f"bench - {key:<72} {old:10.3f}ms -> {new:10.3f}ms ({change:+.1f}%)",
+            file=sys.stderr,
+        )
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the assistant's hot paths.")
+    parser.add_argument(
+        "--sizes",
+        default="1000,10000",
+        help="history sizes in turns, comma separated (100000 and 1000000 work, slowly)",
+    )
+    parser.add_argument(
+        "--only",
+        default="history,format,callback,recognition,loop",
+        help="which benchmarks to run, comma separated",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--answers", type=int, default=200, help="markdown answers")
+    parser.add_argument("--audio-seconds", type=float, default=60.0)
+    parser.add_argument("--block-frames", type=int, default=512)
+    parser.add_argument("--sample-rate", type=int, default=16000)
+    parser.add_argument(
+        "--model",
+        default=os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "models", "model"
+        ),
+        help="Vosk model path",
+    )
+    parser.add_argument("--questions", type=int, default=20, help="ask -> speak rounds")
+    parser.add_argument("--groq-latency", type=float, default=0.0)
+    parser.add_argument("--groq-chunk-delay", type=float, default=0.0)
+    parser.add_argument("--fixtures", default=None, help="also save the fixtures here")
+    parser.add_argument("--output", default=None, help="JSON file (default stdout)")
+    parser.add_argument("--compare", default=None, help="earlier results to compare to")
+    args = parser.parse_args(argv)
+
+    only = set(args.only.split(","))
+    telemetry.verbose = False
+
+    results = Results()
+    answers = markdown_corpus(args.answers, args.seed)
+    pcm = pcm_fixture(args.audio_seconds, args.sample_rate, args.seed)
+    # the repo only ships the small files of the model, the acoustic model is the tell
+    has_vosk_model = os.path.isfile(os.path.join(args.model, "am", "final.mdl"))
+
+    with tempfile.TemporaryDirectory(prefix="bench_") as directory:
+        if args.fixtures:
+            os.makedirs(args.fixtures, exist_ok=True)
+            write_wave(os.path.join(args.fixtures, "speech.wav"), pcm, args.sample_rate)
+            with open(
+                os.path.join(args.fixtures, "answers.json"), "w", encoding="UTF-8"
+            ) as f:
+                json.dump(answers, f, indent=4)
+
+        if "history" in only:
+            for size in (int(size) for size in args.sizes.split(",")):
+                bench_history(results, size, directory, args.repeat, args.seed)
+
+        if "format" in only:
+            bench_formatter(results, answers, args.repeat)
+
+        if "callback" in only:
+            # the callback never touches the recognizer, any directory will do
+            model_path = args.model if has_vosk_model else directory
+            bench_audio_callback(results, pcm, model_path, args.block_frames)
+
+        if "recognition" in only:
+            if has_vosk_model:
+                bench_recognition(results, pcm, args.model, args.sample_rate)
+            else:
+                print(
+                    f"bench - no Vosk model at {args.model}, skipping recognition",
+                    file=sys.stderr,
+                )
+
+        if "loop" in only:
+            bench_loop(
+                results,
+                answers,
+                args.questions,
+                directory,
+                args.groq_latency,
+                args.groq_chunk_delay,
+                args.seed,
+            )
+
+    run = {
+        "meta": {
+            "commit": git_commit(),
+            "created": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": numpy.__version__,
+            "args": vars(args),
+        },
+        "results": results.results,
+    }
+
+    if args.output:
+        with open(args.output, "w", encoding="UTF-8") as f:
+            json.dump(run, f, indent=4)
+    else:
+        print(json.dumps(run, indent=4))
+
+    if args.compare:
+        with open(args.compare, "r", encoding="UTF-8") as f:
+            compare(json.load(f), run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,396 @@
+"""
+Caching for answers and synthesized audio. Same question twice? Don't pay for it twice.
+Answers come with an in-process LRU and a Redis backend that several assistant
+processes can share. Both keep a timestamp on every answer and expire them after a TTL.
+Audio gets a size-bounded LRU in memory, backed by wav files on disk.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import wave
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import redis
+
+from errors.redis import RedisErrors
+from telemetry import telemetry
+
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING = re.compile(r"[\s?!.]+$")
+
+
+def normalize_question(text: str) -> str:
+    """
+    Squashes a question down so trivial differences don't miss the cache.
+    Lowercases, collapses whitespace and drops trailing "?", "!" and ".".
+    Everything else stays, since "2+2" and "2-2" or "C++" and "C#" are different
+    questions.
+    - text (str): The question.
+    - Returns (str): The normalized question.
+    """
+    return _TRAILING.sub("", _WHITESPACE.sub(" ", text.lower())).strip()
+
+
+def cache_key(question: str, model: str = "", **context) -> str:
+    """
+    Builds a cache key from a normalized question, the model and any extra context
+    that changes the answer (system prompt, code mode, etc).
+    - question (str): The question.
+    - model (str): The model name the answer came from.
+    - Returns (str): A stable hex digest.
+    """
+    payload = json.dumps(
+        [normalize_question(question), model, context], sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode("UTF-8")).hexdigest()
+
+
+def context_digest(messages: List[Dict[str, str]]) -> str:
+    """
+    Fingerprints the turns a follow-up question leans on, so its answer ("and
+    tomorrow?") only gets reused after the same exchange.
+    - messages (List[dict]): The earlier messages, without the question itself.
+    - Returns (str): A short hex digest, or "" for no context at all.
+    """
+    if not messages:
+        return ""
+
+    payload = json.dumps(
+        [[message["role"], message["content"]] for message in messages]
+    )
+    return hashlib.sha256(payload.encode("UTF-8")).hexdigest()[:32]
+
+
+class AnswerCache(ABC):
+    """
+    Base class for answer caches. Entries look like:
+    {
+        "answer": str,
+        "timestamp": float,  # unix time it was cached
+    }
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[dict]:
+        """
+        Looks up a cached answer.
+        - key (str): Key from cache_key().
+        - Returns (dict | None): The entry, or None on a miss or if it expired.
+        """
+
+    @abstractmethod
+    def set(self, key: str, answer: str, ttl: Optional[float] = None) -> None:
+        """
+        Caches an answer.
+        - key (str): Key from cache_key().
+        - answer (str): The answer to cache.
+        - ttl (float, optional): Seconds to keep it. Falls back to the cache default.
+        """
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """
+        Drops one entry.
+        - key (str): Key from cache_key().
+        """
+
+    @abstractmethod
+    def clear(self) -> None:
+        """
+        Drops everything.
+        """
+
+
+class MemoryAnswerCache(AnswerCache):
+    """
+    In-process LRU cache. Fast, but every process gets its own copy.
+    """
+
+    def __init__(self, max_entries: int = 1024, default_ttl: Optional[float] = None):
+        """
+        Sets up an empty cache.
+        - max_entries (int): Least recently used answers get evicted past this.
+        - default_ttl (float, optional): Seconds to keep answers. None keeps them forever.
+        """
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            if entry["expires_at"] is not None and entry["expires_at"] <= time.time():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return {"answer": entry["answer"], "timestamp": entry["timestamp"]}
+
+    def set(self, key: str, answer: str, ttl: Optional[float] = None) -> None:
+        ttl = ttl if ttl is not None else self.default_ttl
+        now = time.time()
+
+        with self._lock:
+            self._entries[key] = {
+                "answer": answer,
+                "timestamp": now,
+                "expires_at": now + ttl if ttl is not None else None,
+            }
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisAnswerCache(AnswerCache):
+    """
+    Redis-backed cache, shared by every process pointed at the same instance.
+    Each answer is a hash with its own expiry. A sorted set of last-access times
+    keeps the number of answers capped by evicting the least recently used ones.
+    """
+
+    def __init__(
+        self,
+        url: str = "redis://localhost:6379/0",
+        namespace: str = "augment:answers",
+        max_entries: int = 10000,
+        default_ttl: Optional[float] = 7 * 24 * 60 * 60,
+        max_connections: int = 16,
+        client: Optional[redis.Redis] = None,
+    ) -> None:
+        """
+        Connects to Redis through a connection pool. Raises ConnectionError if it
+        can't reach the server (see scripts/redis.sh to spin one up).
+        - url (str): Redis URL.
+        - namespace (str): Prefix for every key this cache touches.
+        - max_entries (int): Least recently used answers get evicted past this.
+        - default_ttl (float, optional): Seconds to keep answers. None keeps them forever.
+        - max_connections (int): Size of the connection pool.
+        - client (redis.Redis, optional): Use this client instead (fakeredis, redislite, ...).
+        """
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+
+        self.client = client or redis.Redis(
+            connection_pool=redis.ConnectionPool.from_url(
+                url, max_connections=max_connections
+            )
+        )
+        self.lru_key = f"{self.namespace}:lru"
+
+        try:
+            self.client.ping()
+        except redis.exceptions.ConnectionError as e:
+            raise ConnectionError(RedisErrors.CONNECTION.value) from e
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def get(self, key: str) -> Optional[dict]:
+        try:
+            entry = self.client.hgetall(self._key(key))
+            if not entry:
+                # expired or evicted, don't leave it hanging around in the lru set
+                self.client.zrem(self.lru_key, key)
+                return None
+
+            self.client.zadd(self.lru_key, {key: time.time()})
+        except redis.exceptions.ConnectionError:
+            telemetry.debug("cache", RedisErrors.CONNECTION.value)
+            return None
+
+        return {
+            "answer": entry[b"answer"].decode("UTF-8"),
+            "timestamp": float(entry[b"timestamp"]),
+        }
+
+    def set(self, key: str, answer: str, ttl: Optional[float] = None) -> None:
+        ttl = ttl if ttl is not None else self.default_ttl
+        now = time.time()
+
+        try:
+            pipeline = self.client.pipeline()
+            pipeline.hset(self._key(key), mapping={"answer": answer, "timestamp": now})
+            if ttl is not None:
+                pipeline.expire(self._key(key), max(1, int(ttl)))
+            pipeline.zadd(self.lru_key, {key: now})
+            pipeline.zcard(self.lru_key)
+            size = pipeline.execute()[-1]
+
+            if size > self.max_entries:
+                evicted = self.client.zpopmin(self.lru_key, size - self.max_entries)
+                if evicted:
+                    self.client.delete(
+                        *(self._key(member.decode("UTF-8")) for member, _ in evicted)
+                    )
+        except redis.exceptions.ConnectionError:
+            telemetry.debug("cache", RedisErrors.CONNECTION.value)
+
+    def delete(self, key: str) -> None:
+        try:
+            self.client.delete(self._key(key))
+            self.client.zrem(self.lru_key, key)
+        except redis.exceptions.ConnectionError:
+            telemetry.debug("cache", RedisErrors.CONNECTION.value)
+
+    def clear(self) -> None:
+        try:
+            keys = list(self.client.scan_iter(match=f"{self.namespace}:*"))
+            if keys:
+                self.client.delete(*keys)
+        except redis.exceptions.ConnectionError:
+            telemetry.debug("cache", RedisErrors.CONNECTION.value)
+
+
+class AudioCache:
+    """
+    Content-addressed cache for synthesized speech, keyed by the formatted text and
+    the voice settings it was rendered with. Keeps raw 16-bit PCM in an in-memory LRU,
+    and optionally a second, bigger LRU of wav files on disk that survives restarts.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[str] = "cache/audio",
+        max_memory_bytes: int = 32 * 1024 * 1024,
+        max_disk_bytes: int = 256 * 1024 * 1024,
+    ) -> None:
+        """
+        Sets up the cache, picking up whatever is already on disk.
+        - directory (str, optional): Where to keep wav files. None keeps it memory only.
+        - max_memory_bytes (int): Max PCM bytes kept in memory.
+        - max_disk_bytes (int): Max wav bytes kept on disk.
+        """
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+
+        self._memory: "OrderedDict[str, Tuple[bytes, int, int]]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            # oldest first, so eviction order survives restarts
+            for file in sorted(
+                Path(self.directory).glob("*.wav"), key=lambda f: f.stat().st_mtime
+            ):
+                self._disk[file.stem] = file.stat().st_size
+                self._disk_bytes += file.stat().st_size
+
+    @staticmethod
+    def key(text: str, voice: Iterable[str] = ()) -> str:
+        """
+        Builds the cache key for some text spoken with some voice settings.
+        - text (str): The formatted text, exactly as it goes to the synthesizer.
+        - voice (Iterable[str]): Voice, duration, pitch, etc. Anything that changes the audio.
+        - Returns (str): A hex digest.
+        """
+        payload = json.dumps([text, list(voice)])
+        return hashlib.sha256(payload.encode("UTF-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.wav")
+
+    def _remember(self, key: str, entry: Tuple[bytes, int, int]) -> None:
+        """
+        Puts an entry in the memory LRU, evicting until it fits. Needs the lock held.
+        """
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key)[0])
+
+        if len(entry[0]) > self.max_memory_bytes:
+            return
+
+        self._memory[key] = entry
+        self._memory_bytes += len(entry[0])
+        while self._memory_bytes > self.max_memory_bytes:
+            _, (evicted, _, _) = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def get(self, key: str) -> Optional[Tuple[bytes, int, int]]:
+        """
+        Looks up cached audio. Memory first, then disk.
+        - key (str): Key from AudioCache.key().
+        - Returns (Tuple[bytes, int, int] | None): (pcm, sample rate, channels), or None.
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+            if self.directory is None or key not in self._disk:
+                return None
+
+            try:
+                with wave.open(self._path(key), "rb") as wave_file:
+                    entry = (
+                        wave_file.readframes(wave_file.getnframes()),
+                        wave_file.getframerate(),
+                        wave_file.getnchannels(),
+                    )
+                os.utime(self._path(key))
+            except (OSError, wave.Error, EOFError):
+                self._disk_bytes -= self._disk.pop(key)
+                return None
+
+            self._disk.move_to_end(key)
+            self._remember(key, entry)
+            return entry
+
+    def set(self, key: str, pcm: bytes, sample_rate: int, channels: int = 1) -> None:
+        """
+        Caches rendered audio in memory and on disk.
+        - key (str): Key from AudioCache.key().
+        - pcm (bytes): Raw 16-bit PCM.
+        - sample_rate (int): Its sample rate.
+        - channels (int): Its channel count.
+        """
+        with self._lock:
+            self._remember(key, (pcm, sample_rate, channels))
+
+            if self.directory is None:
+                return
+
+            temp_file = f"{self._path(key)}.tmp"
+            with wave.open(temp_file, "wb") as wave_file:
+                wave_file.setnchannels(channels)
+                wave_file.setsampwidth(2)
+                wave_file.setframerate(sample_rate)
+                wave_file.writeframes(pcm)
+            os.replace(temp_file, self._path(key))
+
+            if key in self._disk:
+                self._disk_bytes -= self._disk.pop(key)
+            self._disk[key] = os.path.getsize(self._path(key))
+            self._disk_bytes += self._disk[key]
+
+            while self._disk_bytes > self.max_disk_bytes and len(self._disk) > 1:
+                evicted, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+                if os.path.exists(self._path(evicted)):
+                    os.remove(self._path(evicted))
@@ -0,0 +1,182 @@
+"""
+Single-flight for chat completion calls. When the same request (model, messages,
+tools) is already on its way to Groq, later callers wait for that one instead of
+paying for their own, and everyone gets the same response. Works across every Model
+in the process, so sessions on the server that ask the same thing share one call.
+"""
+
+import asyncio
+import contextlib
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+
+class _Flight:
+    """
+    One async request in the air, and how many callers are waiting on it.
+    """
+
+    def __init__(self, task: asyncio.Task) -> None:
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight requests. Sync callers share a Future, async
+    callers share a task (per event loop). An async caller that gets cancelled only
+    cancels the request itself if nobody else is still waiting on it.
+
+    With a settle window, a new request waits that long before going out, so a burst
+    of identical requests (say, several sessions hearing the same thing) collapses
+    into one call even if they don't arrive at exactly the same moment. Distinct
+    requests still get a call each, since chat completions take one conversation per
+    call (Groq's batch API is for offline jobs, not this); max_concurrent caps how
+    many of those are in the air at once.
+    """
+
+    def __init__(
+        self, settle_window: float = 0.0, max_concurrent: Optional[int] = None
+    ) -> None:
+        """
+        Sets up an empty flight table.
+        - settle_window (float): Seconds a new request waits for identical ones to
+          pile on before it's sent. 0 sends right away.
+        - max_concurrent (int, optional): Max distinct requests in the air at once.
+          None doesn't limit them.
+        """
+        self.settle_window = settle_window
+        self.max_concurrent = max_concurrent
+
+        self.calls: Dict[str, Future] = {}
+        self.flights: Dict[Tuple[asyncio.AbstractEventLoop, str], _Flight] = {}
+        self.lock = threading.Lock()
+
+        self._slots = (
+            threading.BoundedSemaphore(max_concurrent) if max_concurrent else None
+        )
+        self._async_slots: Dict[asyncio.AbstractEventLoop, asyncio.Semaphore] = {}
+
+        self.requests = 0
+        self.shared = 0
+
+    @staticmethod
+    def key(request: Dict[str, Any]) -> str:
+        """
+        - request (dict): Keyword arguments for chat.completions.create().
+        - Returns (str): A stable hex digest; equal for identical requests.
+        """
+        payload = json.dumps(request, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("UTF-8")).hexdigest()
+
+    def call(self, request: Dict[str, Any], create: Callable[[], Any]) -> Any:
+        """
+        Runs a request, or waits for the identical one that's already running.
+        - request (dict): The request, used to spot identical ones.
+        - create (Callable): Actually sends it.
+        - Returns (Any): The response. Raises whatever the request raised.
+        """
+        key = self.key(request)
+
+        with self.lock:
+            self.requests += 1
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+            else:
+                self.shared += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            if self.settle_window:
+                time.sleep(self.settle_window)
+            with self._slots or contextlib.nullcontext():
+                response = create()
+        except BaseException as e:
+            with self.lock:
+                self.calls.pop(key, None)
+            future.set_exception(e)
+            raise
+
+        with self.lock:
+            self.calls.pop(key, None)
+        future.set_result(response)
+        return response
+
+    async def _run(self, create: Callable[[], Awaitable[Any]]) -> Any:
+        if self.settle_window:
+            await asyncio.sleep(self.settle_window)
+
+        if not self.max_concurrent:
+            return await create()
+
+        loop = asyncio.get_running_loop()
+        slots = self._async_slots.setdefault(
+            loop, asyncio.Semaphore(self.max_concurrent)
+        )
+        async with slots:
+            return await create()
+
+    async def acall(
+        self, request: Dict[str, Any], create: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """
+        Async version of call().
+        - request (dict): The request, used to spot identical ones.
+        - create (Callable): Returns the coroutine that actually sends it.
+        - Returns (Any): The response. Raises whatever the request raised.
+        """
+        loop = asyncio.get_running_loop()
+        flight_key = (loop, self.key(request))
+
+        with self.lock:
+            self.requests += 1
+            flight = self.flights.get(flight_key)
+            if flight is not None:
+                self.shared += 1
+            else:
+                flight = self.flights[flight_key] = _Flight(
+                    loop.create_task(self._run(create))
+                )
+
+                def land(_: asyncio.Task, flight: _Flight = flight) -> None:
+                    with self.lock:
+                        if self.flights.get(flight_key) is flight:
+                            del self.flights[flight_key]
+
+                flight.task.add_done_callback(land)
+
+            flight.waiters += 1
+
+        try:
+            # shielded, so one caller getting cancelled doesn't take the others down
+            return await asyncio.shield(flight.task)
+        finally:
+            with self.lock:
+                flight.waiters -= 1
+                abandoned = flight.waiters == 0 and not flight.task.done()
+                if abandoned and self.flights.get(flight_key) is flight:
+                    del self.flights[flight_key]  # nobody new should join it now
+            if abandoned:
+                flight.task.cancel()
+
+    def stats(self) -> Dict[str, float]:
+        """
+        - Returns (dict): Requests seen, how many shared another one's call, and
+          the share of calls saved.
+        """
+        return {
+            "requests": self.requests,
+            "shared": self.shared,
+            "saved": self.shared / self.requests if self.requests else 0.0,
+        }
+
+
+single_flight = SingleFlight()
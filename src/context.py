@@ -0,0 +1,272 @@
+"""
+Builds the conversation context that goes out with each question: the most recent
+turns, plus older turns that look relevant, trimmed to fit the model's context window.
+Token counts are approximate and get worked out once per turn, not once per request.
+"""
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+from history import CompletionHistory
+
+
+# Context window sizes by Groq model id. Unknown models get DEFAULT_CONTEXT_WINDOW.
+CONTEXT_WINDOWS: Dict[str, int] = {
+    "llama3-8b-8192": 8192,
+    "llama-3.1-70b-versatile": 32768,  # Groq caps it below the model's 128k
+    "llama-3.2-11b-vision-preview": 8192,
+    "llama3-groq-8b-8192-tool-use-preview": 8192,
+    "llama3-groq-70b-8192-tool-use-preview": 8192,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+MESSAGE_OVERHEAD = 4  # role and separator tokens every message costs
+
+_RETRIEVED_HEADER = "Earlier parts of this conversation that might be relevant:"
+
+# Llama tokenizers split most words into pieces of a few characters, and punctuation
+# into tokens of its own. Counting those comes within ~10-15% for English text.
+_TOKEN = re.compile(r"\w{1,6}|[^\w\s]")
+
+
+def approximate_tokens(text: str) -> int:
+    """
+    Estimates how many tokens a piece of text costs, without a tokenizer.
+    - text (str): The text.
+    - Returns (int): Roughly how many tokens it is.
+    """
+    return len(_TOKEN.findall(text))
+
+
+def entry_messages(entry: dict) -> List[Dict[str, str]]:
+    """
+    Turns a history entry into chat messages. Entries are either messages already
+    ({"role", "content"}) or older {"request", "answer"} pairs.
+    - entry (dict): The history entry.
+    - Returns (List[dict]): Zero, one or two messages.
+    """
+    if "role" in entry:
+        content = entry.get("content")
+        if entry["role"] in ("user", "assistant") and isinstance(content, str):
+            return [{"role": entry["role"], "content": content}]
+        return []
+
+    messages = []
+    if isinstance(entry.get("request"), str):
+        messages.append({"role": "user", "content": entry["request"]})
+    if isinstance(entry.get("answer"), str):
+        messages.append({"role": "assistant", "content": entry["answer"]})
+    return messages
+
+
+# Words that point back at something said earlier: "and tomorrow?", "why is that?"
+_FOLLOW_UP = re.compile(
+    r"^\s*(and|but|so|also|then|what about|how about|why)\b"
+    r"|\b(it|its|that|this|those|these|they|them|their|he|she|him|her|his|there|"
+    r"one|ones|else|again|too|instead|same)\b",
+    re.IGNORECASE,
+)
+
+
+def is_follow_up(question: str) -> bool:
+    """
+    Guesses whether a question only makes sense given the turns before it. Errs on
+    the side of yes, which only costs a cache hit.
+    - question (str): The question.
+    - Returns (bool): True if it looks like it refers back to the conversation.
+    """
+    return bool(_FOLLOW_UP.search(question))
+
+
+def previous_exchange(history: CompletionHistory) -> List[Dict[str, str]]:
+    """
+    The last exchange before the question, which is what a follow-up leans on.
+    A trailing user turn is taken to be the question itself, so it's skipped.
+    - history (CompletionHistory): The conversation so far.
+    - Returns (List[dict]): Up to two messages, oldest first.
+    """
+    turns = history.conversation_history
+    end = len(turns)
+    if end and turns[-1].get("role") == "user":
+        end -= 1
+
+    messages = []
+    for entry in turns[max(0, end - 2) : end]:
+        messages += entry_messages(entry)
+    return messages[-2:]
+
+
+def message_tokens(message: Dict[str, str]) -> int:
+    return approximate_tokens(message["content"]) + MESSAGE_OVERHEAD
+
+
+class ContextBuilder:
+    """
+    Assembles conversation context for a request. Keeps the converted messages and
+    their token counts for the history it was last used with, so each new turn only
+    costs counting that turn, and the window of recent turns slides forward instead
+    of getting rebuilt.
+    """
+
+    def __init__(
+        self,
+        reserve_tokens: int = 1024,
+        retrieve_k: int = 3,
+        retrieve_share: float = 0.25,
+        cutoff: float = 0.6,
+        context_windows: Optional[Dict[str, int]] = None,
+    ) -> None:
+        """
+        Sets up the builder.
+        - reserve_tokens (int): Tokens kept free for the answer.
+        - retrieve_k (int): Max older turns to pull in by similarity. 0 turns it off.
+        - retrieve_share (float): Max share of the budget older turns can take.
+        - cutoff (float): Minimum similarity for an older turn to count as relevant.
+        - context_windows (Dict[str, int], optional): Overrides CONTEXT_WINDOWS.
+        """
+        self.reserve_tokens = reserve_tokens
+        self.retrieve_k = retrieve_k
+        self.retrieve_share = retrieve_share
+        self.cutoff = cutoff
+        self.context_windows = {**CONTEXT_WINDOWS, **(context_windows or {})}
+
+        self._history: Optional[List[dict]] = None
+        self._entries: List[dict] = []  # history entry behind each message
+        self._messages: List[Dict[str, str]] = []
+        self._counts: List[int] = []
+        self._synced = 0  # history entries converted so far
+
+        self._start = 0  # first message of the recent window
+        self._window_tokens = 0  # tokens from _start to the end
+
+        self._last_key: Optional[Tuple] = None
+        self._last_context: List[Dict[str, str]] = []
+
+    def budget(self, model: str) -> int:
+        """
+        - model (str): Groq model id.
+        - Returns (int): Tokens available for the prompt, answer reserve taken out.
+        """
+        window = self.context_windows.get(model, DEFAULT_CONTEXT_WINDOW)
+        return max(0, window - self.reserve_tokens)
+
+    def _sync(self, history: List[dict]) -> None:
+        """
+        Converts and counts history entries added since the last call. If the list
+        was swapped out or shrunk (cleared, rotated), everything starts over.
+        """
+        if history is not self._history or self._synced > len(history):
+            self._history = history
+            self._entries, self._messages, self._counts = [], [], []
+            self._synced = self._start = self._window_tokens = 0
+            self._last_key = None
+
+        for entry in history[self._synced :]:
+            for message in entry_messages(entry):
+                count = message_tokens(message)
+                self._entries.append(entry)
+                self._messages.append(message)
+                self._counts.append(count)
+                self._window_tokens += count
+        self._synced = len(history)
+
+    def _slide(self, end: int, budget: int) -> None:
+        """
+        Slides the recent window so it ends at `end` and fits the budget.
+        """
+        tokens = self._window_tokens - sum(self._counts[end:])
+
+        while self._start < end and tokens > budget:
+            tokens -= self._counts[self._start]
+            self._window_tokens -= self._counts[self._start]
+            self._start += 1
+
+        # the budget can grow too (shorter question, bigger model)
+        while self._start > 0 and tokens + self._counts[self._start - 1] <= budget:
+            self._start -= 1
+            tokens += self._counts[self._start]
+            self._window_tokens += self._counts[self._start]
+
+    def _retrieved(
+        self,
+        history: CompletionHistory,
+        question: str,
+        budget: int,
+        end: int,
+    ) -> Optional[Dict[str, str]]:
+        """
+        Finds older turns similar to the question that aren't in the recent window,
+        and packs as many as fit into one system message.
+        """
+        if self.retrieve_k <= 0 or budget <= MESSAGE_OVERHEAD:
+            return None
+
+        in_window = {id(entry) for entry in self._entries[self._start : end]}
+        lines = []
+        tokens = MESSAGE_OVERHEAD + approximate_tokens(_RETRIEVED_HEADER)
+
+        for _, entry in history.search_top_k(question, self.retrieve_k, self.cutoff):
+            if id(entry) in in_window:
+                continue
+
+            turn = "\n".join(
+                f"{message['role']}: {message['content']}"
+                for message in entry_messages(entry)
+            )
+            cost = approximate_tokens(turn)
+            if not turn or tokens + cost > budget:
+                continue
+
+            lines.append(turn)
+            tokens += cost
+
+        if not lines:
+            return None
+        return {"role": "system", "content": "\n\n".join([_RETRIEVED_HEADER, *lines])}
+
+    def build(
+        self,
+        history: CompletionHistory,
+        question: str,
+        model: str,
+        additional_context: Optional[str] = None,
+    ) -> List[Dict[str, str]]:
+        """
+        Builds the context messages that go between the system prompt and the
+        question. A trailing user turn in the history is taken to be the one being
+        answered, so it's left out.
+        - history (CompletionHistory): The conversation so far.
+        - question (str): The question being asked.
+        - model (str): Groq model id, for the budget.
+        - additional_context (str, optional): The system prompt, counted against it.
+        - Returns (List[dict]): Relevant older turns (as one system message) followed
+          by the most recent turns, oldest first.
+        """
+        self._sync(history.conversation_history)
+
+        end = len(self._messages)
+        if end and self._messages[-1]["role"] == "user":
+            end -= 1
+
+        key = (end, self._synced, question, model, additional_context)
+        if key == self._last_key:
+            return list(self._last_context)
+
+        budget = self.budget(model) - approximate_tokens(question) - MESSAGE_OVERHEAD
+        if additional_context:
+            budget -= approximate_tokens(additional_context) + MESSAGE_OVERHEAD
+
+        # recent turns get first dibs, retrieved ones fill in from what isn't there
+        self._slide(end, max(0, budget))
+        retrieved = self._retrieved(
+            history, question, int(budget * self.retrieve_share), end
+        )
+        if retrieved is not None:
+            self._slide(end, max(0, budget - message_tokens(retrieved)))
+
+        recent = self._messages[self._start : end]
+        context = ([retrieved] if retrieved else []) + recent
+
+        self._last_key = key
+        self._last_context = context
+        return list(context)
@@ -0,0 +1,173 @@
+"""
+Hands finished transcripts off to the slow stuff (LLM, TTS) on worker threads, so
+the recognizer never has to sit around waiting for an answer to come back.
+"""
+
+import threading
+from collections import deque
+from enum import Enum
+from typing import Callable, Deque, Dict, Optional
+
+from telemetry import telemetry
+
+
+class DispatchPolicy(Enum):
+    """
+    What to do with a new transcript that can't go straight to a worker. BLOCK and
+    the DROP policies only kick in once max_pending is reached, COALESCE merges as
+    soon as anything is waiting, so its queue never holds more than one transcript.
+    """
+
+    BLOCK = "block"  # Wait for room, up to block_timeout, then drop it
+    DROP_NEWEST = "drop_newest"  # Keep what's queued, drop the new one
+    DROP_OLDEST = "drop_oldest"  # Make room by dropping the oldest queued one
+    COALESCE = "coalesce"  # Glue it onto the queued transcript, if there is one
+
+
+class TranscriptDispatcher:
+    """
+    Bounded queue plus a small worker pool between recognition and response
+    generation. With COALESCE, back-to-back utterances that pile up while an answer
+    is being generated get merged into one request instead of several.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[str], None],
+        workers: int = 1,
+        max_pending: int = 4,
+        policy: DispatchPolicy = DispatchPolicy.COALESCE,
+        block_timeout: float = 0.5,
+    ) -> None:
+        """
+        Sets up the dispatcher. Call start() before submitting anything.
+        - handler (Callable[[str], None]): Gets called with each transcript.
+        - workers (int): Number of worker threads. Keep it at 1 to answer in order.
+        - max_pending (int): Max transcripts waiting for a worker (COALESCE never
+          queues more than one).
+        - policy (DispatchPolicy): What to do when a transcript has to wait, see
+          DispatchPolicy.
+        - block_timeout (float): How long BLOCK waits for room before dropping.
+        """
+        self.handler = handler
+        self.workers = workers
+        self.max_pending = max_pending
+        self.policy = policy
+        self.block_timeout = block_timeout
+
+        self.pending: Deque[str] = deque()
+        self.condition = threading.Condition()
+        self.running = False
+        self.threads = []
+
+        self.stats: Dict[str, int] = {
+            "submitted": 0,
+            "handled": 0,
+            "dropped": 0,
+            "coalesced": 0,
+            "errors": 0,
+        }
+
+    def start(self) -> None:
+        """
+        Starts the worker threads.
+        """
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+
+        self.threads = [
+            threading.Thread(target=self._work, daemon=True)
+            for _ in range(self.workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self, wait: bool = True) -> None:
+        """
+        Stops the workers. Transcripts still queued get thrown away.
+        - wait (bool): Wait for the current handler calls to finish.
+        """
+        with self.condition:
+            self.running = False
+            self.pending.clear()
+            self.condition.notify_all()
+
+        if wait:
+            for thread in self.threads:
+                if thread is not threading.current_thread():
+                    thread.join()
+        self.threads = []
+
+    def submit(self, text: str) -> bool:
+        """
+        Queues a transcript. Never blocks longer than block_timeout.
+        - text (str): The finished transcript.
+        - Returns (bool): False if it got dropped, or the dispatcher isn't running.
+        """
+        with self.condition:
+            self.stats["submitted"] += 1
+            if not self.running:
+                self.stats["dropped"] += 1
+                return False
+
+            if self.policy is DispatchPolicy.COALESCE and self.pending:
+                self.pending[-1] = f"{self.pending[-1]} {text}"
+                self.stats["coalesced"] += 1
+                return True
+
+            if len(self.pending) >= self.max_pending:
+                if self.policy is DispatchPolicy.DROP_OLDEST:
+                    self.pending.popleft()
+                    self.stats["dropped"] += 1
+                elif self.policy is DispatchPolicy.BLOCK:
+                    room = self.condition.wait_for(
+                        lambda: len(self.pending) < self.max_pending
+                        or not self.running,
+                        timeout=self.block_timeout,
+                    )
+                    # stop() empties the queue, that doesn't make room for this one
+                    if not room or not self.running:
+                        self.stats["dropped"] += 1
+                        return False
+                else:
+                    self.stats["dropped"] += 1
+                    return False
+
+            self.pending.append(text)
+            self.condition.notify_all()
+            return True
+
+    def _next(self) -> Optional[str]:
+        """
+        Waits for the next transcript.
+        - Returns (str | None): The transcript, or None once stopped.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.pending or not self.running)
+            if not self.running:
+                return None
+
+            text = self.pending.popleft()
+            self.condition.notify_all()  # there's room again for BLOCK submitters
+            return text
+
+    def _work(self) -> None:
+        """
+        Worker loop. Errors in the handler get logged, they don't kill the worker.
+        """
+        while True:
+            text = self._next()
+            if text is None:
+                return
+
+            try:
+                self.handler(text)
+                outcome = "handled"
+            except Exception as e:
+                outcome = "errors"
+                telemetry.debug("dispatch", "handler failed: %s", e)
+
+            with self.condition:
+                self.stats[outcome] += 1
@@ -0,0 +1,119 @@
+"""
+Long-lived pyttsx3 voice for when festival isn't around. One engine, set up once,
+fed from a queue on its own thread, and interruptible mid-sentence.
+"""
+
+import queue
+import threading
+import time
+from typing import List, Optional
+
+import pyttsx3
+
+
+class FallbackVoice:
+    """
+    Owns a single pyttsx3 engine on a worker thread. The voice gets picked once at
+    startup instead of on every utterance. Utterances queue up and play in order,
+    and interrupt() cuts off the current one and drops the rest.
+    """
+
+    def __init__(
+        self,
+        voices: Optional[List[str]] = None,
+        rate: int = 150,
+        volume: float = 0.9,
+    ) -> None:
+        """
+        Sets up the voice. The engine starts on the first say().
+        - voices (List[str], optional): Preferred voice names, first match wins.
+        - rate (int): Speaking rate in words per minute.
+        - volume (float): Volume between 0 and 1.
+        """
+        self.voices = voices or []
+        self.rate = rate
+        self.volume = volume
+
+        self.utterances = queue.Queue()
+        self.interrupted = threading.Event()
+        self.running = False
+        self.thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+
+    def start(self) -> None:
+        """
+        Starts the engine thread if it isn't running yet.
+        """
+        with self.lock:
+            if self.running:
+                return
+
+            self.running = True
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops speaking and shuts the engine thread down.
+        """
+        with self.lock:
+            if not self.running:
+                return
+            self.running = False
+
+        self.interrupt()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def say(self, text: str) -> None:
+        """
+        Queues text to be spoken. Returns right away.
+        - text (str): Already formatted text.
+        """
+        self.start()
+        self.utterances.put(text)
+
+    def interrupt(self) -> None:
+        """
+        Cuts off the current utterance and drops everything queued after it.
+        """
+        while True:
+            try:
+                self.utterances.get_nowait()
+            except queue.Empty:
+                break
+
+        self.interrupted.set()
+
+    def _run(self) -> None:
+        """
+        Engine thread. pyttsx3 engines have to stay on the thread that made them, so
+        this drives the engine's loop by hand and takes commands from the queue.
+        """
+        engine = pyttsx3.init()
+
+        for voice in engine.getProperty("voices"):
+            if any(preferred in voice.name.lower() for preferred in self.voices):
+                engine.setProperty("voice", voice.id)
+                break
+
+        engine.setProperty("rate", self.rate)
+        engine.setProperty("volume", self.volume)
+
+        engine.startLoop(False)
+        try:
+            while self.running:
+                if self.interrupted.is_set():
+                    self.interrupted.clear()
+                    engine.stop()
+
+                try:
+                    engine.say(self.utterances.get_nowait())
+                except queue.Empty:
+                    pass
+
+                engine.iterate()
+                time.sleep(0.01)
+        finally:
+            engine.endLoop()
@@ -0,0 +1,157 @@
+"""
+Talks to a long-running festival server, so we only pay festival's startup cost
+once instead of on every response. Speaks the same socket protocol festival_client
+does and hands back the rendered audio as WAV bytes.
+"""
+
+import socket
+import subprocess
+import threading
+import time
+from typing import List, Optional
+
+
+# the voice the assistant speaks with, as festival scheme expressions
+DEFAULT_VOICE = [
+    "(voice_kal_diphone)",
+    "(Parameter.set 'Duration_Stretch 1)",
+    "(set! int_target_mean 130)",
+]
+
+
+class FestivalServer:
+    """
+    Starts `festival --server` (or connects to one already running) and renders
+    text to WAV over its socket.
+    """
+
+    key = b"ft_StUfF_key"  # festival's end-of-payload marker
+
+    def __init__(
+        self,
+        voice: Optional[List[str]] = None,
+        host: str = "localhost",
+        port: int = 1314,
+        spawn: bool = True,
+        startup_timeout: float = 10.0,
+    ) -> None:
+        """
+        Sets up the server connection. Nothing starts until the first render().
+        - voice (List[str], optional): Scheme expressions to set the voice up with.
+        - host (str): Where the server is listening.
+        - port (int): Server port. 1314 is festival's default.
+        - spawn (bool): Start a festival server ourselves if none is reachable.
+        - startup_timeout (float): How long to wait for a spawned server to come up.
+        """
+        self.voice = voice or []
+        self.host = host
+        self.port = port
+        self.spawn = spawn
+        self.startup_timeout = startup_timeout
+
+        self.process: Optional[subprocess.Popen] = None
+        self.connection: Optional[socket.socket] = None
+        self.buffer = b""
+        self.lock = threading.Lock()
+
+    def _connect(self) -> None:
+        """
+        Connects, spawning the server first if needed, then sets up the voice.
+        """
+        try:
+            self.connection = socket.create_connection((self.host, self.port))
+        except OSError:
+            if not self.spawn:
+                raise
+
+            self.process = subprocess.Popen(
+                ["festival", "--server", f"(set! server_port {self.port})"],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+
+            deadline = time.monotonic() + self.startup_timeout
+            while True:
+                try:
+                    self.connection = socket.create_connection((self.host, self.port))
+                    break
+                except OSError:
+                    if time.monotonic() > deadline or self.process.poll() is not None:
+                        raise
+                    time.sleep(0.1)
+
+        self.buffer = b""
+        self._send("(Parameter.set 'Wavefiletype 'riff)")
+        for expression in self.voice:
+            self._send(expression)
+
+    def _read_until(self, marker: bytes) -> bytes:
+        """
+        Reads from the socket until the marker shows up.
+        - marker (bytes): What to stop at. It gets consumed but not returned.
+        - Returns (bytes): Everything before the marker.
+        """
+        while marker not in self.buffer:
+            data = self.connection.recv(65536)
+            if not data:
+                raise ConnectionError("festival - server closed the connection")
+            self.buffer += data
+
+        payload, self.buffer = self.buffer.split(marker, 1)
+        return payload
+
+    def _send(self, expression: str) -> List[bytes]:
+        """
+        Sends one scheme expression and collects what comes back.
+        - expression (str): The expression to evaluate.
+        - Returns (List[bytes]): Every waveform the server sent back.
+        """
+        self.connection.sendall(expression.encode("UTF-8") + b"\n")
+
+        waves = []
+        while True:
+            ack = self._read_until(b"\n")
+            if ack == b"WV":
+                waves.append(self._read_until(self.key))
+            elif ack == b"LP":
+                self._read_until(self.key)
+            elif ack == b"ER":
+                raise RuntimeError(f"festival - server couldn't evaluate {expression}")
+            elif ack == b"OK":
+                return waves
+
+    def render(self, text: str) -> List[bytes]:
+        """
+        Renders text to speech.
+        - text (str): The text to speak.
+        - Returns (List[bytes]): WAV files, festival sends one per utterance.
+        """
+        escaped = text.replace("\\", "\\\\").replace('"', '\\"')
+
+        with self.lock:
+            if self.connection is None:
+                self._connect()
+
+            try:
+                return self._send(f'(tts_textall "{escaped}" "nil")')
+            except (OSError, ConnectionError):
+                self.close_connection()
+                raise
+
+    def close_connection(self) -> None:
+        """
+        Drops the socket. The next render() reconnects.
+        """
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def stop(self) -> None:
+        """
+        Disconnects and shuts down the server if we started it.
+        """
+        self.close_connection()
+
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+        self.process = None
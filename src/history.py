@@ -5,16 +5,24 @@ Uses JSON files to store everything, since this'll all be running local anyway
 
 import json
 import os
+import time
 from datetime import datetime, timedelta
-from difflib import get_close_matches
 from pathlib import Path
-from typing import List, Optional, Union
+from typing import List, Optional, Tuple, Union
+
+from index import TrigramIndex
+from segments import SegmentReader
+from telemetry import telemetry
 
 
 class CompletionHistory:
     """
     Manages conversation history using JSON files. Handles file rotation,
     saving, clearing, loading, searching, and merging history files.
+    In journal mode, turns get appended to a JSONL file one line at a time instead
+    of rewriting the whole history on every save. Both formats load fine.
+    With lazy loading, files already on disk stay there and get read on demand
+    through a SegmentReader. Only this session's turns live in conversation_history.
     Each conversation entry follows the format:
     {
         "id": int,
@@ -33,6 +41,13 @@ class CompletionHistory:
         history_file_extension: str = ".json",
         new_history_interval: timedelta = timedelta(hours=6),
         recent_conversations_to_load: int = -1,
+        journal: bool = False,
+        journal_file_extension: str = ".jsonl",
+        journal_fsync_batch: int = 8,
+        journal_fsync_interval: float = 1.0,
+        journal_compact_every: int = 1000,
+        lazy_load: bool = False,
+        memory_budget: int = 16 * 1024 * 1024,
     ) -> None:
         """
         Initializes the history manager. Defaults should work out of the box.
@@ -42,6 +57,14 @@ class CompletionHistory:
         - history_file_extension (str): File extension for history files.
         - new_history_interval (timedelta): When to create a new file.
         - recent_conversations_to_load (int): Number of recent conversations to load (-1 for all).
+        - journal (bool): Append each turn as a JSON line instead of rewriting the file.
+        - journal_file_extension (str): File extension for journal files.
+        - journal_fsync_batch (int): Fsync the journal after this many appended turns.
+        - journal_fsync_interval (float): Or after this many seconds, whichever comes first.
+        - journal_compact_every (int): Rewrite the journal file after this many appends.
+        - lazy_load (bool): Index history files instead of loading them into memory.
+        - memory_budget (int): Max bytes of decoded entries kept cached in lazy mode.
+          The search index over archived files gets the same budget.
         """
         self.history_directory = history_directory
         self.history_file_prefix = history_file_prefix
@@ -49,6 +72,26 @@ class CompletionHistory:
         self.new_history_interval = new_history_interval
         self.recent_conversations_to_load = recent_conversations_to_load
 
+        self.journal = journal
+        self.journal_ext = journal_file_extension
+        self.journal_fsync_batch = journal_fsync_batch
+        self.journal_fsync_interval = journal_fsync_interval
+        self.journal_compact_every = journal_compact_every
+
+        self.lazy_load = lazy_load
+        self.memory_budget = memory_budget
+        self.archive: Optional[SegmentReader] = None
+        self.archive_index = TrigramIndex()
+        self._archive_indexed = False
+
+        self._journal_handle = None
+        self._journal_entries: List[dict] = []  # what's in the current journal file
+        self._journaled_history: Optional[List[dict]] = None
+        self._persisted_count = 0
+        self._unsynced_count = 0
+        self._last_fsync = time.monotonic()
+        self._appends_since_compact = 0
+
         self.debug = debug
         self.updated_at: datetime = None
         self.current_history_file: Optional[str] = None
@@ -57,6 +100,10 @@ class CompletionHistory:
         self.timestamp_file = os.path.join(self.history_directory, "h.timestamp")
         self.last_history_time: Optional[datetime] = None
 
+        self.text_index = TrigramIndex()
+        self._indexed_history: Optional[List[dict]] = None
+        self._indexed_count = 0
+
         self.initialize()
         self.load_recent_conversations()
         self.load_last_history_time()
@@ -68,7 +115,7 @@ class CompletionHistory:
 
         os.makedirs(self.history_directory, exist_ok=True)
         if self.debug:
-            print("history - initialized conversation directory")
+            telemetry.debug("history", "initialized conversation directory")
 
     def _generate_name(self) -> str:
         """
@@ -76,9 +123,10 @@ class CompletionHistory:
         - Returns (str): Full path for the new history file.
         """
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        extension = self.journal_ext if self.journal else self.history_file_ext
         return os.path.join(
             self.history_directory,
-            f"{self.history_file_prefix}{timestamp}{self.history_file_ext}",
+            f"{self.history_file_prefix}{timestamp}{extension}",
         )
 
     def load_last_history_time(self) -> None:
@@ -92,8 +140,9 @@ class CompletionHistory:
         else:
             self.last_history_time = None
             if self.debug:
-                print(
-                    "history - 'h.timestamp' file not found. No last history time loaded."
+                telemetry.debug(
+                    "history",
+                    "'h.timestamp' file not found. No last history time loaded.",
                 )
 
     def new(self) -> None:
@@ -101,6 +150,7 @@ class CompletionHistory:
         Creates a new history file and resets internal references.
         """
         self.updated_at = datetime.now()
+        self._close_journal()
         self.current_history_file = self._generate_name()
 
         with open(self.timestamp_file, "w", encoding="UTF-8") as f:
@@ -109,7 +159,9 @@ class CompletionHistory:
         self.last_history_time = self.updated_at
 
         if self.debug:
-            print(f"history - created new history file: {self.current_history_file}")
+            telemetry.debug(
+                "history", f"created new history file: {self.current_history_file}"
+            )
 
     def save(self) -> None:
         """
@@ -126,13 +178,138 @@ class CompletionHistory:
             ):
                 self.new()
 
+        if self.journal:
+            self._append_journal()
+            return
+
         with open(self.current_history_file, "w", encoding="UTF-8") as f:
             json.dump(self.conversation_history, f, default=str, indent=4)
 
+    def _append_journal(self) -> None:
+        """
+        Appends every turn that isn't on disk yet to the current journal file.
+        Only the new turns get serialized, so this costs the same no matter how long
+        the session has been running. Fsyncs are batched, compaction is periodic.
+        """
+        if (
+            self._journaled_history is not self.conversation_history
+            or self._persisted_count > len(self.conversation_history)
+        ):
+            # history got swapped out or cleared, everything in it is new to this file
+            self._journaled_history = self.conversation_history
+            self._persisted_count = 0
+
+        pending = self.conversation_history[self._persisted_count :]
+        if not pending:
+            return
+
+        if self._journal_handle is None:
+            torn = False
+            if os.path.exists(self.current_history_file):
+                with open(self.current_history_file, "rb") as f:
+                    if f.seek(0, os.SEEK_END) > 0:
+                        f.seek(-1, os.SEEK_END)
+                        torn = f.read(1) != b"\n"
+
+            self._journal_handle = open(
+                self.current_history_file, "a", encoding="UTF-8"
+            )
+            if torn:
+                # a torn last line would swallow the next entry, so start on a fresh line
+                self._journal_handle.write("\n")
+
+        self._journal_handle.write(
+            "".join(json.dumps(entry, default=str) + "\n" for entry in pending)
+        )
+        self._journal_handle.flush()
+
+        self._journal_entries.extend(pending)
+        self._persisted_count = len(self.conversation_history)
+        self._unsynced_count += len(pending)
+        self._appends_since_compact += len(pending)
+
+        if self._appends_since_compact >= self.journal_compact_every:
+            self.compact()
+        elif (
+            self._unsynced_count >= self.journal_fsync_batch
+            or time.monotonic() - self._last_fsync >= self.journal_fsync_interval
+        ):
+            self._fsync_journal()
+
+    def _fsync_journal(self) -> None:
+        """
+        Pushes buffered journal writes all the way to disk.
+        """
+        if self._journal_handle is not None:
+            self._journal_handle.flush()
+            os.fsync(self._journal_handle.fileno())
+
+        self._unsynced_count = 0
+        self._last_fsync = time.monotonic()
+
+    def _close_journal(self) -> None:
+        """
+        Syncs and closes the journal file handle, if one is open.
+        """
+        if self._journal_handle is not None:
+            self._fsync_journal()
+            self._journal_handle.close()
+            self._journal_handle = None
+
+        self._journal_entries = []
+
+    def compact(self) -> None:
+        """
+        Rewrites the current journal file from the turns it should contain.
+        Drops half-written lines left behind by a crash. The new file is written next
+        to the old one and swapped in, so a crash mid-compaction loses nothing.
+        """
+        if not self.journal or self.current_history_file is None:
+            return
+
+        if self._journal_handle is not None:
+            self._journal_handle.close()
+            self._journal_handle = None
+
+        temp_file = f"{self.current_history_file}.tmp"
+        with open(temp_file, "w", encoding="UTF-8") as f:
+            f.write(
+                "".join(
+                    json.dumps(entry, default=str) + "\n"
+                    for entry in self._journal_entries
+                )
+            )
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(temp_file, self.current_history_file)
+
+        self._appends_since_compact = 0
+        self._unsynced_count = 0
+        self._last_fsync = time.monotonic()
+
+        if self.debug:
+            telemetry.debug(
+                "history", f"compacted journal: {self.current_history_file}"
+            )
+
+    def close(self) -> None:
+        """
+        Flushes anything still pending to disk and unmaps archived files.
+        Call this on shutdown.
+        """
+        if self.journal:
+            self._append_journal()
+            self._close_journal()
+
+        if self.archive is not None:
+            self.archive.close()
+
     def clear(self) -> None:
         """
         Clears the current conversation history. Resets everything.
         """
+        self._close_journal()
         self.conversation_history = []
         self.current_history_file = None
         self.updated_at = datetime.now()
@@ -143,7 +320,12 @@ class CompletionHistory:
         Also sets the current history file to the most recent one.
         """
         files = sorted(
-            Path(self.history_directory).glob(f"*{self.history_file_ext}"), reverse=True
+            [
+                *Path(self.history_directory).glob(f"*{self.history_file_ext}"),
+                *Path(self.history_directory).glob(f"*{self.journal_ext}"),
+            ],
+            key=lambda file: file.name,
+            reverse=True,
         )
         files_to_load = (
             files[: self.recent_conversations_to_load]
@@ -151,21 +333,88 @@ class CompletionHistory:
             else files
         )
 
+        self._close_journal()
         self.conversation_history = []
+
+        if self.archive is not None:
+            self.archive.close()
+        self.archive = None
+        self.archive_index.clear()
+        self._archive_indexed = False
+
+        if self.lazy_load:
+            self.archive = SegmentReader(
+                files_to_load,
+                journal_file_extension=self.journal_ext,
+                memory_budget=self.memory_budget,
+            )
+            # never write over a file that's only indexed, this session gets its own
+            self.current_history_file = None
+            self._journaled_history = self.conversation_history
+            self._persisted_count = 0
+
+            if self.debug:
+                telemetry.debug(
+                    "history",
+                    f"indexed {len(self.archive)} conversations "
+                    f"across {len(files_to_load)} files",
+                )
+            return
+
         if files_to_load:
             self.current_history_file = str(files_to_load[0])
         else:
             self.current_history_file = None
 
         for file in files_to_load:
-            with open(file, "r", encoding="UTF-8") as f:
-                self.conversation_history.extend(json.load(f))
+            entries = self._read_history_file(file)
+            if self.journal and str(file) == self.current_history_file:
+                self._journal_entries = list(entries)
+            self.conversation_history.extend(entries)
+
+        if self.journal:
+            # can't append lines to a legacy array file, so start a fresh journal
+            if self.current_history_file and not self.current_history_file.endswith(
+                self.journal_ext
+            ):
+                self.current_history_file = None
+                self._journal_entries = []
+
+            self._journaled_history = self.conversation_history
+            self._persisted_count = len(self.conversation_history)
+
         # if self.conversation_history:
         #     self.next_id = max(entry["id"] for entry in self.conversation_history) + 1
         # else:
         #     self.next_id = 0
         if self.debug:
-            print(f"history - loaded {len(self.conversation_history)} conversations")
+            telemetry.debug(
+                "history", f"loaded {len(self.conversation_history)} conversations"
+            )
+
+    def _read_history_file(self, file: Path) -> List[dict]:
+        """
+        Reads one history file. Handles both legacy JSON arrays and JSONL journals.
+        A torn line at the end of a journal (crash mid-write) gets skipped.
+        - file (Path): The history file to read.
+        - Returns (List[dict]): The entries stored in it.
+        """
+        with open(file, "r", encoding="UTF-8") as f:
+            if file.suffix != self.journal_ext:
+                return json.load(f)
+
+            entries = []
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    if self.debug:
+                        telemetry.debug(
+                            "history", f"skipped torn line {line_number} in {file}"
+                        )
+            return entries
 
     def search_by_key(self, key: str, value: Union[str, int]) -> List[dict]:
         """
@@ -174,23 +423,156 @@ class CompletionHistory:
         - value (str | int): The value to match.
         - Returns (List[dict]): Matching conversation entries.
         """
-        return [entry for entry in self.conversation_history if entry.get(key) == value]
+        archived = (
+            [entry for _, entry in self.archive.search_by_key(key, value)]
+            if self.archive is not None
+            else []
+        )
+        return archived + [
+            entry for entry in self.conversation_history if entry.get(key) == value
+        ]
+
+    def _sync_archive_index(self) -> None:
+        """
+        Builds the text index over archived files the first time it's needed.
+        Streams through the segments once, newest files first; entries aren't kept in
+        memory. The index stops growing at memory_budget, so in a very large archive
+        the oldest entries don't get indexed and text searches won't find them.
+        """
+        if self.archive is None or self._archive_indexed:
+            return
+
+        for position, entry in self.archive:
+            if self.archive_index.nbytes >= self.memory_budget:
+                if self.debug:
+                    telemetry.debug(
+                        "history",
+                        f"search index is full, left the oldest "
+                        f"{len(self.archive) - position} archived entries out",
+                    )
+                break
+
+            for key in ["request", "answer"]:
+                if key in entry and isinstance(entry[key], str):
+                    self.archive_index.add(entry[key], (position, key))
+
+        self._archive_indexed = True
+
+    def _archived_text(self, doc_id: int) -> str:
+        """
+        Looks up the original text behind an archive index document.
+        - doc_id (int): The document id handed out by the index.
+        - Returns (str): The request or answer text it points to.
+        """
+        position, key = self.archive_index.refs[doc_id]
+        return self.archive.get(position)[key]
+
+    def _sync_text_index(self) -> None:
+        """
+        Brings the text index up to date with conversation_history.
+        New entries get appended to the index. If the list was swapped out or shrunk
+        (cleared, reloaded), the index gets rebuilt from scratch.
+        """
+        if (
+            self._indexed_history is not self.conversation_history
+            or self._indexed_count > len(self.conversation_history)
+        ):
+            self.text_index.clear()
+            self._indexed_history = self.conversation_history
+            self._indexed_count = 0
 
+        for position in range(self._indexed_count, len(self.conversation_history)):
+            entry = self.conversation_history[position]
+            for key in ["request", "answer"]:
+                if key in entry and isinstance(entry[key], str):
+                    self.text_index.add(entry[key], (position, key))
+
+        self._indexed_count = len(self.conversation_history)
+
+    def _indexed_text(self, doc_id: int) -> str:
+        """
+        Looks up the original text behind a text index document.
+        - doc_id (int): The document id handed out by the index.
+        - Returns (str): The request or answer text it points to.
+        """
+        position, key = self.text_index.refs[doc_id]
+        return self.conversation_history[position][key]
+
+    def search_top_k(
+        self, text: str, k: int = 5, cutoff: float = 0.6
+    ) -> List[Tuple[float, dict]]:
+        """
+        Ranked similarity search. Same scoring as search_by_text, but best first.
+        - text (str): The text to search for.
+        - k (int): Max number of entries to return (-1 for all).
+        - cutoff (float): Minimum similarity score to consider a match (0-1).
+        - Returns (List[Tuple[float, dict]]): (score, entry) pairs, highest score first.
+        """
+        self._sync_text_index()
+        self._sync_archive_index()
+
+        scored = [
+            (score, "session", self.text_index.refs[doc_id][0])
+            for score, doc_id in self.text_index.search(
+                text, self._indexed_text, cutoff=cutoff
+            )
+        ]
+        if self.archive is not None:
+            scored += [
+                (score, "archive", self.archive_index.refs[doc_id][0])
+                for score, doc_id in self.archive_index.search(
+                    text, self._archived_text, cutoff=cutoff
+                )
+            ]
+        scored.sort(key=lambda match: -match[0])
+
+        results = []
+        seen = set()
+        for score, source, position in scored:
+            if (source, position) in seen:
+                continue
+
+            seen.add((source, position))
+            entry = (
+                self.archive.get(position)
+                if source == "archive"
+                else self.conversation_history[position]
+            )
+            results.append((score, entry))
+            if len(results) == k:
+                break
+
+        return results
+
+    @telemetry.timed("history.search_by_text")
     def search_by_text(self, text: str, cutoff: float = 0.6) -> List[dict]:
         """
         Performs a similarity search for conversations matching the given text.
+        Finds the same entries a difflib scan over every request and answer would,
+        but only runs difflib on the ones that could match (see TrigramIndex).
         - text (str): The text to search for.
         - cutoff (float): Minimum similarity score to consider a match (0-1).
         - Returns (List[dict]): Matching conversation entries based on similarity.
         """
-        matches = []
-        for entry in self.conversation_history:
-            for key in ["request", "answer"]:
-                if key in entry and isinstance(entry[key], str):
-                    close_matches = get_close_matches(
-                        text, [entry[key]], n=1, cutoff=cutoff
-                    )
-                    if close_matches:
-                        matches.append(entry)
-                        break
-        return matches
+        self._sync_text_index()
+        self._sync_archive_index()
+
+        archived = []
+        if self.archive is not None:
+            archived_positions = {
+                self.archive_index.refs[doc_id][0]
+                for _, doc_id in self.archive_index.search(
+                    text, self._archived_text, cutoff=cutoff
+                )
+            }
+            archived = [self.archive.get(p) for p in sorted(archived_positions)]
+
+        positions = {
+            self.text_index.refs[doc_id][0]
+            for _, doc_id in self.text_index.search(
+                text, self._indexed_text, cutoff=cutoff
+            )
+        }
+        return archived + [
+            self.conversation_history[position] for position in sorted(positions)
+        ]
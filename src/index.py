@@ -0,0 +1,236 @@
+"""
+Character n-gram index for fuzzy text lookups. Keeps posting lists and character
+counts in memory so searching history doesn't mean running difflib against every
+single entry.
+"""
+
+import heapq
+import math
+from collections import defaultdict
+from difflib import SequenceMatcher
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy
+
+
+# characters get counted into this many buckets, see TrigramIndex._bag()
+BAG_SIZE = 64
+
+
+class TrigramIndex:
+    """
+    Finds documents `difflib.get_close_matches` would match, without running
+    SequenceMatcher on every one of them. Documents are added once and get a
+    sequential id.
+
+    By default lookups are lossless, they find exactly what a full difflib scan
+    finds. Two bounds that difflib's ratio can never beat rule documents out
+    before the real check, both worked out for every document at once with NumPy:
+    - length: 2 * min(a, b) / (a + b), what real_quick_ratio() checks.
+    - shared characters: each document's character counts live in a row of BAG_SIZE
+      buckets, and 2 * sum(min(query, document)) / (a + b) is at least what
+      quick_ratio() gives, so nothing that could pass gets dropped.
+    What's left gets the same checks get_close_matches does.
+
+    For big histories where speed matters more than recall, setting max_candidates
+    (and optionally posting_budget) switches to a lossy ranking instead: documents
+    get scored by the IDF weight of the trigrams they share with the query, rarest
+    first, and only the best max_candidates of them get checked. That misses
+    documents sharing no rare trigram with the query (short queries like "of the"
+    vs "for ten" can match without sharing one), and near-duplicates past the cap.
+    """
+
+    def __init__(
+        self,
+        n: int = 3,
+        max_candidates: Optional[int] = None,
+        posting_budget: Optional[int] = None,
+    ) -> None:
+        """
+        Sets up an empty index.
+        - n (int): Size of the character grams. Defaults to 3.
+        - max_candidates (int, optional): Most documents that get a full similarity
+          check. Setting it makes lookups lossy, see above. None checks everything
+          the bounds let through.
+        - posting_budget (int, optional): With max_candidates, postings to visit
+          before skipping the common grams. The rarest gram always gets visited.
+        """
+        self.n = n
+        self.max_candidates = max_candidates
+        self.posting_budget = posting_budget
+        self.postings: Dict[str, List[int]] = defaultdict(list)
+        self.by_length: Dict[int, List[int]] = defaultdict(list)
+        self.lengths: List[int] = []
+        self.refs: List[Any] = []
+        # same lengths as a NumPy array, plus the character counts, grown by doubling
+        self._length_array = numpy.zeros(1024, dtype=numpy.int64)
+        self._bags = numpy.zeros((1024, BAG_SIZE), dtype=numpy.int32)
+        self.nbytes = 0  # rough size of everything above, see add()
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def _grams(self, text: str) -> set:
+        """
+        Breaks text into a set of lowercase, space padded n-grams.
+        Lowercasing only ever adds candidates, the final check is case sensitive.
+        - text (str): The text to split.
+        - Returns (set): Unique grams found in the text.
+        """
+        padded = f"{' ' * (self.n - 1)}{text.lower()} "
+        return {padded[i : i + self.n] for i in range(len(padded) - self.n + 1)}
+
+    @staticmethod
+    def _bag(text: str) -> numpy.ndarray:
+        """
+        Counts a text's characters into BAG_SIZE buckets. Different characters can
+        share a bucket, which only ever makes the bound looser, never wrong.
+        - text (str): The text.
+        - Returns (numpy.ndarray): Counts per bucket.
+        """
+        codes = numpy.frombuffer(text.encode("utf-32-le"), dtype=numpy.uint32)
+        return numpy.bincount(codes % BAG_SIZE, minlength=BAG_SIZE).astype(numpy.int32)
+
+    def add(self, text: str, ref: Any = None) -> int:
+        """
+        Adds a document to the index.
+        - text (str): The text to index.
+        - ref (Any): Whatever the caller wants back when this document matches.
+        - Returns (int): The id given to the document.
+        """
+        doc_id = len(self.lengths)
+        self.lengths.append(len(text))
+        self.refs.append(ref)
+
+        if doc_id == len(self._length_array):
+            self._length_array = numpy.resize(self._length_array, 2 * doc_id)
+            self._bags = numpy.concatenate([self._bags, numpy.zeros_like(self._bags)])
+        self._length_array[doc_id] = len(text)
+        self._bags[doc_id] = self._bag(text)
+        # the bag row, the id, length, ref and bookkeeping around them
+        self.nbytes += 4 * BAG_SIZE + 160
+
+        if self.max_candidates is not None:
+            self.by_length[len(text)].append(doc_id)
+            grams = self._grams(text)
+            for gram in grams:
+                self.postings[gram].append(doc_id)
+            self.nbytes += 8 * len(grams)  # a pointer per posting
+        return doc_id
+
+    def clear(self) -> None:
+        """
+        Drops everything from the index.
+        """
+        self.postings.clear()
+        self.by_length.clear()
+        self.lengths.clear()
+        self.refs.clear()
+        self.nbytes = 0
+
+    def candidates(self, text: str, cutoff: float = 0.6) -> List[int]:
+        """
+        Finds documents worth running a full similarity check on.
+        - text (str): The query text.
+        - cutoff (float): Minimum similarity score (0-1).
+        - Returns (List[int]): Every document that could reach the cutoff, in id
+          order. With max_candidates set, at most that many, highest IDF weighted
+          overlap first.
+        """
+        if self.max_candidates is not None:
+            return self._ranked_candidates(text, cutoff)
+
+        count = len(self.lengths)
+        if count == 0:
+            return []
+
+        size = len(text)
+        lengths = self._length_array[:count]
+        totals = lengths + size
+        if cutoff <= 0:
+            return list(range(count))
+
+        # ratio = 2 * matches / total, and matches can't beat either bound
+        shortest = numpy.minimum(lengths, size)
+        viable = numpy.flatnonzero(2 * shortest >= cutoff * totals - 1e-9)
+        if not len(viable):
+            return []
+
+        shared = numpy.minimum(self._bags[viable], self._bag(text)).sum(axis=1)
+        keep = 2 * shared >= cutoff * totals[viable] - 1e-9
+        return viable[keep].tolist()
+
+    def _ranked_candidates(self, text: str, cutoff: float) -> List[int]:
+        """
+        The lossy candidate search, see the class docstring.
+        """
+        size = len(text)
+        total = len(self.lengths)
+        # any doc outside [low, high] fails real_quick_ratio() no matter what
+        low = size * cutoff / (2.0 - cutoff) if cutoff > 0 else 0
+        high = size * (2.0 - cutoff) / cutoff if cutoff > 0 else math.inf
+
+        postings = sorted(
+            (
+                self.postings[gram]
+                for gram in self._grams(text)
+                if gram in self.postings
+            ),
+            key=len,
+        )
+
+        budget = self.posting_budget or math.inf
+        scores: Dict[int, float] = defaultdict(float)
+        visited = 0
+        for doc_ids in postings:
+            if visited and visited + len(doc_ids) > budget:
+                break  # everything from here on is more common, and worth less
+
+            visited += len(doc_ids)
+            weight = math.log((total + 1) / len(doc_ids))
+            for doc_id in doc_ids:
+                scores[doc_id] += weight
+
+        if not scores and size < 16 and cutoff > 0:
+            # short queries can match without sharing a gram, try the newest few
+            fallback = []
+            for length, doc_ids in self.by_length.items():
+                if low <= length <= high:
+                    fallback.extend(doc_ids[-self.max_candidates :])
+            return heapq.nlargest(self.max_candidates, fallback)
+
+        viable = (doc_id for doc_id in scores if low <= self.lengths[doc_id] <= high)
+        return heapq.nlargest(
+            self.max_candidates, viable, key=lambda doc_id: (scores[doc_id], -doc_id)
+        )
+
+    def search(
+        self,
+        text: str,
+        fetch: Callable[[int], str],
+        cutoff: float = 0.6,
+        limit: int = -1,
+    ) -> List[Tuple[float, int]]:
+        """
+        Scores candidates the same way `difflib.get_close_matches` does.
+        - text (str): The query text.
+        - fetch (Callable[[int], str]): Returns the original text of a document id.
+        - cutoff (float): Minimum similarity score (0-1).
+        - limit (int): Max results to return (-1 for all).
+        - Returns (List[Tuple[float, int]]): (score, document id) pairs, best first.
+        """
+        matcher = SequenceMatcher()
+        matcher.set_seq2(text)
+
+        scored = []
+        for doc_id in self.candidates(text, cutoff):
+            matcher.set_seq1(fetch(doc_id))
+            if matcher.real_quick_ratio() < cutoff or matcher.quick_ratio() < cutoff:
+                continue
+
+            score = matcher.ratio()
+            if score >= cutoff:
+                scored.append((score, doc_id))
+
+        scored.sort(key=lambda pair: (-pair[0], pair[1]))
+        return scored if limit == -1 else scored[:limit]
@@ -8,15 +8,18 @@ Workflow:
 1. The user speaks into the microphone.
 2. The `SpeechInputManager` processes the audio, converting it to text using Vosk.
 3. Once speech is finalized, the text is passed to the `on_speech_create` callback.
-4. The AI model (`Model`) generates a response, which is synthesized back into audio for playback.
+4. The AI model (`Model`) streams a response, which is synthesized back into audio
+   sentence by sentence, so playback starts before the whole answer is done.
 """
 
-import os
+import threading
 import time
 from dotenv import load_dotenv
 
 from speech import SpeechInputManager
-from base import Model
+from startup import Startup, vosk_models
+from base import CONFIRMATION_PROMPTS, FAILURE_PROMPTS, OFFLINE_PROMPTS, Model
+from telemetry import telemetry
 
 
 load_dotenv()
@@ -25,28 +28,65 @@ load_dotenv()
 def on_speech_start():
     """Callback function called when user starts speaking."""
 
-    with synth.synth_process_lock:
-        if synth.synth_playback_process and synth.synth_playback_process.poll() is None:
-            synth.synth_playback_process.terminate()
-            synth.synth_playback_process = None
+    synth.stop_playback()
+    model.cancel()  # stop generating the answer nobody is listening to anymore
 
-            if os.path.exists("response.wav"):
-                os.remove("response.wav")
 
+def on_speech_create(text: str = None):
+    """Callback function called when speech is finalized. Speaks the answer as it streams in."""
+
+    print(f"\n me - '{text}'")
+
+    response = []
+
+    def answer():
+        for chunk in model.ask_stream(text=text):
+            response.append(chunk)
+            yield chunk
+
+    synth.synthesize_stream(answer())
+    print(f"\n llm - '{''.join(response)}'")
+
+
+# the slow bits don't depend on each other, so load them all at once
+startup = Startup()
+startup.submit("vosk", vosk_models.get, "src/models/model/")
+startup.submit("history", Model.create_history)
+startup.submit("client", Model.create_client)
+# a new paraphrase index gets filled from history, so that one waits for it
+startup.submit(
+    "semantic",
+    lambda: Model.create_semantic_index(history=startup.result("history")),
+)
 
-model = Model()
 synth = SpeechInputManager(
     on_speech_start=on_speech_start,
-    on_speech_create=lambda text=None: (
-        print(f"\n me - '{text}'"),
-        (response := model.ask(text=text)),
-        print(f"\n llm - '{response}'"),
-        synth.synthesize(response),
-    ),
+    on_speech_create=on_speech_create,
+)
+model = Model(
+    history=startup.result("history"),
+    client=startup.result("client"),
+    semantic_index=startup.result("semantic"),
 )
 
 if __name__ == "__main__":
+    # TELEMETRY_TRACE / TELEMETRY_PORT turn on the trace file and /metrics
+    telemetry.configure_from_env()
+    telemetry.collect("scheduler", model.scheduler.stats)
+    telemetry.collect("flights", model.flights.stats)
+    telemetry.collect("dispatch", lambda: synth.dispatcher.stats)
+    telemetry.collect("audio_callback", synth.callback_stats)
+
+    # render the canned replies up front so they play instantly
+    threading.Thread(
+        target=synth.warm_up,
+        args=(["Okay.", *CONFIRMATION_PROMPTS, *OFFLINE_PROMPTS, *FAILURE_PROMPTS],),
+        daemon=True,
+    ).start()
+
     synth.run()
+    startup.wait()
+    print(startup.report())
 
     try:
         while True:
@@ -55,12 +95,7 @@ if __name__ == "__main__":
         pass
     finally:
         synth.stop()
-
-        with synth.synth_process_lock:
-            if (
-                synth.synth_playback_process
-                and synth.synth_playback_process.poll() is None
-            ):
-                synth.synth_playback_process.terminate()
-            if os.path.exists("response.wav"):
-                os.remove("response.wav")
+        model.history.close()
+        model.scheduler.close()
+        print(telemetry.report())
+        telemetry.close()
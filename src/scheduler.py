@@ -0,0 +1,462 @@
+"""
+Request scheduling around the Groq client. Keeps track of the rate limits Groq
+reports in its response headers and holds requests back instead of running into
+them, retries what's worth retrying (with jittered backoff, within a deadline), can
+hedge slow requests with a second copy, and falls back to a smaller model when the
+bigger one is out of quota.
+"""
+
+import asyncio
+import concurrent.futures
+import math
+import random
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from groq import (
+    APIConnectionError,
+    APIStatusError,
+    APITimeoutError,
+    AsyncGroq,
+    Groq,
+    InternalServerError,
+    RateLimitError,
+)
+
+from context import approximate_tokens
+from telemetry import telemetry
+
+
+RETRYABLE = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+
+# Where to go when a model is out of quota, by Groq model id
+DEFAULT_FALLBACKS: Dict[str, List[str]] = {
+    "llama-3.1-70b-versatile": ["llama3-8b-8192"],
+    "llama3-groq-70b-8192-tool-use-preview": ["llama3-groq-8b-8192-tool-use-preview"],
+}
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(text: Optional[str]) -> Optional[float]:
+    """
+    Parses the durations Groq puts in its rate limit headers ("7.66s", "2m59.56s",
+    "350ms"), or plain seconds like retry-after has.
+    - text (str, optional): The header value.
+    - Returns (float | None): Seconds, or None if there's nothing to parse.
+    """
+    if not text:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        pass
+
+    parts = _DURATION.findall(text)
+    if not parts:
+        return None
+    return sum(float(value) * _UNITS[unit] for value, unit in parts)
+
+
+class TokenBucket:
+    """
+    A token bucket that learns its size and refill rate from rate limit headers.
+    Until it has seen any headers, it lets everything through.
+    Taking more than is left drives it negative, so concurrent callers line up
+    behind each other instead of all waking at the same moment.
+    """
+
+    def __init__(self) -> None:
+        self.capacity: Optional[float] = None
+        self.tokens = 0.0
+        self.rate = 0.0  # tokens per second
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        if self.capacity is not None:
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+        self.updated = now
+
+    def wait_time(self, cost: float = 1.0) -> float:
+        """
+        - cost (float): Tokens needed.
+        - Returns (float): Seconds until there are that many, 0 if there are now.
+        """
+        with self.lock:
+            if self.capacity is None:
+                return 0.0
+
+            self._refill(time.monotonic())
+            missing = cost - self.tokens
+            if missing <= 0:
+                return 0.0
+            return missing / self.rate if self.rate else math.inf
+
+    def take(self, cost: float = 1.0) -> float:
+        """
+        Takes tokens, going into debt if needed.
+        - cost (float): Tokens to take.
+        - Returns (float): Seconds to wait before the debt is paid off.
+        """
+        with self.lock:
+            if self.capacity is None:
+                return 0.0
+
+            self._refill(time.monotonic())
+            self.tokens -= cost
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate if self.rate else math.inf
+
+    def observe(self, limit: float, remaining: float, reset: Optional[float]) -> None:
+        """
+        Syncs the bucket with what the server says.
+        - limit (float): Bucket size.
+        - remaining (float): Tokens left right now.
+        - reset (float, optional): Seconds until it's full again.
+        """
+        with self.lock:
+            first = self.capacity is None
+            self._refill(time.monotonic())
+            self.capacity = limit
+            # the server's count is already out of date by the time it gets here, and
+            # requests still in flight will take more, so never raise the local count
+            self.tokens = remaining if first else min(self.tokens, remaining)
+            if reset and limit > remaining:
+                self.rate = (limit - remaining) / reset
+            elif not self.rate:
+                self.rate = limit / 60.0
+
+
+class RequestScheduler:
+    """
+    Sends chat completions through a Groq client, sync or async depending on the
+    client, with rate limiting, retries, hedging and model fallback.
+    Rate limits are tracked per model, the same way Groq applies them. Share one
+    scheduler between every Model on the same API key.
+    """
+
+    def __init__(
+        self,
+        client: Groq | AsyncGroq,
+        deadline: float = 30.0,
+        max_attempts: int = 4,
+        base_delay: float = 0.25,
+        max_delay: float = 8.0,
+        hedge_after: Optional[float] = None,
+        fallbacks: Optional[Dict[str, List[str]]] = None,
+    ) -> None:
+        """
+        Sets up the scheduler.
+        - client (Groq | AsyncGroq): The client to send through. Its own retries
+          should be off (max_retries=0), see Model.create_client.
+        - deadline (float): Seconds a request gets, retries and waiting included.
+        - max_attempts (int): Max tries per request, fallbacks not counted.
+        - base_delay (float): Backoff before the first retry, doubling after that.
+          Each delay is picked at random below that (full jitter).
+        - max_delay (float): Cap on the backoff.
+        - hedge_after (float, optional): If a response hasn't come back after this
+          many seconds, send a second copy and take whichever lands first. Only
+          happens while the rate limit has room. None turns hedging off.
+        - fallbacks (Dict[str, List[str]], optional): Models to fall back to, by
+          model id. Defaults to DEFAULT_FALLBACKS.
+        """
+        self.client = client
+        self.deadline = deadline
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge_after = hedge_after
+        self.fallbacks = DEFAULT_FALLBACKS if fallbacks is None else fallbacks
+
+        self.limits: Dict[str, Tuple[TokenBucket, TokenBucket]] = {}
+        self.lock = threading.Lock()
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+        self.counts = {
+            "requests": 0,
+            "attempts": 0,
+            "retries": 0,
+            "hedges": 0,
+            "hedge_wins": 0,
+            "fallbacks": 0,
+        }
+
+    def _buckets(self, model: str) -> Tuple[TokenBucket, TokenBucket]:
+        """
+        - Returns (Tuple[TokenBucket, TokenBucket]): The model's request and token
+          buckets.
+        """
+        with self.lock:
+            if model not in self.limits:
+                self.limits[model] = (TokenBucket(), TokenBucket())
+            return self.limits[model]
+
+    def _observe(self, model: str, headers: httpx.Headers) -> None:
+        """
+        Feeds x-ratelimit-* headers into the model's buckets.
+        """
+        for bucket, kind in zip(self._buckets(model), ("requests", "tokens")):
+            limit = headers.get(f"x-ratelimit-limit-{kind}")
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if limit is None or remaining is None:
+                continue
+
+            try:
+                bucket.observe(
+                    float(limit),
+                    float(remaining),
+                    parse_duration(headers.get(f"x-ratelimit-reset-{kind}")),
+                )
+            except ValueError:
+                pass
+
+    @staticmethod
+    def _cost(request: Dict[str, Any]) -> float:
+        """
+        Rough token cost of a request, for the token bucket.
+        """
+        return sum(
+            approximate_tokens(message["content"]) + 4
+            for message in request.get("messages", [])
+            if isinstance(message.get("content"), str)
+        )
+
+    def _plan(
+        self, models: List[str], cost: float, deadline: float
+    ) -> Tuple[str, float]:
+        """
+        Picks the model to try next and takes its rate limit tokens. Skips to a
+        fallback if the current model couldn't go before the deadline.
+        - Returns (Tuple[str, float]): The model and how long to wait first.
+        """
+        while True:
+            requests, tokens = self._buckets(models[0])
+            remaining = deadline - time.monotonic()
+            wait = max(requests.wait_time(1), tokens.wait_time(cost))
+
+            if wait > remaining and len(models) > 1:
+                telemetry.debug(
+                    "scheduler", "%s is rate limited, trying %s", models[0], models[1]
+                )
+                self.counts["fallbacks"] += 1
+                models.pop(0)
+                continue
+
+            return models[0], max(requests.take(1), tokens.take(cost))
+
+    def _backoff(self, error: Exception, attempt: int) -> float:
+        """
+        - Returns (float): Seconds to wait before the next try. Full jitter, but never
+          shorter than what retry-after asks for.
+        """
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        if isinstance(error, APIStatusError):
+            retry_after = parse_duration(error.response.headers.get("retry-after"))
+            if retry_after:
+                delay = max(delay, retry_after)
+        return delay
+
+    def _send(self, request: Dict[str, Any], timeout: float) -> Any:
+        self.counts["attempts"] += 1
+        try:
+            raw = self.client.chat.completions.with_raw_response.create(
+                **request, timeout=timeout
+            )
+        except APIStatusError as e:
+            self._observe(request["model"], e.response.headers)
+            raise
+
+        self._observe(request["model"], raw.headers)
+        return raw.parse()
+
+    def _attempt(self, request: Dict[str, Any], timeout: float) -> Any:
+        """
+        One try, hedged if it's slow and hedging is on. Streams never get hedged.
+        """
+        if not self.hedge_after or timeout <= self.hedge_after or request.get("stream"):
+            return self._send(request, timeout)
+
+        executor = self._executor
+        if executor is None:
+            executor = self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=8, thread_name_prefix="hedge"
+            )
+
+        first = executor.submit(self._send, request, timeout)
+        done, _ = concurrent.futures.wait([first], timeout=self.hedge_after)
+        if done or self._buckets(request["model"])[0].wait_time(1) > 0:
+            return first.result()
+
+        self.counts["hedges"] += 1
+        self._buckets(request["model"])[0].take(1)
+        hedge = executor.submit(self._send, request, timeout - self.hedge_after)
+
+        # the slower one can't be stopped, it just finishes in the background
+        pending = {first, hedge}
+        while True:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                if future.exception() is None:
+                    self.counts["hedge_wins"] += future is hedge
+                    return future.result()
+            if not pending:
+                return next(iter(done)).result()  # both failed, raise
+
+    def create(self, **request) -> Any:
+        """
+        Sends a chat completion with a sync client. Same arguments as
+        chat.completions.create().
+        With stream=True it returns the stream once Groq has accepted the request, so
+        rate limiting, retries and fallback cover getting the stream started, not
+        errors halfway through it.
+        - Returns (Any): The chat completion (or stream). Its model may be a fallback.
+        Raises the last error once retries or the deadline run out.
+        """
+        self.counts["requests"] += 1
+        deadline = time.monotonic() + self.deadline
+        models = [request["model"], *self.fallbacks.get(request["model"], [])]
+        cost = self._cost(request)
+
+        attempt = 0
+        while True:
+            model, wait = self._plan(models, cost, deadline)
+            if 0 < wait < deadline - time.monotonic():
+                time.sleep(wait)  # past the deadline, just try and see
+
+            try:
+                return self._attempt(
+                    {**request, "model": model},
+                    max(0.1, deadline - time.monotonic()),
+                )
+            except RETRYABLE as e:
+                error = e
+
+            if isinstance(error, RateLimitError) and len(models) > 1:
+                telemetry.debug(
+                    "scheduler", "%s is out of quota, trying %s", model, models[1]
+                )
+                self.counts["fallbacks"] += 1
+                models.pop(0)
+                continue
+
+            attempt += 1
+            delay = self._backoff(error, attempt)
+            if attempt >= self.max_attempts or time.monotonic() + delay >= deadline:
+                raise error
+
+            self.counts["retries"] += 1
+            time.sleep(delay)
+
+    async def _asend(self, request: Dict[str, Any], timeout: float) -> Any:
+        self.counts["attempts"] += 1
+        try:
+            raw = await self.client.chat.completions.with_raw_response.create(
+                **request, timeout=timeout
+            )
+        except APIStatusError as e:
+            self._observe(request["model"], e.response.headers)
+            raise
+
+        self._observe(request["model"], raw.headers)
+        return await raw.parse()
+
+    async def _aattempt(self, request: Dict[str, Any], timeout: float) -> Any:
+        """
+        Async version of _attempt(). The slower copy gets cancelled.
+        """
+        if not self.hedge_after or timeout <= self.hedge_after or request.get("stream"):
+            return await self._asend(request, timeout)
+
+        first = asyncio.ensure_future(self._asend(request, timeout))
+        pending = {first}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=self.hedge_after)
+            if done or self._buckets(request["model"])[0].wait_time(1) > 0:
+                return await first
+
+            self.counts["hedges"] += 1
+            self._buckets(request["model"])[0].take(1)
+            hedge = asyncio.ensure_future(
+                self._asend(request, timeout - self.hedge_after)
+            )
+            pending.add(hedge)
+
+            while True:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        self.counts["hedge_wins"] += task is hedge
+                        return task.result()
+                if not pending:
+                    return next(iter(done)).result()  # both failed, raise
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def acreate(self, **request) -> Any:
+        """
+        Async version of create(), for an AsyncGroq client.
+        """
+        self.counts["requests"] += 1
+        deadline = time.monotonic() + self.deadline
+        models = [request["model"], *self.fallbacks.get(request["model"], [])]
+        cost = self._cost(request)
+
+        attempt = 0
+        while True:
+            model, wait = self._plan(models, cost, deadline)
+            if 0 < wait < deadline - time.monotonic():
+                await asyncio.sleep(wait)  # past the deadline, just try and see
+
+            try:
+                return await self._aattempt(
+                    {**request, "model": model},
+                    max(0.1, deadline - time.monotonic()),
+                )
+            except RETRYABLE as e:
+                error = e
+
+            if isinstance(error, RateLimitError) and len(models) > 1:
+                telemetry.debug(
+                    "scheduler", "%s is out of quota, trying %s", model, models[1]
+                )
+                self.counts["fallbacks"] += 1
+                models.pop(0)
+                continue
+
+            attempt += 1
+            delay = self._backoff(error, attempt)
+            if attempt >= self.max_attempts or time.monotonic() + delay >= deadline:
+                raise error
+
+            self.counts["retries"] += 1
+            await asyncio.sleep(delay)
+
+    def close(self) -> None:
+        """
+        Shuts down the hedging threads, without waiting for hedges still running.
+        Fine to call more than once, and hedging starts a new pool if the scheduler
+        gets used again.
+        """
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        - Returns (dict): Requests, attempts, retries, hedges (and how many of them
+          won), and fallbacks so far.
+        """
+        return dict(self.counts)
@@ -0,0 +1,282 @@
+"""
+Lazy reader for history files on disk. Indexes where every entry lives inside each
+file and only decodes entries when somebody actually asks for them, so startup
+doesn't mean pulling every conversation ever into memory.
+"""
+
+import json
+import mmap
+import os
+from bisect import bisect_right
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Iterator, List, Optional, Tuple
+
+
+class HistorySegment:
+    """
+    One history file, memory-mapped, with an offset table for its entries.
+    Works with both legacy JSON arrays and JSONL journals.
+    """
+
+    def __init__(self, path: Path, journal_file_extension: str = ".jsonl") -> None:
+        """
+        Indexes the file. Entries themselves aren't kept around.
+        - path (Path): The history file.
+        - journal_file_extension (str): Files with this extension are read as JSONL.
+        """
+        self.path = Path(path)
+        self.journal = self.path.suffix == journal_file_extension
+        self.offsets: List[Tuple[int, int]] = []
+
+        self._file = None
+        self._map: Optional[mmap.mmap] = None
+
+        self._scan()
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def open(self) -> Optional[mmap.mmap]:
+        """
+        Maps the file into memory if it isn't already.
+        - Returns (mmap | None): The mapping, or None for an empty file.
+        """
+        if self._map is None and os.path.getsize(self.path) > 0:
+            self._file = open(self.path, "rb")
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def close(self) -> None:
+        """
+        Unmaps the file and closes its handle. It gets reopened on the next read.
+        """
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _scan(self) -> None:
+        """
+        Builds the (start, end) byte offset table for every entry in the file.
+        """
+        data = self.open()
+        if data is None:
+            return
+
+        if self.journal:
+            position = 0
+            while position < len(data):
+                end = data.find(b"\n", position)
+                if end == -1:
+                    end = len(data)
+                if data[position:end].strip():
+                    self.offsets.append((position, end))
+                position = end + 1
+            return
+
+        # legacy arrays have to be walked once to find where each element sits
+        text = data[:].decode("UTF-8")
+        decoder = json.JSONDecoder()
+
+        position = text.find("[") + 1
+        if not position:
+            return  # empty or whitespace-only file, no entries
+        byte_position = len(text[:position].encode("UTF-8"))
+        while True:
+            while position < len(text) and text[position] in " \t\r\n,":
+                byte_position += 1
+                position += 1
+            if position >= len(text) or text[position] == "]":
+                break
+
+            _, end = decoder.raw_decode(text, position)
+            size = len(text[position:end].encode("UTF-8"))
+            self.offsets.append((byte_position, byte_position + size))
+            byte_position += size
+            position = end
+
+    def raw(self, index: int) -> bytes:
+        """
+        Gets the undecoded bytes of one entry.
+        - index (int): Position of the entry inside this file.
+        - Returns (bytes): The raw JSON for that entry.
+        """
+        start, end = self.offsets[index]
+        return self.open()[start:end]
+
+    def entry(self, index: int) -> Optional[dict]:
+        """
+        Decodes one entry.
+        - index (int): Position of the entry inside this file.
+        - Returns (dict | None): The entry, or None if it's a torn journal line.
+        """
+        try:
+            return json.loads(self.raw(index))
+        except json.JSONDecodeError:
+            return None
+
+
+class SegmentReader:
+    """
+    Read-only view over a list of history files, in the order given.
+    Entries are addressed by one global index across all files. Decoded entries
+    are kept in an LRU cache that stays under a byte budget, measured by the size of
+    their raw JSON. Only a handful of files stay mapped at once.
+    """
+
+    def __init__(
+        self,
+        files: List[Path],
+        journal_file_extension: str = ".jsonl",
+        memory_budget: int = 16 * 1024 * 1024,
+        max_open_segments: int = 32,
+    ) -> None:
+        """
+        Indexes every file. Nothing gets decoded yet.
+        - files (List[Path]): History files to read, in order.
+        - journal_file_extension (str): Files with this extension are read as JSONL.
+        - memory_budget (int): Max bytes of decoded entries to keep cached.
+        - max_open_segments (int): Max files mapped at the same time.
+        """
+        self.memory_budget = memory_budget
+        self.max_open_segments = max_open_segments
+
+        self.segments = [HistorySegment(file, journal_file_extension) for file in files]
+        self.starts: List[int] = []
+
+        total = 0
+        for segment in self.segments:
+            self.starts.append(total)
+            total += len(segment)
+        self.total = total
+
+        self._cache: "OrderedDict[int, Tuple[Optional[dict], int]]" = OrderedDict()
+        self._cached_bytes = 0
+        self._open_segments: "OrderedDict[int, HistorySegment]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return self.total
+
+    def _locate(self, index: int) -> Tuple[int, int]:
+        """
+        Turns a global index into (segment number, index inside that segment).
+        """
+        if not 0 <= index < self.total:
+            raise IndexError(f"history - entry {index} is out of range")
+
+        # empty files share a start with the next file, bisect_right skips past them
+        segment_number = bisect_right(self.starts, index) - 1
+        return segment_number, index - self.starts[segment_number]
+
+    def _segment(self, segment_number: int) -> HistorySegment:
+        """
+        Gets a segment, keeping at most max_open_segments of them mapped.
+        """
+        segment = self.segments[segment_number]
+        self._open_segments[segment_number] = segment
+        self._open_segments.move_to_end(segment_number)
+
+        while len(self._open_segments) > self.max_open_segments:
+            _, oldest = self._open_segments.popitem(last=False)
+            oldest.close()
+
+        return segment
+
+    def raw(self, index: int) -> bytes:
+        """
+        Gets the undecoded bytes of an entry.
+        - index (int): Global entry index.
+        - Returns (bytes): The raw JSON for that entry.
+        """
+        segment_number, local = self._locate(index)
+        return self._segment(segment_number).raw(local)
+
+    def get(self, index: int) -> Optional[dict]:
+        """
+        Gets a decoded entry, through the cache.
+        - index (int): Global entry index.
+        - Returns (dict | None): The entry, or None if it couldn't be decoded.
+        """
+        if index in self._cache:
+            self._cache.move_to_end(index)
+            return self._cache[index][0]
+
+        segment_number, local = self._locate(index)
+        segment = self._segment(segment_number)
+        entry = segment.entry(local)
+
+        start, end = segment.offsets[local]
+        cost = end - start
+        if cost <= self.memory_budget:
+            self._cache[index] = (entry, cost)
+            self._cached_bytes += cost
+            while self._cached_bytes > self.memory_budget:
+                _, (_, evicted_cost) = self._cache.popitem(last=False)
+                self._cached_bytes -= evicted_cost
+
+        return entry
+
+    def __getitem__(self, index: int) -> Optional[dict]:
+        return self.get(index)
+
+    def __iter__(self) -> Iterator[Tuple[int, dict]]:
+        """
+        Streams every entry as (global index, entry). Skips the cache so a full scan
+        doesn't throw out the entries that are actually hot.
+        """
+        for segment_number, segment in enumerate(self.segments):
+            if not len(segment):
+                continue
+
+            self._segment(segment_number)
+            start = self.starts[segment_number]
+            for local in range(len(segment)):
+                entry = segment.entry(local)
+                if entry is not None:
+                    yield start + local, entry
+
+    def search_by_key(self, key: str, value: Any) -> List[Tuple[int, dict]]:
+        """
+        Finds entries where a key equals a value. Entries whose raw bytes don't even
+        contain the encoded value are skipped without being decoded.
+        - key (str): The key to match on.
+        - value (Any): The value to match.
+        - Returns (List[Tuple[int, dict]]): (global index, entry) pairs.
+        """
+        try:
+            needles = {
+                json.dumps(value).encode("UTF-8"),
+                json.dumps(value, ensure_ascii=False).encode("UTF-8"),
+            }
+        except TypeError:
+            needles = None
+
+        matches = []
+        for segment_number, segment in enumerate(self.segments):
+            if not len(segment):
+                continue
+
+            self._segment(segment_number)
+            start = self.starts[segment_number]
+            for local in range(len(segment)):
+                if needles and not any(n in segment.raw(local) for n in needles):
+                    continue
+
+                entry = segment.entry(local)
+                if entry is not None and entry.get(key) == value:
+                    matches.append((start + local, entry))
+        return matches
+
+    def close(self) -> None:
+        """
+        Unmaps every file and drops the cache.
+        """
+        for segment in self._open_segments.values():
+            segment.close()
+        self._open_segments.clear()
+        self._cache.clear()
+        self._cached_bytes = 0
@@ -0,0 +1,509 @@
+"""
+Paraphrase lookups over past questions. Questions get embedded with a hashing-trick
+embedding (no model to download, works offline), kept as rows of a normalized NumPy
+matrix, and matched by cosine similarity. "whats the capital of france" finds
+"what is the capital city of France?", which the difflib search never would.
+Embeddings can't tell "turn the lights on" from "turn the lights off", so matches
+also have to agree on the words that flip an answer: negations, operators,
+numbers and dates (see guard_tokens()).
+"""
+
+import json
+import math
+import os
+import re
+import threading
+import zlib
+from typing import FrozenSet, Iterable, List, Optional, Tuple
+
+import numpy
+
+from telemetry import telemetry
+
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+# Words that say nothing about what a question is about
+_STOPWORDS = frozenset(
+    "a an the is are was were be been am do does did of to in on at for by with "
+    "and or it its this that these those what whats which who how can could would "
+    "should will you your me my i we our please tell about s".split()
+)
+
+
+def _stem(word: str) -> str:
+    """
+    Very light stemming, just enough that plurals and -ing forms line up.
+    """
+    for suffix in ("ing", "ies", "es", "ed", "s"):
+        if len(word) > len(suffix) + 2 and word.endswith(suffix):
+            return word[: -len(suffix)] + ("y" if suffix == "ies" else "")
+    return word
+
+
+# Words that turn a question into a different one, while barely moving its embedding
+_GUARD_WORDS = frozenset(
+    # negation
+    "not no never none nothing nobody without cannot cant dont doesnt didnt isnt "
+    "arent wasnt werent wont wouldnt shouldnt couldnt hasnt havent "
+    # direction and state
+    "on off up down open close start stop enable disable increase decrease more "
+    "less most least before after higher lower min max first last next previous "
+    # arithmetic
+    "plus minus times divided multiply multiplied subtract add remove "
+    # dates and times
+    "today tomorrow yesterday tonight now morning afternoon evening night weekend "
+    "monday tuesday wednesday thursday friday saturday sunday january february march "
+    "april june july august september october november december".split()
+)
+
+_NUMBER_WORDS = {
+    word: str(number)
+    for number, word in enumerate(
+        "zero one two three four five six seven eight nine ten eleven twelve".split()
+    )
+}
+
+_GUARD_TOKEN = re.compile(r"\d+(?:\.\d+)?|[a-z]+|(?<![a-z])[-+*/×÷=%<>^](?![a-z])")
+
+
+def guard_tokens(text: str) -> FrozenSet[str]:
+    """
+    The parts of a question that similar looking questions can't disagree on:
+    negations, direction words, operators, numbers and dates. Two questions only
+    count as paraphrases if these match exactly.
+    - text (str): The question.
+    - Returns (FrozenSet[str]): The guard tokens, number words as digits.
+    """
+    tokens = set()
+    for token in _GUARD_TOKEN.findall(text.lower().replace("'", "").replace("’", "")):
+        if token in _NUMBER_WORDS:
+            tokens.add(_NUMBER_WORDS[token])
+        elif not token.isalpha():
+            tokens.add(token)
+        elif token in _GUARD_WORDS:
+            tokens.add(token)
+        elif _stem(token) in _GUARD_WORDS:
+            tokens.add(_stem(token))
+    return frozenset(tokens)
+
+
+class HashingEmbedder:
+    """
+    Embeds text by hashing its features into a fixed number of buckets: content
+    words, word pairs and character trigrams. Texts about the same things share
+    features, so they end up pointing the same way. Not as smart as a trained
+    model, but it's free, deterministic and fast.
+    """
+
+    def __init__(self, dimensions: int = 256) -> None:
+        """
+        - dimensions (int): Size of the embeddings.
+        """
+        self.dimensions = dimensions
+
+    def _features(self, text: str) -> List[Tuple[str, float]]:
+        words = [
+            _stem(word)
+            for word in _WORD.findall(text.lower())
+            if word not in _STOPWORDS
+        ]
+
+        features = [(word, 1.0) for word in words]
+        features += [(f"{a} {b}", 0.5) for a, b in zip(words, words[1:])]
+        for word in words:
+            padded = f"<{word}>"
+            features += [(padded[i : i + 3], 0.25) for i in range(len(padded) - 2)]
+        return features
+
+    def embed(self, text: str) -> numpy.ndarray:
+        """
+        - text (str): The text.
+        - Returns (numpy.ndarray): Unit length float32 vector (all zeros for text
+          without any content words).
+        """
+        vector = numpy.zeros(self.dimensions, dtype=numpy.float32)
+        for feature, weight in self._features(text):
+            hashed = zlib.crc32(feature.encode("utf-8"))
+            # the top bit picks the sign, so collisions cancel out instead of piling up
+            vector[hashed % self.dimensions] += weight if hashed >> 31 else -weight
+
+        norm = numpy.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed_many(self, texts: Iterable[str]) -> numpy.ndarray:
+        """
+        - texts (Iterable[str]): The texts.
+        - Returns (numpy.ndarray): One row per text.
+        """
+        rows = [self.embed(text) for text in texts]
+        if not rows:
+            return numpy.zeros((0, self.dimensions), dtype=numpy.float32)
+        return numpy.stack(rows)
+
+
+class SemanticIndex:
+    """
+    Question -> answer pairs, searchable by meaning. Embeddings live in one matrix
+    that grows by doubling, so adding a row is amortized O(1).
+    Small indexes get searched exhaustively, one matrix-vector product plus
+    argpartition. Past exhaustive_below rows the rows get clustered around about
+    sqrt(rows) centroids (spherical k-means on a sample), and a search only scores
+    the rows in the nprobe clusters closest to the question, so it costs roughly
+    O(sqrt(rows)) instead of O(rows). That's approximate: a match sitting in a
+    cluster that didn't get probed is missed (on 10^5 synthetic rows the default
+    nprobe found about 90% of what a full scan did). New rows join their
+    nearest cluster. Clustering runs on a background thread whenever the index
+    doubles, searches keep using what they had until it's done, and rebuild()
+    does it right away.
+    On disk it's two append-only files in the index directory: raw float32 rows
+    and a JSON line per row, so adding a pair never rewrites anything. The
+    clusters get saved next to them, so a restart doesn't recluster.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[str] = "conversations/semantic",
+        embedder: Optional[HashingEmbedder] = None,
+        initial_capacity: int = 1024,
+        exhaustive_below: int = 20000,
+        nprobe: int = 16,
+    ) -> None:
+        """
+        Loads the index from directory, if it's been saved there before.
+        - directory (str, optional): Where the index files live. Keep it apart from
+          the history files. None keeps the index in memory only.
+        - embedder (HashingEmbedder, optional): Defaults to 256 dimensions.
+        - initial_capacity (int): Rows to allocate up front.
+        - exhaustive_below (int): Search every row until the index is this big.
+        - nprobe (int): Clusters to search once it's clustered.
+        """
+        self.embedder = embedder or HashingEmbedder()
+        self.directory = directory
+        self.exhaustive_below = exhaustive_below
+        self.nprobe = nprobe
+
+        self.matrix = numpy.zeros(
+            (initial_capacity, self.embedder.dimensions), dtype=numpy.float32
+        )
+        self.entries: List[dict] = []
+        self.lock = threading.Lock()
+
+        self.centroids: Optional[numpy.ndarray] = None  # None until clustered
+        self.clusters: List[numpy.ndarray] = []  # row numbers per centroid
+        self.appended: List[List[int]] = []  # rows added since the last training
+        self.trained_rows = 0
+        self._trainer: Optional[threading.Thread] = None
+
+        self.vectors_file = self.entries_file = self.clusters_file = None
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            name = f"semantic_{self.embedder.dimensions}"
+            self.vectors_file = os.path.join(directory, f"{name}.f32")
+            self.entries_file = os.path.join(directory, f"{name}.jsonl")
+            self.clusters_file = os.path.join(directory, f"{name}.clusters.npz")
+            self._load()
+            self._load_clusters()
+            with self.lock:
+                self._maybe_train()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _load(self) -> None:
+        """
+        Reads the saved rows back in. If the two files disagree (say the process died
+        between writes), the extra rows get dropped from both.
+        """
+        if not os.path.exists(self.entries_file):
+            return
+
+        with open(self.entries_file, "r", encoding="UTF-8") as f:
+            entries = []
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break  # half-written last line
+
+        vectors = numpy.fromfile(self.vectors_file, dtype=numpy.float32)
+        rows = min(len(entries), len(vectors) // self.embedder.dimensions)
+        vectors = vectors[: rows * self.embedder.dimensions].reshape(rows, -1)
+
+        self._reserve(rows)
+        self.matrix[:rows] = vectors
+        self.entries = entries[:rows]
+
+        if rows != len(entries) or vectors.nbytes != os.path.getsize(self.vectors_file):
+            telemetry.debug("semantic", "dropped a partly written row, kept %d", rows)
+            with open(self.entries_file, "w", encoding="UTF-8") as f:
+                f.writelines(json.dumps(entry) + "\n" for entry in self.entries)
+            vectors.tofile(self.vectors_file)
+
+    def _reserve(self, rows: int) -> None:
+        """
+        Makes room for at least this many rows, doubling the matrix as needed.
+        """
+        capacity = len(self.matrix)
+        if rows <= capacity:
+            return
+
+        while capacity < rows:
+            capacity *= 2
+        grown = numpy.zeros((capacity, self.embedder.dimensions), dtype=numpy.float32)
+        grown[: len(self.entries)] = self.matrix[: len(self.entries)]
+        self.matrix = grown
+
+    def _maybe_train(self) -> None:
+        """
+        Starts clustering in the background once there are exhaustive_below rows,
+        and again every time the index doubles. Searches stay exact (or use the old
+        clusters) until it's done. Call with the lock held.
+        """
+        rows = len(self.entries)
+        if (
+            rows < self.exhaustive_below
+            or rows < 2 * self.trained_rows
+            or self._trainer is not None
+        ):
+            return
+
+        self._trainer = threading.Thread(
+            target=self._train_in_background, args=(self.matrix, rows), daemon=True
+        )
+        self._trainer.start()
+
+    def _train_in_background(self, matrix: numpy.ndarray, rows: int) -> None:
+        try:
+            centroids, nearest = self._train(matrix, rows)
+            self._install(centroids, nearest)
+            self._save_clusters(centroids, nearest)
+        except Exception as e:
+            telemetry.debug("semantic", "clustering failed: %s", e)
+        finally:
+            self._trainer = None
+
+    def rebuild(self) -> None:
+        """
+        Clusters the index right away, in this thread, whatever its size. Waits for
+        a background run first, if there is one.
+        """
+        trainer = self._trainer
+        if trainer is not None:
+            trainer.join()
+
+        with self.lock:
+            matrix, rows = self.matrix, len(self.entries)
+        if rows:
+            centroids, nearest = self._train(matrix, rows)
+            self._install(centroids, nearest)
+            self._save_clusters(centroids, nearest)
+
+    @staticmethod
+    def _train(matrix: numpy.ndarray, rows: int) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Spherical k-means over a sample of the first rows of the matrix. Rows never
+        change once written, so this doesn't need the lock.
+        - Returns (Tuple[numpy.ndarray, numpy.ndarray]): The centroids, and the
+          nearest centroid for each of the rows.
+        """
+        data = matrix[:rows]
+        count = max(1, int(math.sqrt(rows)))
+        random = numpy.random.default_rng(0)  # same data, same clusters
+        sample = data[random.choice(rows, min(rows, count * 32), replace=False)]
+        centroids = sample[random.choice(len(sample), count, replace=False)].copy()
+
+        for _ in range(10):
+            nearest = numpy.argmax(sample @ centroids.T, axis=1)
+            sums = numpy.zeros_like(centroids)
+            numpy.add.at(sums, nearest, sample)
+            norms = numpy.linalg.norm(sums, axis=1)
+            used = norms > 0
+            # empty clusters keep their old centroid
+            centroids[used] = sums[used] / norms[used, None]
+
+        nearest = numpy.concatenate(
+            [
+                numpy.argmax(data[start : start + 65536] @ centroids.T, axis=1)
+                for start in range(0, rows, 65536)
+            ]
+        ).astype(numpy.int32)
+        return centroids, nearest
+
+    def _install(self, centroids: numpy.ndarray, nearest: numpy.ndarray) -> None:
+        """
+        Switches searches over to new clusters. Rows added after the ones in
+        nearest join their closest cluster.
+        """
+        count = len(centroids)
+        order = numpy.argsort(nearest, kind="stable")
+        bounds = numpy.searchsorted(nearest[order], numpy.arange(count + 1))
+        clusters = [order[bounds[i] : bounds[i + 1]] for i in range(count)]
+
+        with self.lock:
+            appended = [[] for _ in range(count)]
+            rows = len(self.entries)
+            if rows > len(nearest):
+                extra = self.matrix[len(nearest) : rows] @ centroids.T
+                for row, cluster in enumerate(
+                    numpy.argmax(extra, axis=1), len(nearest)
+                ):
+                    appended[cluster].append(row)
+
+            self.centroids = centroids
+            self.clusters = clusters
+            self.appended = appended
+            self.trained_rows = len(nearest)
+
+    def _save_clusters(self, centroids: numpy.ndarray, nearest: numpy.ndarray) -> None:
+        """
+        Writes the clusters next to the index, so loading it doesn't mean
+        clustering all over again.
+        """
+        if self.directory is None:
+            return
+
+        temporary = f"{self.clusters_file}.tmp"
+        with open(temporary, "wb") as f:
+            numpy.savez(f, centroids=centroids, nearest=nearest)
+        os.replace(temporary, self.clusters_file)
+
+    def _load_clusters(self) -> None:
+        """
+        Picks saved clusters back up, unless they cover rows the index doesn't
+        have anymore.
+        """
+        if not os.path.exists(self.clusters_file):
+            return
+
+        try:
+            with numpy.load(self.clusters_file) as saved:
+                centroids, nearest = saved["centroids"], saved["nearest"]
+        except (OSError, ValueError, KeyError) as e:
+            telemetry.debug("semantic", "couldn't read the saved clusters: %s", e)
+            return
+
+        if (
+            len(nearest) > len(self.entries)
+            or centroids.shape[1:] != (self.embedder.dimensions,)
+            or (len(nearest) and nearest.max() >= len(centroids))
+        ):
+            return
+        self._install(centroids, nearest)
+
+    def add_many(self, pairs: Iterable[Tuple[str, str]]) -> None:
+        """
+        Adds question -> answer pairs and appends them to the index files.
+        - pairs (Iterable[Tuple[str, str]]): (question, answer) pairs.
+        """
+        pairs = [(q, a) for q, a in pairs if q and a]
+        if not pairs:
+            return
+
+        vectors = self.embedder.embed_many(question for question, _ in pairs)
+        entries = [{"request": q, "answer": a} for q, a in pairs]
+
+        with self.lock:
+            start = len(self.entries)
+            self._reserve(start + len(entries))
+            self.matrix[start : start + len(entries)] = vectors
+            self.entries.extend(entries)
+
+            if self.centroids is not None:
+                nearest = numpy.argmax(vectors @ self.centroids.T, axis=1)
+                for row, cluster in enumerate(nearest, start):
+                    self.appended[cluster].append(row)
+
+            if self.directory is not None:
+                with open(self.vectors_file, "ab") as f:
+                    f.write(vectors.tobytes())
+                with open(self.entries_file, "a", encoding="UTF-8") as f:
+                    f.writelines(json.dumps(entry) + "\n" for entry in entries)
+
+            self._maybe_train()
+
+    def add(self, question: str, answer: str) -> None:
+        """
+        Adds one question -> answer pair.
+        """
+        self.add_many([(question, answer)])
+
+    def search_many(
+        self,
+        questions: List[str],
+        k: int = 5,
+        cutoff: float = 0.0,
+        confirm: bool = True,
+    ) -> List[List[Tuple[float, dict]]]:
+        """
+        Finds the closest stored questions for several questions in one go.
+        - questions (List[str]): The questions.
+        - k (int): Max matches per question, before confirming.
+        - cutoff (float): Minimum cosine similarity (0-1).
+        - confirm (bool): Drop matches whose guard_tokens() differ from the
+          question's, like "lights on" for "lights off".
+        - Returns (List[List[Tuple[float, dict]]]): Per question, (score, entry)
+          pairs, best first. Entries look like {"request", "answer"}.
+        """
+        queries = self.embedder.embed_many(questions)
+
+        with self.lock:
+            rows = len(self.entries)
+            if rows == 0 or k <= 0:
+                return [[] for _ in questions]
+
+            if self.centroids is None:
+                # rows are unit length -> cosine
+                scores = queries @ self.matrix[:rows].T
+                candidates = [numpy.arange(rows)] * len(questions)
+            else:
+                scores, candidates = [], []
+                nprobe = min(self.nprobe, len(self.centroids))
+                for query in queries:
+                    closest = numpy.argpartition(-(self.centroids @ query), nprobe - 1)[
+                        :nprobe
+                    ]
+                    rows_to_score = numpy.concatenate(
+                        [self.clusters[c] for c in closest]
+                        + [
+                            numpy.array(self.appended[c], dtype=numpy.intp)
+                            for c in closest
+                        ]
+                    )
+                    scores.append(self.matrix[rows_to_score] @ query)
+                    candidates.append(rows_to_score)
+            entries = self.entries
+
+        results = []
+        for question, query_scores, rows_scored in zip(questions, scores, candidates):
+            top_k = min(k, len(query_scores))
+            if not top_k:
+                results.append([])
+                continue
+
+            # argpartition is linear, only the k survivors get sorted
+            top = numpy.argpartition(-query_scores, top_k - 1)[:top_k]
+            ranked = top[numpy.argsort(-query_scores[top])]
+            matches = [
+                (float(query_scores[i]), entries[rows_scored[i]])
+                for i in ranked
+                if query_scores[i] >= cutoff
+            ]
+
+            if confirm and matches:
+                guards = guard_tokens(question)
+                matches = [
+                    (score, entry)
+                    for score, entry in matches
+                    if guard_tokens(entry["request"]) == guards
+                ]
+            results.append(matches)
+        return results
+
+    def search(
+        self, question: str, k: int = 5, cutoff: float = 0.0, confirm: bool = True
+    ) -> List[Tuple[float, dict]]:
+        """
+        Finds the stored questions closest to this one. See search_many.
+        """
+        return self.search_many([question], k, cutoff, confirm)[0]
@@ -0,0 +1,406 @@
+"""
+Multi-session websocket server. One process serves many voice or text conversations,
+each with its own history and confirmation state, while sharing the expensive stuff:
+the Vosk model, the answer cache, the pooled Groq client and the festival server.
+
+Protocol (one websocket per session):
+    client -> server
+        {"type": "hello", "session": "abc", "sample_rate": 16000, "audio": true}
+            Optional, has to come first. Reconnecting with the same session id picks
+            its history back up. "audio" asks for spoken replies.
+        binary frames
+            Mono 16-bit PCM at the session's sample rate.
+        {"type": "end"}        The user stopped talking, flush the recognizer.
+        {"type": "text", "text": "..."}     Ask something without audio.
+        {"type": "cancel"}     Drop the answer that's in progress.
+    server -> client
+        {"type": "ready", "session": "abc"}
+        {"type": "partial", "text": "..."}
+        {"type": "transcript", "text": "..."}
+        {"type": "answer", "text": "..."}
+        {"type": "audio", "sample_rate": 16000, "channels": 1, "bytes": 1234}
+            Followed by one binary frame with that much 16-bit PCM.
+        {"type": "error", "message": "..."}
+
+Usage:
+    python src/server.py --port 8765 --audio
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import re
+import uuid
+import wave
+from typing import Any, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+from websockets.asyncio.server import ServerConnection, serve
+from websockets.exceptions import ConnectionClosed
+
+from base import Model
+from cache import AnswerCache, AudioCache
+from festival import DEFAULT_VOICE, FestivalServer
+from scheduler import RequestScheduler
+from startup import vosk_models
+from telemetry import telemetry
+from text import Formatter
+
+
+load_dotenv()
+
+_SESSION_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class Session:
+    """
+    One conversation. Owns its own Model (history, confirmation state) and recognizer.
+    """
+
+    def __init__(
+        self,
+        session_id: str,
+        websocket: ServerConnection,
+        model: Model,
+        recognizer,
+        audio: bool = False,
+    ) -> None:
+        self.id = session_id
+        self.websocket = websocket
+        self.model = model
+        self.recognizer = recognizer
+        self.audio = audio
+
+        self.answer_task: Optional[asyncio.Task] = None
+        self.last_partial = ""
+
+    async def send(self, **message) -> None:
+        await self.websocket.send(json.dumps(message))
+
+
+class AssistantServer:
+    """
+    Accepts websocket sessions and runs each conversation on the shared resources.
+    """
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = 8765,
+        vosk_model: str = "src/models/model/",
+        history_directory: str = "conversations/sessions",
+        max_sessions: int = 64,
+        audio: bool = False,
+        answer_cache: Optional[AnswerCache] = None,
+    ) -> None:
+        """
+        Sets up the shared resources. The Vosk model starts loading right away.
+        - host (str): Interface to listen on.
+        - port (int): Port to listen on.
+        - vosk_model (str): Path to the Vosk model every session shares.
+        - history_directory (str): Each session keeps its history in a subdirectory here.
+        - max_sessions (int): Connections past this get turned away.
+        - audio (bool): Render spoken replies with a shared festival server.
+        - answer_cache (AnswerCache, optional): Shared answer cache. Redis if REDIS_URL
+          is set and reachable, an in-process LRU otherwise.
+        Paraphrase indexes aren't shared, each session's only holds its own answers.
+        """
+        self.host = host
+        self.port = port
+        self.vosk_model = vosk_model
+        self.history_directory = history_directory
+        self.max_sessions = max_sessions
+
+        self.http_client = Model.create_http_client()
+        self.client = Model.create_client(
+            asynchronous=True, http_client=self.http_client
+        )
+        # one scheduler for every session, since they all share the API key's limits
+        self.scheduler = RequestScheduler(self.client)
+        self.answer_cache = answer_cache or Model.create_answer_cache()
+
+        self.festival = FestivalServer(voice=DEFAULT_VOICE) if audio else None
+        self.audio_cache = AudioCache() if audio else None
+
+        # None while a session is still being set up, so its slot is already taken
+        self.sessions: Dict[str, Optional[Session]] = {}
+
+        vosk_models.load(self.vosk_model)
+
+    async def _open_session(
+        self, websocket: ServerConnection
+    ) -> Tuple[Optional[Session], Any]:
+        """
+        Reads the optional hello message and builds the session.
+        - Returns (Tuple[Session | None, Any]): The session (None if it was turned away),
+          and the first message if it wasn't a hello, so it still gets handled.
+        """
+        hello = {}
+        first = None
+        try:
+            first = await asyncio.wait_for(websocket.recv(), timeout=2.0)
+            if isinstance(first, str):
+                message = json.loads(first)
+                if isinstance(message, dict) and message.get("type") == "hello":
+                    hello, first = message, None
+        except (asyncio.TimeoutError, json.JSONDecodeError):
+            pass
+        except ConnectionClosed:
+            return None, None
+
+        try:
+            sample_rate = int(hello.get("sample_rate", 16000))
+            if sample_rate <= 0:
+                raise ValueError(sample_rate)
+        except (TypeError, ValueError):
+            await websocket.send(
+                json.dumps({"type": "error", "message": "bad sample rate"})
+            )
+            return None, None
+
+        session_id = str(hello.get("session") or uuid.uuid4().hex)
+        if not _SESSION_ID.match(session_id) or session_id in self.sessions:
+            await websocket.send(
+                json.dumps({"type": "error", "message": "bad or busy session id"})
+            )
+            return None, None
+
+        if len(self.sessions) >= self.max_sessions:
+            await websocket.close(1013, "server - too many sessions")
+            return None, None
+
+        # hold the slot before awaiting anything, or two hellos could both get it
+        self.sessions[session_id] = None
+        try:
+            directory = os.path.join(self.history_directory, session_id)
+            history = await asyncio.to_thread(Model.create_history, directory)
+            semantic_index = await asyncio.to_thread(
+                Model.create_semantic_index, directory, history
+            )
+            model = Model(
+                asynchronous=True,
+                client=self.client,
+                answer_cache=self.answer_cache,
+                history=history,
+                semantic_index=semantic_index,
+                scheduler=self.scheduler,
+            )
+            recognizer = await asyncio.to_thread(
+                vosk_models.recognizer, self.vosk_model, sample_rate
+            )
+        except BaseException:
+            self.sessions.pop(session_id, None)
+            raise
+
+        session = Session(
+            session_id,
+            websocket,
+            model,
+            recognizer,
+            audio=bool(hello.get("audio")) and self.festival is not None,
+        )
+        self.sessions[session_id] = session
+        telemetry.debug(
+            "server", "session %s opened (%d active)", session_id, len(self.sessions)
+        )
+
+        return session, first
+
+    async def _close_session(self, session: Session) -> None:
+        if session.answer_task is not None:
+            session.answer_task.cancel()
+            await asyncio.gather(session.answer_task, return_exceptions=True)
+
+        self.sessions.pop(session.id, None)
+        # an answer's history write can still be finishing on a worker thread
+        await asyncio.to_thread(session.model.close_history)
+        telemetry.debug(
+            "server", "session %s closed (%d active)", session.id, len(self.sessions)
+        )
+
+    async def handler(self, websocket: ServerConnection) -> None:
+        """
+        Runs one connection from hello to hang-up.
+        """
+        session, first = await self._open_session(websocket)
+        if session is None:
+            return
+
+        try:
+            await session.send(type="ready", session=session.id)
+            if first is not None:
+                await self._handle(session, first)
+
+            async for message in websocket:
+                await self._handle(session, message)
+        except ConnectionClosed:
+            pass
+        finally:
+            await self._close_session(session)
+
+    async def _handle(self, session: Session, message) -> None:
+        """
+        Handles one incoming message.
+        """
+        if isinstance(message, bytes):
+            await self._on_audio(session, message)
+            return
+
+        try:
+            request = json.loads(message)
+        except json.JSONDecodeError:
+            await session.send(type="error", message="messages have to be JSON")
+            return
+
+        if not isinstance(request, dict):
+            await session.send(type="error", message="messages have to be JSON objects")
+            return
+
+        kind = request.get("type")
+        if kind == "text" and request.get("text") and isinstance(request["text"], str):
+            self._answer(session, request["text"])
+        elif kind == "end":
+            result = await asyncio.to_thread(session.recognizer.FinalResult)
+            await self._on_transcript(session, json.loads(result).get("text", ""))
+        elif kind == "cancel":
+            if session.answer_task is not None:
+                session.answer_task.cancel()
+        else:
+            await session.send(type="error", message=f"unknown message type {kind}")
+
+    async def _on_audio(self, session: Session, pcm: bytes) -> None:
+        """
+        Feeds audio to the session's recognizer. Vosk decides where utterances end.
+        """
+        if await asyncio.to_thread(session.recognizer.AcceptWaveform, pcm):
+            result = json.loads(session.recognizer.Result())
+            await self._on_transcript(session, result.get("text", ""))
+            return
+
+        partial = json.loads(session.recognizer.PartialResult()).get("partial", "")
+        if partial and partial != session.last_partial:
+            session.last_partial = partial
+            await session.send(type="partial", text=partial)
+
+    async def _on_transcript(self, session: Session, text: str) -> None:
+        session.last_partial = ""
+        if not text:
+            return
+
+        await session.send(type="transcript", text=text)
+        self._answer(session, text)
+
+    def _answer(self, session: Session, text: str) -> None:
+        """
+        Starts answering in the background, so audio keeps flowing in meanwhile.
+        A new question barges in on the previous answer.
+        """
+        if session.answer_task is not None and not session.answer_task.done():
+            session.answer_task.cancel()
+
+        session.answer_task = asyncio.create_task(self._reply(session, text))
+
+    async def _reply(self, session: Session, text: str) -> None:
+        try:
+            reply = await session.model.aask(text)
+            await session.send(type="answer", text=reply)
+
+            if session.audio:
+                pcm, sample_rate, channels = await asyncio.to_thread(
+                    self._render, reply
+                )
+                await session.send(
+                    type="audio",
+                    sample_rate=sample_rate,
+                    channels=channels,
+                    bytes=len(pcm),
+                )
+                await session.websocket.send(pcm)
+        except asyncio.CancelledError:
+            pass
+        except ConnectionClosed:
+            pass
+        except Exception as e:
+            telemetry.debug("server", "session %s failed to answer: %s", session.id, e)
+            try:
+                await session.send(type="error", message="couldn't answer that")
+            except ConnectionClosed:
+                pass
+
+    def _render(self, text: str) -> Tuple[bytes, int, int]:
+        """
+        Renders a reply with the shared festival server, through the audio cache.
+        - text (str): The reply.
+        - Returns (Tuple[bytes, int, int]): (pcm, sample rate, channels).
+        """
+        text = Formatter(text).format()
+        key = AudioCache.key(text, DEFAULT_VOICE)
+
+        cached = self.audio_cache.get(key)
+        if cached:
+            return cached
+
+        pcm, sample_rate, channels = b"", 16000, 1
+        for data in self.festival.render(text):
+            with wave.open(io.BytesIO(data), "rb") as wave_file:
+                sample_rate = wave_file.getframerate()
+                channels = wave_file.getnchannels()
+                pcm += wave_file.readframes(wave_file.getnframes())
+
+        self.audio_cache.set(key, pcm, sample_rate, channels)
+        return pcm, sample_rate, channels
+
+    async def serve_forever(self) -> None:
+        """
+        Listens until cancelled, then cleans up the shared resources.
+        """
+        try:
+            async with serve(self.handler, self.host, self.port, max_size=2**22):
+                telemetry.debug(
+                    "server", "listening on ws://%s:%d", self.host, self.port
+                )
+                await asyncio.get_running_loop().create_future()
+        finally:
+            if self.festival is not None:
+                self.festival.stop()
+            self.scheduler.close()
+            await self.http_client.aclose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Serve assistant sessions over websockets."
+    )
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--model", default="src/models/model/", help="Vosk model path")
+    parser.add_argument("--history", default="conversations/sessions")
+    parser.add_argument("--max-sessions", type=int, default=64)
+    parser.add_argument("--audio", action="store_true", help="send spoken replies")
+    args = parser.parse_args()
+
+    server = AssistantServer(
+        host=args.host,
+        port=args.port,
+        vosk_model=args.model,
+        history_directory=args.history,
+        max_sessions=args.max_sessions,
+        audio=args.audio,
+    )
+
+    # TELEMETRY_TRACE / TELEMETRY_PORT turn on the trace file and /metrics
+    telemetry.configure_from_env()
+    telemetry.collect("scheduler", server.scheduler.stats)
+
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        telemetry.close()
+
+
+if __name__ == "__main__":
+    main()
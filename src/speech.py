@@ -2,22 +2,28 @@
 docstring
 """
 
+import io
 import json
 import os
 import queue
-import sys
 import threading
 import time as t
 import subprocess
+import wave
 
-from typing import Any
+from typing import Any, Iterable, List, Optional, Tuple
 
 import numpy
 import sounddevice
-import vosk
-import pyttsx3
 
-from text import Formatter
+from cache import AudioCache
+from dispatch import DispatchPolicy, TranscriptDispatcher
+from fallback import FallbackVoice
+from festival import DEFAULT_VOICE, FestivalServer
+from text import Formatter, SentenceSplitter
+from startup import vosk_models
+from telemetry import telemetry
+from vad import PreRollBuffer, VoiceActivityDetector
 
 
 class SpeechInputManager:
@@ -29,14 +35,36 @@ class SpeechInputManager:
         self,
         model: str = "src/models/model/",
         sample_rate: int = 16000,
-        threshold: int = -30,
+        threshold: float = -45.0,
         silence_timeout: float = 1.0,
+        pre_roll: float = 0.3,
+        endpointing: str = "vosk",
         on_speech_start=None,  # Start Event
         on_speech_create=None,  # Callback that fires when speech is finalized
         on_partial_create=None,  # Callback that fires when each word individually is finalized
+        dispatch_workers: int = 1,
+        dispatch_queue_size: int = 4,
+        dispatch_policy: DispatchPolicy = DispatchPolicy.COALESCE,
+        festival_server: bool = False,
+        audio_cache: Optional[AudioCache] = None,
     ) -> None:
         """
         Initializes the speech input manager.
+        on_speech_create runs on a dispatcher thread, not the recognizer thread, so a
+        slow answer doesn't hold up recognition. The dispatch_* settings control how
+        many workers run it and what happens to transcripts that pile up meanwhile.
+        festival_server keeps one festival process around for every response,
+        instead of starting text2wave each time.
+        Rendered audio is cached by formatted text and voice settings in audio_cache
+        (memory plus cache/audio on disk by default), so repeated replies play instantly.
+        threshold is the quietest level (in dBFS, so 0 is a full scale signal) that can
+        start speech; -45 is about a quiet room. On top of that the detector tracks the
+        room's noise floor, and silence_timeout is how long it waits after the last
+        voiced block before calling the utterance done.
+        The last pre_roll seconds before speech starts get sent along with it, so the
+        first word doesn't get clipped. endpointing picks what happens when speech ends:
+        "vosk" flushes the recognizer and keeps whatever it heard, "reset" throws away
+        anything it hadn't finalized yet.
         """
         if not os.path.exists(model):
             raise FileNotFoundError(
@@ -48,62 +76,113 @@ class SpeechInputManager:
         self.threshold = threshold
         self.sample_rate = sample_rate
         self.silence_timeout = silence_timeout
+        self.endpointing = endpointing
+
+        if endpointing not in ("vosk", "reset"):
+            raise ValueError(f"vosk - unknown endpointing mode {endpointing}")
 
         self.on_speech_start = on_speech_start
         self.on_speech_create = on_speech_create
         self.on_partial_create = on_partial_create
 
-        self.audio_queue = queue.Queue()
+        self.audio_queue = queue.Queue()  # (perf_counter_ns when queued, audio or None)
+        self.dispatcher = TranscriptDispatcher(
+            self._dispatch_transcript,
+            workers=dispatch_workers,
+            max_pending=dispatch_queue_size,
+            policy=dispatch_policy,
+        )
 
         self.running = False
         self.transcribing = False
-        self.last_sound_time = 0
+        self.vad = VoiceActivityDetector(
+            min_onset_dbfs=threshold, hangover=silence_timeout
+        )
+        self.pre_roll = PreRollBuffer(int(pre_roll * sample_rate) * 2)
 
-        self.service = vosk.Model(self.model)
-        self.recognizer = vosk.KaldiRecognizer(self.service, sample_rate)
+        # the model loads in the background and is shared with every other manager
+        # using the same path, the recognizer gets made once it's needed
+        vosk_models.load(self.model)
+        self.recognizer = None
 
         self.service_stream = None
         self.service_thread = None
 
-        self.synth_response_file = "response.txt"
-        self.synth_playback_process = None
+        self.synth_playing = False
         self.synth_process_lock = threading.Lock()
 
+        self.festival_voice = list(DEFAULT_VOICE)
+        self.festival_server = (
+            FestivalServer(voice=self.festival_voice) if festival_server else None
+        )
+        self.audio_cache = audio_cache or AudioCache()
+
+        self.playback_queue = queue.Queue()
+        self.playback_thread = None
+        self.playback_generation = (
+            0  # bumped on every interrupt, stale audio gets skipped
+        )
+
         self.fallback_voices = ["female", "zira"]
+        self.fallback_voice = FallbackVoice(self.fallback_voices, rate=150, volume=0.9)
 
     def audio_callback(
         self, indata: bytes = None, frames=None, time=None, status: Any = None
     ) -> None:
         """
         Processes incoming audio and handles transcription triggers.
+        Runs on PortAudio's thread, so it stays cheap: the VAD works on the buffer in
+        place, and a block only gets copied out when it's going to the recognizer.
+        Pauses shorter than silence_timeout go through too, so words don't get glued together.
         """
-        if status:
-            print(f"speech - audio callback status: {status}", file=sys.stderr)
+        started = t.perf_counter_ns()
 
-        data = bytes(indata)
-        audio = numpy.frombuffer(data, dtype=numpy.int16)
-        rms = numpy.sqrt(numpy.mean(audio.astype(numpy.float32) ** 2))
-        decibels = 20 * numpy.log10(rms) if rms > 0 else -numpy.inf
+        if status:
+            telemetry.debug("speech", "audio callback status: %s", status)
 
-        current_time = t.time()
+        speaking, speech_started, speech_ended = self.vad.process(indata, t.monotonic())
 
-        if decibels > self.threshold:
-            self.last_sound_time = current_time
+        if speech_started:
+            self.transcribing = True
+            telemetry.mark("speech.start")
 
-            if not self.transcribing:
-                self.transcribing = True
+            if self.on_speech_start:
+                self.on_speech_start()
 
-                if self.on_speech_start:
-                    self.on_speech_start()
+            # only audio that never went to the recognizer is in here, so nothing gets heard twice
+            lead_in = self.pre_roll.slices()
+            if lead_in:
+                self.audio_queue.put((started, b"".join(lead_in)))
+            self.pre_roll.clear()
 
-            self.audio_queue.put(data)
+        if speaking:
+            self.audio_queue.put((started, bytes(indata)))
         else:
-            if (
-                self.transcribing
-                and (current_time - self.last_sound_time) > self.silence_timeout
-            ):
+            self.pre_roll.write(indata)
+
+            if speech_ended:
                 self.transcribing = False
-                self.audio_queue.put(None)  # this'll signal the recognizer to reset
+                # end of utterance, see endpointing
+                self.audio_queue.put((started, None))
+                telemetry.since("speech.start", "vad.utterance")
+                telemetry.mark("speech.end")
+
+        elapsed = t.perf_counter_ns() - started
+        self.vad.record_callback(elapsed)
+        telemetry.observe("vad.callback", elapsed / 1e9)
+
+    def callback_stats(self) -> dict:
+        """
+        - Returns (dict): Audio callback timing plus the VAD's current levels.
+        """
+        return self.vad.stats()
+
+    @property
+    def service(self):
+        """
+        The shared vosk.Model. Waits for it to finish loading.
+        """
+        return vosk_models.get(self.model)
 
     def run(self) -> None:
         """
@@ -122,6 +201,7 @@ class SpeechInputManager:
         )
 
         self.service_stream.start()
+        self.dispatcher.start()
 
         self.service_thread = threading.Thread(target=self._process_audio_queue)
         self.service_thread.start()
@@ -142,10 +222,28 @@ class SpeechInputManager:
         if self.service_thread is not None:
             self.service_thread.join()
 
+        self.dispatcher.stop()
+        self.stop_playback()
+
+        if self.festival_server is not None:
+            self.festival_server.stop()
+
+        self.fallback_voice.stop()
+
+    def _dispatch_transcript(self, text: str) -> None:
+        """
+        Runs on a dispatcher worker. Hands a finished transcript to on_speech_create.
+        """
+        if self.on_speech_create:
+            self.on_speech_create(text)
+
     def synthesize(self, text: str = None, use_festival: bool = True) -> None:
         """
         Speaks the given text. Defaults to using Festival if available.
         Falls back to pyttsx3 if needed. Make sure you have the required tools installed.
+        Festival audio never touches the disk: text goes in over a pipe (or the
+        festival server socket), audio comes back in memory and gets queued for
+        playback, so this returns as soon as rendering is done.
         """
         assert (
             text is not None
@@ -154,90 +252,253 @@ class SpeechInputManager:
         text = Formatter(text).format()
 
         if use_festival:
+            generation = self.playback_generation
             try:
-                with open(self.synth_response_file, "w", encoding="UTF-8") as f:
-                    f.write(text)
-
-                subprocess.run(
-                    [
-                        "text2wave",
-                        "-eval",
-                        "(voice_kal_diphone)",
-                        "-eval",
-                        "(Parameter.set 'Duration_Stretch 1)",
-                        "-eval",
-                        "(set! int_target_mean 130)",
-                        "response.txt",
-                        "-o",
-                        "response.wav",
-                    ],
-                    check=True,
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.DEVNULL,
+                samples, sample_rate = self._cached_render(text)
+            except (subprocess.CalledProcessError, OSError, RuntimeError):
+                telemetry.debug(
+                    "sim",
+                    "could not synthesize voice with festival."
+                    "Please ensure you have followed the festival installation instructions.",
                 )
+                return
 
-                with self.synth_process_lock:
-                    self.synth_playback_process = subprocess.Popen(
-                        ["aplay", "response.wav"],
-                        stdout=subprocess.DEVNULL,
-                        stderr=subprocess.DEVNULL,
-                    )
-            except subprocess.CalledProcessError:
-                print(
-                    (
-                        "sim - could not synthesize voice with festival."
-                        "Please ensure you have aplay installed,"
-                        "and have followed the festival installation instructions."
-                    )
+            self._queue_playback(generation, samples, sample_rate)
+            return
+
+        # one long-lived engine, so no per-utterance setup and barge-in works here too
+        self.fallback_voice.say(text)
+
+        return
+
+    def _cached_render(self, text: str) -> Tuple[numpy.ndarray, int]:
+        """
+        Renders text with festival, going through the audio cache.
+        - text (str): Already formatted text to speak.
+        - Returns (Tuple[numpy.ndarray, int]): int16 samples and their sample rate.
+        """
+        key = AudioCache.key(text, self.festival_voice)
+
+        cached = self.audio_cache.get(key)
+        if cached:
+            pcm, sample_rate, channels = cached
+            return (
+                numpy.frombuffer(pcm, dtype=numpy.int16).reshape(-1, channels),
+                sample_rate,
+            )
+
+        samples, sample_rate = self._render_festival(text)
+        self.audio_cache.set(key, samples.tobytes(), sample_rate, samples.shape[1])
+        return samples, sample_rate
+
+    def warm_up(self, phrases: Iterable[str]) -> None:
+        """
+        Pre-renders phrases into the audio cache without playing them, so fixed
+        replies play instantly the first time too. Fine to run on a background thread.
+        - phrases (Iterable[str]): Things the assistant is going to say a lot.
+        """
+        for phrase in phrases:
+            try:
+                self._cached_render(Formatter(phrase).format())
+            except (subprocess.CalledProcessError, OSError, RuntimeError):
+                telemetry.debug(
+                    "sim",
+                    "could not pre-render phrase with festival, skipping warm-up.",
                 )
-            finally:
-                if os.path.exists(self.synth_response_file):
-                    os.remove(self.synth_response_file)
+                return
 
-            return
+    def _festival_command(self) -> List[str]:
+        """
+        Builds the text2wave command line for our voice settings. Reads the text from
+        stdin and writes the wav to stdout.
+        - Returns (List[str]): The command to run.
+        """
+        command = ["text2wave"]
+        for expression in self.festival_voice:
+            command += ["-eval", expression]
+        return command + ["-"]
 
-        engine = pyttsx3.init()
+    def _render_festival(self, text: str) -> Tuple[numpy.ndarray, int]:
+        """
+        Renders text with festival, entirely in memory. Uses the persistent festival
+        server if it's enabled, a text2wave pipe otherwise.
+        - text (str): Already formatted text to speak.
+        - Returns (Tuple[numpy.ndarray, int]): int16 samples and their sample rate.
+        """
+        engine = "server" if self.festival_server is not None else "text2wave"
+        with telemetry.span("tts.render", engine=engine, chars=len(text)):
+            if self.festival_server is not None:
+                waves = self.festival_server.render(text)
+            else:
+                waves = [
+                    subprocess.run(
+                        self._festival_command(),
+                        input=text.encode("UTF-8"),
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.DEVNULL,
+                        check=True,
+                    ).stdout
+                ]
 
-        voices = engine.getProperty("voices")
-        for voice in voices:
-            if any(fallback in voice.name.lower() for fallback in self.fallback_voices):
-                engine.setProperty("voice", voice.id)
-                break
+        decoded = [self._decode_wave(wave) for wave in waves if wave]
+        if not decoded:
+            raise RuntimeError("sim - festival returned no audio")
+
+        sample_rate = decoded[0][1]
+        return numpy.concatenate([samples for samples, _ in decoded]), sample_rate
 
-        engine.setProperty("rate", 150)
-        engine.setProperty("volume", 0.9)
+    @staticmethod
+    def _decode_wave(data: bytes) -> Tuple[numpy.ndarray, int]:
+        """
+        Decodes an in-memory 16-bit wav file.
+        - data (bytes): The wav file.
+        - Returns (Tuple[numpy.ndarray, int]): Samples shaped (frames, channels), and the rate.
+        """
+        with wave.open(io.BytesIO(data), "rb") as wave_file:
+            channels = wave_file.getnchannels()
+            sample_rate = wave_file.getframerate()
+            frames = wave_file.readframes(wave_file.getnframes())
 
-        engine.say(text)
-        engine.runAndWait()
+        samples = numpy.frombuffer(frames, dtype=numpy.int16).reshape(-1, channels)
+        return samples, sample_rate
 
-        return
+    def _queue_playback(
+        self, generation: int, samples: numpy.ndarray, sample_rate: int
+    ) -> None:
+        """
+        Queues rendered audio for the playback thread, starting it if needed.
+        - generation (int): playback_generation from before rendering started.
+        - samples (numpy.ndarray): int16 samples.
+        - sample_rate (int): Their sample rate.
+        """
+        if self.playback_thread is None or not self.playback_thread.is_alive():
+            self.playback_thread = threading.Thread(
+                target=self._process_playback_queue, daemon=True
+            )
+            self.playback_thread.start()
+
+        self.playback_queue.put((generation, samples, sample_rate))
+
+    def _process_playback_queue(self) -> None:
+        """
+        Plays queued audio back to back through sounddevice.
+        Anything queued before the last interrupt gets skipped.
+        """
+        while True:
+            generation, samples, sample_rate = self.playback_queue.get()
+
+            with self.synth_process_lock:
+                if generation != self.playback_generation:
+                    continue
+
+                sounddevice.play(samples, sample_rate)
+                self.synth_playing = True
+
+            # only the first sentence after an utterance counts, the mark gets used up
+            telemetry.since("speech.end", "pipeline.response")
+
+            sounddevice.wait()
+
+            with self.synth_process_lock:
+                self.synth_playing = False
+
+    def stop_playback(self) -> None:
+        """
+        Cuts off whatever is playing and drops everything still queued.
+        Hook this up to on_speech_start for barge-in.
+        """
+        with self.synth_process_lock:
+            self.playback_generation += 1
+
+            if self.synth_playing:
+                sounddevice.stop()
+                self.synth_playing = False
+
+        self.fallback_voice.interrupt()
+
+    def synthesize_stream(
+        self, chunks: Iterable[str], use_festival: bool = True
+    ) -> None:
+        """
+        Speaks streamed text sentence by sentence. Each sentence gets formatted and
+        rendered as soon as it's complete, then queued for playback, so audio starts
+        after the first sentence instead of after the whole answer. Returns once
+        everything is queued. Stops pulling chunks if playback gets interrupted.
+
+        - chunks (Iterable[str]): Text pieces, e.g. from Model.ask_stream().
+        - use_festival (bool): Use festival, or speak each sentence with pyttsx3.
+        """
+        generation = self.playback_generation
+        splitter = SentenceSplitter()
+
+        def speak(sentence: str) -> None:
+            if generation == self.playback_generation:
+                self.synthesize(sentence, use_festival=use_festival)
+
+        for chunk in chunks:
+            for sentence in splitter.feed(chunk):
+                speak(sentence)
+
+            if generation != self.playback_generation:
+                # barged in, no point generating the rest
+                if hasattr(chunks, "close"):
+                    chunks.close()
+                return
+
+        rest = splitter.flush()
+        if rest:
+            speak(rest)
 
     def _process_audio_queue(self):
         """
-        Processes audio data from the queue.
+        Processes audio data from the queue. Audio that arrives while the model is
+        still loading just waits in the queue.
         """
+        if self.recognizer is None:
+            try:
+                self.recognizer = vosk_models.recognizer(self.model, self.sample_rate)
+            except Exception as e:
+                telemetry.debug("vosk", "couldn't load model: %s", e)
+                return
+
         while self.running:
             try:
-                data = self.audio_queue.get(timeout=0.1)
+                queued, data = self.audio_queue.get(timeout=0.1)
+                telemetry.observe(
+                    "audio.queue_wait", (t.perf_counter_ns() - queued) / 1e9
+                )
 
                 if data is None:
-                    self.recognizer.Reset()
+                    if self.endpointing == "reset":
+                        self.recognizer.Reset()
+                        continue
+
+                    # FinalResult resets too, but hands back the words it was still holding on to
+                    with telemetry.span("vosk.final_result"):
+                        final = self.recognizer.FinalResult()
+                    text = json.loads(final).get("text", "")
+                    if text and self.on_speech_create:
+                        self.dispatcher.submit(text)
                     continue
 
-                if self.transcribing:
-                    if self.recognizer.AcceptWaveform(data):
-                        result = self.recognizer.Result()
-                        text = json.loads(result).get("text", "")
-
-                        if text and self.on_speech_create:
-                            self.on_speech_create(text)
-                    else:
-                        partial = self.recognizer.PartialResult()
-                        text = json.loads(partial).get("partial", "")
-                        if text and self.on_partial_create:
-                            self.on_partial_create(text)
+                # the queue only ever holds speech, and blocks still queued when the
+                # utterance ended belong to it, so they go in regardless of transcribing
+                with telemetry.span("vosk.accept_waveform"):
+                    accepted = self.recognizer.AcceptWaveform(data)
+
+                if accepted:
+                    result = self.recognizer.Result()
+                    text = json.loads(result).get("text", "")
+
+                    if text and self.on_speech_create:
+                        self.dispatcher.submit(text)
+                else:
+                    partial = self.recognizer.PartialResult()
+                    text = json.loads(partial).get("partial", "")
+                    if text and self.on_partial_create:
+                        self.on_partial_create(text)
             except queue.Empty:
                 continue
             except Exception as e:
-                print(e)
+                telemetry.debug("vosk", "%s", e)
                 break
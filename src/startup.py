@@ -0,0 +1,146 @@
+"""
+Startup plumbing. Loading the Vosk model, the conversation history and the Groq
+client are all slow and don't depend on each other, so they run side by side, and
+a Vosk model gets loaded once no matter how many recognizers use it.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import vosk
+
+
+class VoskModelRegistry:
+    """
+    Loads each Vosk model once and hands out KaldiRecognizers on top of it. A model
+    is only a few hundred megabytes of read-only data, so any number of microphones
+    or sessions can share it, each with its own recognizer.
+    """
+
+    def __init__(self) -> None:
+        self.models: Dict[str, Future] = {}
+        self.lock = threading.Lock()
+
+    def load(self, path: str) -> Future:
+        """
+        Starts loading a model in the background, unless it's loading or loaded already.
+        - path (str): Path to the Vosk model.
+        - Returns (Future): Resolves to the vosk.Model.
+        """
+        path = os.path.abspath(path)
+
+        with self.lock:
+            if path in self.models:
+                return self.models[path]
+
+            if not os.path.exists(path):
+                raise FileNotFoundError(
+                    f"vosk - model was not found at path {path}. "
+                    "Download a model from here -> https://alphacephei.com/vosk/models"
+                )
+
+            future = Future()
+            self.models[path] = future
+
+        def load_model() -> None:
+            try:
+                future.set_result(vosk.Model(path))
+            except Exception as e:
+                with self.lock:
+                    self.models.pop(path, None)  # let the next caller try again
+                future.set_exception(e)
+
+        threading.Thread(target=load_model, daemon=True).start()
+        return future
+
+    def get(self, path: str) -> vosk.Model:
+        """
+        Gets a model, waiting for it to load if it has to.
+        - path (str): Path to the Vosk model.
+        - Returns (vosk.Model): The shared model.
+        """
+        return self.load(path).result()
+
+    def recognizer(self, path: str, sample_rate: int = 16000) -> vosk.KaldiRecognizer:
+        """
+        Makes a new recognizer on the shared model.
+        - path (str): Path to the Vosk model.
+        - sample_rate (int): Sample rate of the audio it will get.
+        - Returns (vosk.KaldiRecognizer): A fresh recognizer.
+        """
+        return vosk.KaldiRecognizer(self.get(path), sample_rate)
+
+
+vosk_models = VoskModelRegistry()
+
+
+class Startup:
+    """
+    Runs independent startup tasks in parallel and keeps track of how long each took.
+    Tasks start as soon as they're submitted; result() waits for just the one you need.
+    """
+
+    def __init__(self, workers: int = 4) -> None:
+        """
+        - workers (int): How many tasks can run at once.
+        """
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.tasks: Dict[str, Future] = {}
+        self.timings: Dict[str, Tuple[float, float]] = {}
+        self.started = time.perf_counter()
+
+    def submit(self, name: str, task: Callable[..., Any], *args, **kwargs) -> Future:
+        """
+        Starts a task in the background.
+        - name (str): Name for the task, used by result() and the report.
+        - task (Callable): What to run.
+        - Returns (Future): Resolves to whatever the task returns.
+        """
+
+        def timed() -> Any:
+            began = time.perf_counter()
+            try:
+                return task(*args, **kwargs)
+            finally:
+                self.timings[name] = (began, time.perf_counter())
+
+        self.tasks[name] = self.executor.submit(timed)
+        return self.tasks[name]
+
+    def result(self, name: str, timeout: Optional[float] = None) -> Any:
+        """
+        Waits for one task and returns its result. Re-raises whatever it raised.
+        - name (str): The task's name.
+        - timeout (float, optional): Max seconds to wait.
+        """
+        return self.tasks[name].result(timeout)
+
+    def wait(self) -> Dict[str, Any]:
+        """
+        Waits for every task.
+        - Returns (dict): Results by name.
+        """
+        results = {name: future.result() for name, future in self.tasks.items()}
+        self.executor.shutdown(wait=False)
+        return results
+
+    def report(self) -> str:
+        """
+        - Returns (str): When each finished task started and how long it took, and the
+          overall wall time so far.
+        """
+        lines = []
+        for name, (began, ended) in sorted(self.timings.items(), key=lambda t: t[1]):
+            lines.append(
+                f"startup - {name:<10} +{began - self.started:6.3f}s  {ended - began:6.3f}s"
+            )
+
+        wall = time.perf_counter() - self.started
+        serial = sum(ended - began for began, ended in self.timings.values())
+        lines.append(
+            f"startup - total      {wall:.3f}s wall, {serial:.3f}s if run one by one"
+        )
+        return "\n".join(lines)
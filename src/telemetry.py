@@ -0,0 +1,365 @@
+"""
+Where the time goes. Every stage of the voice pipeline (VAD, recognition, history
+search, the Groq round trip, formatting, synthesis, playback) reports how long it
+took into a histogram. Optionally every event also goes to a JSONL trace file, and
+the histograms can be scraped Prometheus-style over HTTP.
+Recording is a bisect and a couple of increments, cheap enough for the audio callback.
+Trace lines get written on a background thread, never on the caller's.
+"""
+
+import bisect
+import json
+import os
+import queue
+import threading
+import time
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+
+
+# 1e-5s to 100s, four buckets per decade
+DEFAULT_BOUNDS = [10 ** (exponent / 4) for exponent in range(-20, 9)]
+
+
+class Histogram:
+    """
+    Fixed-bucket latency histogram, in seconds.
+    """
+
+    def __init__(self, bounds: List[float] = DEFAULT_BOUNDS) -> None:
+        """
+        - bounds (List[float]): Upper bounds of the buckets, ascending. Anything
+          bigger lands in an overflow bucket.
+        """
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        index = bisect.bisect_left(self.bounds, seconds)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def quantile(self, q: float) -> float:
+        """
+        - q (float): 0-1.
+        - Returns (float): Upper bound of the bucket the quantile falls in (so it's
+          an overestimate by at most one bucket), capped at the max seen.
+        """
+        with self.lock:
+            if not self.count:
+                return 0.0
+
+            rank = q * self.count
+            seen = 0
+            for index, count in enumerate(self.counts):
+                seen += count
+                if seen >= rank and count:
+                    bound = self.bounds[index] if index < len(self.bounds) else self.max
+                    return min(bound, self.max)
+            return self.max
+
+
+class _Span:
+    """
+    Times a with-block into a stage. See Telemetry.span().
+    """
+
+    __slots__ = ("telemetry", "stage", "fields", "started")
+
+    def __init__(self, telemetry: "Telemetry", stage: str, fields: dict) -> None:
+        self.telemetry = telemetry
+        self.stage = stage
+        self.fields = fields
+
+    def __enter__(self) -> "_Span":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, error_type, error, traceback) -> None:
+        if error_type is not None:
+            self.fields["error"] = error_type.__name__
+        self.telemetry.observe(
+            self.stage, time.perf_counter() - self.started, **self.fields
+        )
+
+
+class Telemetry:
+    """
+    Latency histograms per stage, point-in-time marks for end-to-end timings, an
+    optional JSONL trace, and the debug printer everything logs through.
+    """
+
+    def __init__(self, verbose: bool = True) -> None:
+        """
+        - verbose (bool): Print debug messages. They still go to the trace if it's on.
+        """
+        self.verbose = verbose
+        self.histograms: Dict[str, Histogram] = {}
+        self.marks: Dict[str, float] = {}
+        self.collectors: Dict[str, Callable[[], Dict[str, float]]] = {}
+        self.lock = threading.Lock()
+
+        self.trace_path: Optional[str] = None
+        self._trace: Optional[queue.SimpleQueue] = None
+        self._trace_thread: Optional[threading.Thread] = None
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def configure_from_env(self) -> None:
+        """
+        Sets things up from the environment:
+        - TELEMETRY_DEBUG=0 silences debug messages.
+        - TELEMETRY_TRACE=path writes a JSONL trace there.
+        - TELEMETRY_PORT=9464 serves /metrics on that port.
+        """
+        self.verbose = os.environ.get("TELEMETRY_DEBUG", "1") != "0"
+        if os.environ.get("TELEMETRY_TRACE"):
+            self.enable_trace(os.environ["TELEMETRY_TRACE"])
+        if os.environ.get("TELEMETRY_PORT"):
+            self.serve(int(os.environ["TELEMETRY_PORT"]))
+
+    def histogram(self, stage: str) -> Histogram:
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(stage, Histogram())
+        return histogram
+
+    def observe(self, stage: str, seconds: float, **fields) -> None:
+        """
+        Records how long a stage took.
+        - stage (str): Stage name, like "groq.completion".
+        - seconds (float): How long it took.
+        - fields: Extra context for the trace (ignored by the histograms).
+        """
+        self.histogram(stage).observe(seconds)
+        if self._trace is not None:
+            self._trace.put(
+                {"ts": time.time(), "stage": stage, "ms": seconds * 1000, **fields}
+            )
+
+    def span(self, stage: str, **fields) -> _Span:
+        """
+        Times a block:
+            with telemetry.span("tts.render", chars=len(text)):
+                ...
+        An exception still gets recorded (with its type in the trace), then raised.
+        """
+        return _Span(self, stage, fields)
+
+    def timed(self, stage: str) -> Callable:
+        """
+        Decorator version of span().
+        """
+
+        def decorator(function: Callable) -> Callable:
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with _Span(self, stage, {}):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def mark(self, name: str, **fields) -> None:
+        """
+        Notes that something just happened, for since() to measure from.
+        - name (str): Mark name, like "speech.end".
+        """
+        self.marks[name] = time.perf_counter()
+        if self._trace is not None:
+            self._trace.put({"ts": time.time(), "mark": name, **fields})
+
+    def since(self, mark: str, stage: str, **fields) -> Optional[float]:
+        """
+        Records the time from a mark to now as a stage, and clears the mark so it
+        only gets counted once.
+        - mark (str): The mark to measure from.
+        - stage (str): Stage to record it as.
+        - Returns (float | None): Seconds, or None if the mark isn't set.
+        """
+        started = self.marks.pop(mark, None)
+        if started is None:
+            return None
+
+        seconds = time.perf_counter() - started
+        self.observe(stage, seconds, **fields)
+        return seconds
+
+    def debug(self, source: str, message: str, *args) -> None:
+        """
+        Prints "source - message" if verbose, and traces it if tracing is on.
+        Formatting only happens if it's going somewhere.
+        - source (str): Who's talking, like "history".
+        - message (str): The message, %-style if args are given.
+        """
+        if not self.verbose and self._trace is None:
+            return
+
+        text = message % args if args else message
+        if self.verbose:
+            print(f"{source} - {text}")
+        if self._trace is not None:
+            self._trace.put({"ts": time.time(), "log": source, "message": text})
+
+    def collect(self, name: str, collector: Callable[[], Dict[str, float]]) -> None:
+        """
+        Adds numbers to the metrics endpoint, read whenever it gets scraped.
+        - name (str): Prefix for the metrics, like "scheduler".
+        - collector (Callable): Returns a dict of numbers, e.g. scheduler.stats.
+        """
+        self.collectors[name] = collector
+
+    def enable_trace(self, path: str) -> None:
+        """
+        Starts appending every event to a JSONL file.
+        - path (str): The trace file.
+        """
+        if self._trace is not None:
+            return
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.trace_path = path
+        self._trace = queue.SimpleQueue()
+        self._trace_thread = threading.Thread(
+            target=self._write_trace, args=(path, self._trace), daemon=True
+        )
+        self._trace_thread.start()
+
+    def _write_trace(self, path: str, events: queue.SimpleQueue) -> None:
+        with open(path, "a", encoding="UTF-8") as f:
+            while True:
+                event = events.get()
+                if event is None:
+                    break
+
+                f.write(json.dumps(event, default=str) + "\n")
+                if events.empty():
+                    f.flush()
+
+    def close(self) -> None:
+        """
+        Flushes and closes the trace, and stops the metrics endpoint.
+        """
+        if self._trace is not None:
+            self._trace.put(None)
+            self._trace_thread.join()
+            self._trace = None
+
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        - Returns (dict): Per stage: count, mean, p50, p95, p99 and max, in ms.
+        """
+        return {
+            stage: {
+                "count": histogram.count,
+                "mean": histogram.sum / histogram.count * 1000,
+                "p50": histogram.quantile(0.5) * 1000,
+                "p95": histogram.quantile(0.95) * 1000,
+                "p99": histogram.quantile(0.99) * 1000,
+                "max": histogram.max * 1000,
+            }
+            for stage, histogram in sorted(self.histograms.items())
+            if histogram.count
+        }
+
+    def report(self) -> str:
+        """
+        - Returns (str): summary() as a table, one stage per line.
+        """
+        lines = [
+            f"telemetry - {stage:<28} n={numbers['count']:<6} "
+            f"p50 {numbers['p50']:8.2f}ms  p95 {numbers['p95']:8.2f}ms  "
+            f"max {numbers['max']:8.2f}ms"
+            for stage, numbers in self.summary().items()
+        ]
+        return "\n".join(lines) or "telemetry - nothing recorded yet"
+
+    def render_prometheus(self) -> str:
+        """
+        - Returns (str): Every histogram and collector in the Prometheus text format.
+        """
+        lines = [
+            "# HELP assistant_stage_seconds Time spent per pipeline stage.",
+            "# TYPE assistant_stage_seconds histogram",
+        ]
+        for stage, histogram in sorted(self.histograms.items()):
+            with histogram.lock:
+                counts = list(histogram.counts)
+                total, count = histogram.sum, histogram.count
+
+            cumulative = 0
+            for bound, bucket in zip(histogram.bounds, counts):
+                cumulative += bucket
+                lines.append(
+                    f'assistant_stage_seconds_bucket{{stage="{stage}",le="{bound:.6g}"}} {cumulative}'
+                )
+            lines.append(
+                f'assistant_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}'
+            )
+            lines.append(f'assistant_stage_seconds_sum{{stage="{stage}"}} {total}')
+            lines.append(f'assistant_stage_seconds_count{{stage="{stage}"}} {count}')
+
+        for name, collector in sorted(self.collectors.items()):
+            try:
+                numbers = collector()
+            except Exception as e:
+                self.debug("telemetry", "collector %s failed: %s", name, e)
+                continue
+
+            for key, value in sorted(numbers.items()):
+                if isinstance(value, (int, float)):
+                    lines.append(f"# TYPE assistant_{name}_{key} gauge")
+                    lines.append(f"assistant_{name}_{key} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int = 9464, host: str = "localhost") -> None:
+        """
+        Serves render_prometheus() at http://host:port/metrics on a background thread.
+        - port (int): Port to listen on.
+        - host (str): Interface to listen on.
+        """
+        if self._server is not None:
+            return
+
+        telemetry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+
+                body = telemetry.render_prometheus().encode("UTF-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args) -> None:
+                pass  # no access log spam in the console
+
+        self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self.debug("telemetry", "serving metrics at http://%s:%d/metrics", host, port)
+
+
+telemetry = Telemetry()
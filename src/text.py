@@ -3,9 +3,202 @@ Does formatting stuff, mainly markdown to plain text.
 """
 
 import re
+from functools import lru_cache
+from typing import List, Optional
+
 import markdown
 import bs4
 
+from telemetry import telemetry
+
+
+# Everything below mirrors how Python-Markdown parses the subset of markdown LLM
+# answers actually use, and strips it the same way the markdown -> HTML -> text
+# pipeline does (tag boundaries become spaces, links keep their text, code and images
+# disappear). Anything outside that subset goes through the real pipeline instead.
+
+_PLACEHOLDER = re.compile(r"\x02(\d+)\x03")
+_CODE_SPAN = re.compile(r"(`+)(.+?)(?<!`)\1(?!`)", re.DOTALL)
+_LINK = re.compile(
+    r"(!?)\[([^\[\]\n]*)\]\(([^()<>\s]*)(?:[ ]+(?:\"[^\"\n]*\"|'[^'\n]*'))?\)"
+)
+_LINE_BREAK = re.compile(r"  \n")
+_ASTERISKS = re.compile(r"\*+")
+_LONE_ASTERISKS = re.compile(r"(?:^|(?<=\s))\*{1,3}(?=\s|$)")
+_HEADER = re.compile(r"^(#{1,6})(.*?)#*$")
+_LIST_ITEM = re.compile(r"^ {0,3}(?:\d+\.|[*+-]) +(.*)$")
+_WHITESPACE = re.compile(r"\s+")
+_BLANK_LINES = re.compile(r"(?<=\n) +\n")
+
+_UNSAFE_TEXT = re.compile(r"[\x02\x03]|\\`")
+_UNSAFE_LINE = re.compile(
+    r"^(?: {0,3}(?:>|<|\[[^\]\n]*\]:)"  # quotes, html blocks, reference definitions
+    r"| {0,3}(?:=+|-+) *$"  # setext headers
+    r"| {0,3}(?:(?:-+ {0,2}){3,}|(?:_+ {0,2}){3,}|(?:\*+ {0,2}){3,}) *$"  # rules
+    r"|#{7})",
+    re.MULTILINE,
+)
+_UNSAFE_INLINE = re.compile(r"[<\\\[\]_]|&#?\w+;")
+
+
+class _Unsupported(Exception):
+    """
+    Raised when text needs the full markdown renderer.
+    """
+
+
+def _render_markdown(text: str) -> str:
+    """
+    The full markdown -> HTML -> text pipeline. Slow, but handles everything.
+    """
+    md = markdown.markdown(text)
+
+    md = re.sub(r"<pre><code>.*?</code></pre>", " ", md, flags=re.DOTALL)
+    md = re.sub(r"<code>.*?</code>", " ", md, flags=re.DOTALL)
+
+    md = re.sub(r"<a [^>]+>(.*?)</a>", r"\1", md)
+
+    md = re.sub(r"!\[.*?\]\((.*?)\)", " ", md)
+    md = re.sub(r"<img [^>]+alt=['\"](.*?)['\"][^>]*>", r"\1", md)
+
+    soup = bs4.BeautifulSoup(md, "html.parser")
+    text = soup.get_text(separator=" ", strip=True)
+
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _strip_emphasis(text: str) -> str:
+    """
+    Turns matched * and ** pairs into spaces. Lone markers with whitespace on both
+    sides stay put, like Python-Markdown leaves them.
+    """
+    if "_" in text:
+        raise _Unsupported
+    if "*" not in text:
+        return text
+
+    lone = {match.start() for match in _LONE_ASTERISKS.finditer(text)}
+    runs = [run for run in _ASTERISKS.finditer(text) if run.start() not in lone]
+    if not runs:
+        return text
+
+    if len(runs) % 2 or any(
+        len(opening.group()) not in (1, 2)
+        or len(opening.group()) != len(closing.group())
+        for opening, closing in zip(runs[::2], runs[1::2])
+    ):
+        raise _Unsupported
+
+    pieces = []
+    last = 0
+    for run in runs:
+        pieces.append(text[last : run.start()])
+        pieces.append(" ")
+        last = run.end()
+    pieces.append(text[last:])
+    return "".join(pieces)
+
+
+def _strip_inline(text: str) -> str:
+    """
+    Strips inline markdown from one paragraph, header or list item.
+    """
+    stash: List[str] = []
+
+    def hide(replacement: str) -> str:
+        stash.append(replacement)
+        return f"\x02{len(stash) - 1}\x03"
+
+    # same order Python-Markdown uses: code spans, links and images, line breaks
+    if "`" in text:
+        text = _CODE_SPAN.sub(lambda match: hide(" "), text)
+    if "[" in text:
+        text = _LINK.sub(
+            lambda match: hide(
+                " " if match.group(1) else _strip_emphasis(match.group(2))
+            ),
+            text,
+        )
+    if "  \n" in text:
+        text = _LINE_BREAK.sub(lambda match: hide(" "), text)
+
+    if _UNSAFE_INLINE.search(text):
+        raise _Unsupported
+
+    text = _strip_emphasis(text)
+    if not stash:
+        return text
+    return _PLACEHOLDER.sub(lambda match: stash[int(match.group(1))], text)
+
+
+def _strip_block(lines: List[str], pieces: List[str]) -> None:
+    """
+    Strips one block (a run of lines without blank lines), appending the plain text
+    of every paragraph, header and list item in it to pieces.
+    """
+    if not lines or lines[0].startswith("    "):
+        if lines:
+            raise _Unsupported  # indented code
+        return
+
+    for index, line in enumerate(lines):
+        header = _HEADER.match(line) if line.startswith("#") else None
+        if header:
+            _strip_block(lines[:index], pieces)
+            pieces.append(_strip_inline(header.group(2)))
+            _strip_block(lines[index + 1 :], pieces)
+            return
+
+    if not _LIST_ITEM.match(lines[0]):
+        pieces.append(_strip_inline("\n".join(lines)))
+        return
+
+    items: List[List[str]] = []
+    for line in lines:
+        if line.startswith("    "):
+            raise _Unsupported  # nested blocks inside list items
+
+        item = _LIST_ITEM.match(line)
+        if item:
+            items.append([item.group(1)])
+        else:
+            items[-1].append(line)  # lazy continuation of the last item
+
+    for item in items:
+        # item contents get parsed as blocks of their own, quotes and rules included
+        if _UNSAFE_LINE.search("\n".join(item)):
+            raise _Unsupported
+        _strip_block(item, pieces)
+
+
+@lru_cache(maxsize=1024)
+def to_speech_text(text: str) -> str:
+    """
+    Strips markdown down to plain text for TTS. Common markdown gets stripped in one
+    pass over the text, and the output matches what rendering it to HTML with
+    markdown and pulling the text out with BeautifulSoup gives. Anything unusual
+    (raw HTML, escapes, reference links, indented code, ...) still goes through that
+    renderer. Results are cached, since the same replies come up over and over.
+    - text (str): Markdown.
+    - Returns (str): Plain text, whitespace collapsed.
+    """
+    source = text.replace("\r\n", "\n").replace("\r", "\n").expandtabs(4)
+    source = _BLANK_LINES.sub("\n", source + "\n\n")
+
+    if _UNSAFE_TEXT.search(source) or _UNSAFE_LINE.search(source):
+        return _render_markdown(text)
+
+    pieces: List[str] = []
+    try:
+        for block in source.split("\n\n"):
+            _strip_block(
+                block.lstrip("\n").split("\n") if block.strip() else [], pieces
+            )
+    except _Unsupported:
+        return _render_markdown(text)
+
+    return _WHITESPACE.sub(" ", " ".join(pieces)).strip()
+
 
 class Formatter:
     """
@@ -23,30 +216,81 @@ class Formatter:
     def __to_text__(self) -> str:
         """
         Strips markdown down to plain text. Deals with code, links, headers, etc.
-        Not perfect, but gets the job done.
+        Not perfect, but gets the job done. See to_speech_text.
         """
         assert self.text is not None, "formatter - text must be provided in order to format"
 
-        md = markdown.markdown(self.text)
-
-        md = re.sub(r"<pre><code>.*?</code></pre>", " ", md, flags=re.DOTALL)
-        md = re.sub(r"<code>.*?</code>", " ", md, flags=re.DOTALL)
-
-        md = re.sub(r"<a [^>]+>(.*?)</a>", r"\1", md)
-
-        md = re.sub(r"!\[.*?\]\((.*?)\)", " ", md)
-        md = re.sub(r"<img [^>]+alt=['\"](.*?)['\"][^>]*>", r"\1", md)
-
-        soup = bs4.BeautifulSoup(md, "html.parser")
-        self.text = soup.get_text(separator=" ", strip=True)
-
-        self.text = re.sub(r"\s+", " ", self.text).strip()
+        self.text = to_speech_text(self.text)
 
         return self.text
 
+    @telemetry.timed("text.format")
     def format(self) -> str:
         """
         Takes input text, does formatting magic, and gives you back clean text.
         Strips markdown, HTML, and other fluff.
         """
         return self.__to_text__()
+
+
+class SentenceSplitter:
+    """
+    Chops streamed text into whole sentences, so speech can start on the first
+    sentence while the rest is still being generated. Fenced code blocks are kept
+    in one piece, since the formatter drops them anyway.
+    """
+
+    boundary = re.compile(r"(?<=[.!?])[\"')\]]*\s+|\n\s*\n")
+
+    def __init__(self, min_length: int = 20) -> None:
+        """
+        Sets up an empty buffer.
+        - min_length (int): Sentences shorter than this get glued onto the next one,
+          so list markers and "Sure." don't each become their own utterance.
+        """
+        self.min_length = min_length
+        self.buffer = ""
+
+    def feed(self, chunk: str) -> List[str]:
+        """
+        Adds streamed text and returns every sentence it completed.
+        - chunk (str): The next piece of text.
+        - Returns (List[str]): Finished sentences, possibly none.
+        """
+        self.buffer += chunk
+        sentences = []
+
+        start = 0
+        search_from = 0
+        while True:
+            fence = self.buffer.find("```", search_from)
+            match = self.boundary.search(self.buffer, search_from)
+            if match is None:
+                break
+
+            if fence != -1 and fence < match.start():
+                closing = self.buffer.find("```", fence + 3)
+                if closing == -1:
+                    break  # still inside a code block, wait for the rest of it
+                search_from = closing + 3
+                continue
+
+            sentence = self.buffer[start : match.end()].strip()
+            search_from = match.end()
+            if len(sentence) < self.min_length:
+                continue
+
+            sentences.append(sentence)
+            start = match.end()
+
+        self.buffer = self.buffer[start:]
+        return sentences
+
+    def flush(self) -> Optional[str]:
+        """
+        Returns whatever is left in the buffer once the stream is done.
+        - Returns (str | None): The trailing text, or None if there isn't any.
+        """
+        rest = self.buffer.strip()
+        self.buffer = ""
+        return rest or None
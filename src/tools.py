@@ -0,0 +1,318 @@
+"""
+Tool registry for tool-use models. Tools get validated and compiled to the function
+schema Groq expects once, when they're registered, and calls just reference them by
+name. Tool calls that come back from the model run locally, in parallel.
+"""
+
+import copy
+import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Literal, Optional, Union
+
+from pydantic import BaseModel, Field, ValidationError, create_model
+
+from telemetry import telemetry
+
+
+_PYTHON_TYPES = {
+    "string": str,
+    "number": float,
+    "integer": int,
+    "boolean": bool,
+    "array": list,
+    "object": dict,
+}
+
+
+class ToolParameter(BaseModel):
+    """
+    One parameter of a tool, same shape as the `tool_parameters` entries Model has
+    always taken.
+    """
+
+    name: str = Field(pattern=r"^[A-Za-z_][A-Za-z0-9_]*$")
+    type: Literal["string", "number", "integer", "boolean", "array", "object"]
+    description: str = ""
+    required: bool = False
+
+
+class ToolSpec(BaseModel):
+    """
+    A tool definition: {"tool_name", "description", "tool_parameters"}.
+    """
+
+    tool_name: str = Field(pattern=r"^[A-Za-z0-9_-]{1,64}$")
+    description: str = ""
+    tool_parameters: List[ToolParameter] = []
+
+
+class Tool:
+    """
+    A registered tool: its compiled wire schema, an arguments model to validate
+    calls with, and optionally the function that runs it.
+    """
+
+    def __init__(self, spec: ToolSpec, handler: Optional[Callable[..., Any]] = None):
+        self.name = spec.tool_name
+        self.spec = spec
+        self.handler = handler
+
+        self.schema = {
+            "type": "function",
+            "function": {
+                "name": spec.tool_name,
+                "description": spec.description,
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        param.name: {
+                            "type": param.type,
+                            "description": param.description,
+                        }
+                        for param in spec.tool_parameters
+                    },
+                    "required": [
+                        param.name for param in spec.tool_parameters if param.required
+                    ],
+                },
+            },
+        }
+
+        self.arguments = create_model(
+            f"{re.sub(r'[^A-Za-z0-9_]', '_', spec.tool_name)}_arguments",
+            **{
+                param.name: (
+                    (
+                        _PYTHON_TYPES[param.type]
+                        if param.required
+                        else Optional[_PYTHON_TYPES[param.type]]
+                    ),
+                    ... if param.required else None,
+                )
+                for param in spec.tool_parameters
+            },
+        )
+
+
+class ToolRegistry:
+    """
+    Holds registered tools by name. Model takes tools as names (or, like before, as
+    full definitions, which only apply to the request they came with, see scoped()).
+    """
+
+    def __init__(
+        self, max_workers: int = 8, executor: Optional[ThreadPoolExecutor] = None
+    ) -> None:
+        """
+        Sets up an empty registry.
+        - max_workers (int): Max tool calls running at once.
+        - executor (ThreadPoolExecutor, optional): Pool to run tool calls on, instead
+          of a new one. scoped() registries share their parent's.
+        """
+        self.tools: Dict[str, Tool] = {}
+        self.compiled: Dict[str, Tool] = {}  # ad-hoc definitions, by their JSON
+        self.max_compiled = 256
+        self.lock = threading.Lock()
+        self.executor = executor or ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="tool"
+        )
+
+    def register(
+        self,
+        spec: Union[dict, ToolSpec],
+        handler: Optional[Callable[..., Any]] = None,
+    ) -> str:
+        """
+        Validates and compiles a tool. Registering a name again replaces it.
+        Raises ValueError if the definition is invalid.
+        - spec (dict | ToolSpec): The tool definition.
+        - handler (Callable, optional): Runs the tool. Gets the call's arguments as
+          keyword arguments, and whatever it returns gets sent back to the model.
+        - Returns (str): The tool's name.
+        """
+        try:
+            validated = (
+                spec if isinstance(spec, ToolSpec) else ToolSpec.model_validate(spec)
+            )
+        except ValidationError as e:
+            raise ValueError(f"tools - invalid tool definition: {e}") from e
+
+        tool = Tool(validated, handler)
+        with self.lock:
+            self.tools[tool.name] = tool
+        return tool.name
+
+    def compile(self, spec: dict) -> Tool:
+        """
+        Compiles an ad-hoc definition without registering it. The same definition
+        only gets compiled once. Raises ValueError if it's invalid.
+        - spec (dict): The tool definition.
+        - Returns (Tool): The compiled tool, without a handler.
+        """
+        key = json.dumps(spec, sort_keys=True, default=str)
+        tool = self.compiled.get(key)
+        if tool is not None:
+            return tool
+
+        try:
+            tool = Tool(ToolSpec.model_validate(spec))
+        except ValidationError as e:
+            raise ValueError(f"tools - invalid tool definition: {e}") from e
+
+        with self.lock:
+            if len(self.compiled) >= self.max_compiled:
+                self.compiled.clear()
+            self.compiled[key] = tool
+        return tool
+
+    def scoped(self, tools: Iterable[Union[str, dict]]) -> "ToolRegistry":
+        """
+        A registry for a single request: everything registered here, plus the full
+        definitions in tools, which stay out of this registry. A definition named
+        like a registered tool runs with that tool's handler.
+        - tools (Iterable[str | dict]): What the request was given.
+        - Returns (ToolRegistry): This registry if there are no definitions, else a
+          throwaway one sharing this one's thread pool.
+        """
+        definitions = [tool for tool in tools if not isinstance(tool, str)]
+        if not definitions:
+            return self
+
+        scoped = ToolRegistry(executor=self.executor)
+        scoped.tools = dict(self.tools)
+        for definition in definitions:
+            tool = copy.copy(self.compile(definition))
+            existing = self.tools.get(tool.name)
+            tool.handler = existing.handler if existing else None
+            scoped.tools[tool.name] = tool
+        return scoped
+
+    def tool(
+        self, description: str = "", parameters: Optional[List[dict]] = None
+    ) -> Callable:
+        """
+        Decorator version of register(), named after the function.
+        - description (str): What the tool does.
+        - parameters (List[dict], optional): Its `tool_parameters`.
+        """
+
+        def decorator(handler: Callable[..., Any]) -> Callable[..., Any]:
+            self.register(
+                {
+                    "tool_name": handler.__name__,
+                    "description": description,
+                    "tool_parameters": parameters or [],
+                },
+                handler,
+            )
+            return handler
+
+        return decorator
+
+    def schemas(self, tools: Iterable[Union[str, dict]]) -> List[dict]:
+        """
+        Gets the compiled schemas for a request.
+        - tools (Iterable[str | dict]): Tool names, or full definitions. Definitions
+          don't get registered (see compile()).
+        - Returns (List[dict]): The schemas, ready to send. Don't modify them.
+        """
+        schemas = []
+        for tool in tools:
+            if isinstance(tool, str):
+                if tool not in self.tools:
+                    raise KeyError(f"tools - no tool named {tool} is registered")
+                schemas.append(self.tools[tool].schema)
+            else:
+                schemas.append(self.compile(tool).schema)
+        return schemas
+
+    def call(self, name: str, arguments: str) -> str:
+        """
+        Runs one tool call. Errors come back as text for the model to read, they
+        don't raise.
+        - name (str): The tool's name.
+        - arguments (str): The call's arguments, as the JSON string the model sent.
+        - Returns (str): The result, JSON encoded unless the tool returned a string.
+        """
+        tool = self.tools.get(name)
+        if tool is None or tool.handler is None:
+            return f"error: no tool named {name} can be run here"
+
+        try:
+            parsed = tool.arguments.model_validate_json(arguments or "{}")
+        except ValidationError as e:
+            return f"error: invalid arguments for {name}: {e}"
+
+        try:
+            result = tool.handler(**parsed.model_dump(exclude_none=True))
+        except Exception as e:
+            telemetry.debug("tools", "%s failed: %s", name, e)
+            return f"error: {name} failed: {e}"
+
+        return result if isinstance(result, str) else json.dumps(result, default=str)
+
+    def dispatch(self, tool_calls: List[Any]) -> List[dict]:
+        """
+        Runs tool calls from a chat completion in parallel.
+        - tool_calls (List[Any]): `message.tool_calls` from the response.
+        - Returns (List[dict]): One "tool" message per call, in the same order.
+        """
+        futures = [
+            self.executor.submit(
+                self.call, tool_call.function.name, tool_call.function.arguments
+            )
+            for tool_call in tool_calls
+        ]
+        return [
+            {
+                "role": "tool",
+                "tool_call_id": tool_call.id,
+                "name": tool_call.function.name,
+                "content": future.result(),
+            }
+            for tool_call, future in zip(tool_calls, futures)
+        ]
+
+    def follow_up(self, response: Any) -> Optional[List[dict]]:
+        """
+        If the model asked for tool calls we can run, runs them.
+        - response (Any): The chat completion.
+        - Returns (List[dict] | None): Messages to append to the conversation before
+          asking again (the assistant's tool calls plus their results), or None if
+          there's nothing to run.
+        """
+        if not response.choices:
+            return None
+
+        message = response.choices[0].message
+        tool_calls = getattr(message, "tool_calls", None)
+        if not tool_calls or any(
+            self.tools.get(tool_call.function.name) is None
+            or self.tools[tool_call.function.name].handler is None
+            for tool_call in tool_calls
+        ):
+            return None
+
+        return [
+            {
+                "role": "assistant",
+                "content": message.content or "",
+                "tool_calls": [
+                    {
+                        "id": tool_call.id,
+                        "type": "function",
+                        "function": {
+                            "name": tool_call.function.name,
+                            "arguments": tool_call.function.arguments,
+                        },
+                    }
+                    for tool_call in tool_calls
+                ],
+            },
+            *self.dispatch(tool_calls),
+        ]
+
+
+tool_registry = ToolRegistry()
@@ -0,0 +1,286 @@
+"""
+Batch transcription for recorded audio. Streams WAV/PCM files through Vosk in fixed
+size chunks, spread across a process pool where every worker loads the model once,
+and writes the results out as JSONL or SRT.
+
+Usage:
+    python src/transcribe.py calls/ --workers 8 --format srt --output transcripts/
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import wave
+from datetime import timedelta
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional
+
+import numpy
+import srt
+import vosk
+from tqdm import tqdm
+
+
+AUDIO_EXTENSIONS = (".wav", ".pcm", ".raw")
+
+_worker_model: Optional[vosk.Model] = None
+
+
+def _init_worker(model_path: str) -> None:
+    """
+    Pool initializer. Loads the Vosk model once per worker process.
+    - model_path (str): Path to the Vosk model.
+    """
+    global _worker_model
+
+    vosk.SetLogLevel(-1)
+    _worker_model = vosk.Model(model_path)
+
+
+def read_chunks(
+    path: str, sample_rate: int = 16000, chunk_seconds: float = 0.5
+) -> Iterator[tuple]:
+    """
+    Streams a file as mono 16-bit PCM chunks. WAV files carry their own format,
+    anything else is treated as raw mono 16-bit PCM at sample_rate.
+    - path (str): The audio file.
+    - sample_rate (int): Sample rate for raw PCM files.
+    - chunk_seconds (float): Size of each chunk in seconds.
+    - Returns (Iterator[tuple]): (sample rate, pcm bytes) per chunk.
+    """
+    if path.lower().endswith(".wav"):
+        with wave.open(path, "rb") as wave_file:
+            if wave_file.getsampwidth() != 2:
+                raise ValueError(f"transcribe - {path} isn't 16-bit PCM")
+
+            rate = wave_file.getframerate()
+            channels = wave_file.getnchannels()
+            frames = max(1, int(rate * chunk_seconds))
+
+            while True:
+                data = wave_file.readframes(frames)
+                if not data:
+                    return
+
+                if channels > 1:
+                    samples = numpy.frombuffer(data, dtype=numpy.int16)
+                    samples = samples.reshape(-1, channels).mean(axis=1)
+                    data = samples.astype(numpy.int16).tobytes()
+
+                yield rate, data
+
+    chunk_bytes = max(1, int(sample_rate * chunk_seconds)) * 2
+    with open(path, "rb") as file:
+        while True:
+            data = file.read(chunk_bytes)
+            if not data:
+                return
+            yield sample_rate, data
+
+
+def transcribe_file(
+    path: str,
+    model: Optional[vosk.Model] = None,
+    sample_rate: int = 16000,
+    chunk_seconds: float = 0.5,
+) -> dict:
+    """
+    Transcribes one file. Every finalized result becomes a segment with word timings.
+    - path (str): The audio file.
+    - model (vosk.Model, optional): Model to use. Defaults to this worker's model.
+    - sample_rate (int): Sample rate for raw PCM files.
+    - chunk_seconds (float): How much audio to hand the recognizer at a time.
+    - Returns (dict): {"file", "duration", "text", "segments"}, or {"file", "error"}.
+    """
+    model = model or _worker_model
+
+    try:
+        recognizer = None
+        rate = sample_rate
+        samples = 0
+        segments = []
+
+        def collect(result: str) -> None:
+            result = json.loads(result)
+            words = result.get("result", [])
+            if not result.get("text") or not words:
+                return
+
+            segments.append(
+                {
+                    "start": words[0]["start"],
+                    "end": words[-1]["end"],
+                    "text": result["text"],
+                    "words": words,
+                }
+            )
+
+        for rate, data in read_chunks(path, sample_rate, chunk_seconds):
+            if recognizer is None:
+                recognizer = vosk.KaldiRecognizer(model, rate)
+                recognizer.SetWords(True)
+
+            samples += len(data) // 2
+            if recognizer.AcceptWaveform(data):
+                collect(recognizer.Result())
+
+        if recognizer is not None:
+            collect(recognizer.FinalResult())
+    except Exception as e:
+        return {"file": path, "error": str(e)}
+
+    return {
+        "file": path,
+        "duration": samples / rate,
+        "text": " ".join(segment["text"] for segment in segments),
+        "segments": segments,
+    }
+
+
+def _transcribe_job(job: tuple) -> dict:
+    path, sample_rate, chunk_seconds = job
+    return transcribe_file(path, None, sample_rate, chunk_seconds)
+
+
+def find_audio_files(paths: Iterable[str]) -> List[str]:
+    """
+    Expands directories into the audio files inside them.
+    - paths (Iterable[str]): Files and/or directories.
+    - Returns (List[str]): Audio files, sorted within each directory.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(
+                str(file)
+                for file in sorted(Path(path).rglob("*"))
+                if file.suffix.lower() in AUDIO_EXTENSIONS
+            )
+        else:
+            files.append(path)
+    return files
+
+
+def transcribe_files(
+    files: List[str],
+    model_path: str = "src/models/model/",
+    workers: Optional[int] = None,
+    sample_rate: int = 16000,
+    chunk_seconds: float = 0.5,
+    progress: bool = True,
+) -> Iterator[dict]:
+    """
+    Transcribes files across a process pool, yielding results as they finish.
+    - files (List[str]): Audio files.
+    - model_path (str): Path to the Vosk model.
+    - workers (int, optional): Worker processes. Defaults to the number of cores.
+    - sample_rate (int): Sample rate for raw PCM files.
+    - chunk_seconds (float): How much audio to hand the recognizer at a time.
+    - progress (bool): Show a progress bar.
+    - Returns (Iterator[dict]): One result per file, see transcribe_file.
+    """
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(
+            f"vosk - model was not found at path {model_path}. "
+            "Download a model from here -> https://alphacephei.com/vosk/models"
+        )
+
+    workers = min(workers or os.cpu_count() or 1, max(1, len(files)))
+    jobs = [(file, sample_rate, chunk_seconds) for file in files]
+
+    with multiprocessing.Pool(
+        workers, initializer=_init_worker, initargs=(model_path,)
+    ) as pool:
+        results = pool.imap_unordered(_transcribe_job, jobs, chunksize=1)
+        yield from tqdm(
+            results, total=len(jobs), unit="file", disable=not progress, file=sys.stderr
+        )
+
+
+def to_srt(result: dict) -> str:
+    """
+    Turns a transcription result into SRT subtitles, one per segment.
+    - result (dict): Output of transcribe_file.
+    - Returns (str): The SRT file contents.
+    """
+    subtitles = [
+        srt.Subtitle(
+            index=index,
+            start=timedelta(seconds=segment["start"]),
+            end=timedelta(seconds=segment["end"]),
+            content=segment["text"],
+        )
+        for index, segment in enumerate(result.get("segments", []), start=1)
+    ]
+    return srt.compose(subtitles)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Transcribe recorded audio with Vosk.")
+    parser.add_argument("paths", nargs="+", help="audio files or directories")
+    parser.add_argument("--model", default="src/models/model/", help="Vosk model path")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes")
+    parser.add_argument("--format", choices=("jsonl", "srt"), default="jsonl")
+    parser.add_argument(
+        "--output",
+        default=None,
+        help="JSONL file (default stdout), or a directory for SRT files (default next to the audio)",
+    )
+    parser.add_argument(
+        "--sample-rate", type=int, default=16000, help="sample rate of raw PCM files"
+    )
+    parser.add_argument("--chunk-seconds", type=float, default=0.5)
+    parser.add_argument("--quiet", action="store_true", help="no progress bar")
+    args = parser.parse_args(argv)
+
+    files = find_audio_files(args.paths)
+    if not files:
+        print("transcribe - no audio files found", file=sys.stderr)
+        return
+
+    results = transcribe_files(
+        files,
+        model_path=args.model,
+        workers=args.workers,
+        sample_rate=args.sample_rate,
+        chunk_seconds=args.chunk_seconds,
+        progress=not args.quiet,
+    )
+
+    failed = 0
+
+    if args.format == "jsonl":
+        output = open(args.output, "w", encoding="UTF-8") if args.output else sys.stdout
+        try:
+            for result in results:
+                failed += "error" in result
+                output.write(json.dumps(result) + "\n")
+                output.flush()
+        finally:
+            if output is not sys.stdout:
+                output.close()
+    else:
+        if args.output:
+            os.makedirs(args.output, exist_ok=True)
+
+        for result in results:
+            if "error" in result:
+                failed += 1
+                print(
+                    f"transcribe - {result['file']}: {result['error']}", file=sys.stderr
+                )
+                continue
+
+            directory = args.output or os.path.dirname(result["file"])
+            path = os.path.join(directory, f"{Path(result['file']).stem}.srt")
+            with open(path, "w", encoding="UTF-8") as file:
+                file.write(to_srt(result))
+
+    if failed:
+        print(f"transcribe - {failed} of {len(files)} files failed", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
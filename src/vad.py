@@ -0,0 +1,259 @@
+"""
+Voice activity detection that's cheap enough for the PortAudio callback thread.
+No per-block allocations, no logs, just an integer dot product against thresholds
+that follow the room's noise floor.
+"""
+
+from typing import Dict, List, Tuple
+
+import numpy
+
+
+FULL_SCALE_ENERGY = 32768.0**2  # mean square of a full scale int16 signal
+
+
+def dbfs_to_energy(decibels: float) -> float:
+    """
+    Converts a level in dBFS to mean square int16 energy.
+    - decibels (float): Level relative to full scale.
+    - Returns (float): The matching mean square sample value.
+    """
+    return FULL_SCALE_ENERGY * 10 ** (decibels / 10)
+
+
+def energy_to_dbfs(energy: float) -> float:
+    """
+    Converts mean square int16 energy to dBFS. Only used for reporting.
+    - energy (float): Mean square sample value.
+    - Returns (float): Level relative to full scale.
+    """
+    return float(10 * numpy.log10(max(energy, 1e-12) / FULL_SCALE_ENERGY))
+
+
+class VoiceActivityDetector:
+    """
+    Energy based VAD with an adaptive noise floor, hysteresis and hangover.
+    Speech starts when a block is onset_margin above the noise floor, and keeps
+    going as long as blocks stay release_margin above it. Once it drops below that,
+    speech only ends after `hangover` seconds, so pauses between words don't cut
+    an utterance in half. The noise floor learns quickly while nobody is talking and
+    very slowly during speech, so a fan or a TV that kicks in mid-utterance gets
+    absorbed eventually instead of keeping the detector stuck in speech. As a last
+    resort an utterance gets cut after max_utterance seconds, and then the level has
+    to drop back below the release threshold before anything counts as a new onset,
+    so whatever kept it going doesn't start another utterance on the very next block.
+    """
+
+    def __init__(
+        self,
+        min_onset_dbfs: float = -45.0,
+        onset_margin_db: float = 12.0,
+        release_margin_db: float = 6.0,
+        hangover: float = 1.0,
+        initial_noise_dbfs: float = -60.0,
+        noise_rise: float = 0.02,
+        noise_fall: float = 0.2,
+        speech_adapt: float = 0.002,
+        max_utterance: float = 30.0,
+        max_block: int = 8192,
+    ) -> None:
+        """
+        Sets up the detector and its scratch buffer.
+        - min_onset_dbfs (float): Never trigger below this level, however quiet the room.
+        - onset_margin_db (float): How far above the noise floor speech has to start.
+        - release_margin_db (float): How far above the noise floor speech has to stay.
+        - hangover (float): Seconds of quiet before speech counts as over.
+        - initial_noise_dbfs (float): Starting guess for the noise floor.
+        - noise_rise (float): How fast the floor follows louder noise (0-1 per block).
+        - noise_fall (float): How fast the floor follows quieter noise (0-1 per block).
+        - speech_adapt (float): How fast the floor follows the level during speech
+          (0-1 per block). Keep it tiny, or speech itself becomes the floor.
+        - max_utterance (float): Seconds after which speech gets ended regardless.
+        - max_block (int): Scratch buffer size in samples. Grows if a bigger block shows up.
+        """
+        self.min_onset_energy = dbfs_to_energy(min_onset_dbfs)
+        self.onset_gain = 10 ** (onset_margin_db / 10)
+        self.release_gain = 10 ** (release_margin_db / 10)
+        self.hangover = hangover
+        self.noise_rise = noise_rise
+        self.noise_fall = noise_fall
+        self.speech_adapt = speech_adapt
+        self.max_utterance = max_utterance
+
+        self.noise_energy = dbfs_to_energy(initial_noise_dbfs)
+        self.last_energy = 0.0
+        self.speaking = False
+        self.last_voice_time = 0.0
+        self.speech_start_time = 0.0
+        self.awaiting_release = False  # set after a forced end, see process()
+
+        self._scratch = numpy.zeros(max_block, dtype=numpy.int64)
+
+        self.callbacks = 0
+        self.callback_ns_total = 0
+        self.callback_ns_max = 0
+        self.samples_seen = 0
+
+    def energy(self, block) -> float:
+        """
+        Mean square energy of a block of int16 samples, without allocating.
+        - block (buffer): Raw int16 audio (bytes, memoryview, cffi buffer, ...).
+        - Returns (float): Mean square sample value.
+        """
+        samples = numpy.frombuffer(block, dtype=numpy.int16)
+        count = samples.shape[0]
+        if count == 0:
+            return 0.0
+
+        if count > self._scratch.shape[0]:
+            self._scratch = numpy.zeros(count, dtype=numpy.int64)
+
+        scratch = self._scratch[:count]
+        numpy.copyto(scratch, samples, casting="unsafe")
+        self.samples_seen += count
+        return float(numpy.dot(scratch, scratch)) / count
+
+    def process(self, block, now: float) -> Tuple[bool, bool, bool]:
+        """
+        Runs one block through the detector.
+        - block (buffer): Raw int16 audio.
+        - now (float): Current time in seconds.
+        - Returns (Tuple[bool, bool, bool]): (speaking, speech just started, speech just ended).
+        """
+        energy = self.energy(block)
+        self.last_energy = energy
+
+        if not self.speaking:
+            if self.awaiting_release and energy <= self._release_energy():
+                self.awaiting_release = False
+
+            if not self.awaiting_release and energy > max(
+                self.noise_energy * self.onset_gain, self.min_onset_energy
+            ):
+                self.speaking = True
+                self.last_voice_time = now
+                self.speech_start_time = now
+                return True, True, False
+
+            rate = self.noise_rise if energy > self.noise_energy else self.noise_fall
+            self.noise_energy += rate * (energy - self.noise_energy)
+            self.noise_energy = max(self.noise_energy, 1.0)
+            return False, False, False
+
+        self.noise_energy += self.speech_adapt * (energy - self.noise_energy)
+        self.noise_energy = max(self.noise_energy, 1.0)
+
+        if now - self.speech_start_time > self.max_utterance:
+            self.speaking = False
+            self.awaiting_release = True
+            return False, False, True
+
+        if energy > self._release_energy():
+            self.last_voice_time = now
+        elif now - self.last_voice_time > self.hangover:
+            self.speaking = False
+            return False, False, True
+
+        return True, False, False
+
+    def _release_energy(self) -> float:
+        """
+        - Returns (float): The level speech has to stay above to keep going.
+        """
+        return max(
+            self.noise_energy * self.release_gain,
+            self.min_onset_energy / self.onset_gain,
+        )
+
+    def record_callback(self, elapsed_ns: int) -> None:
+        """
+        Tracks how long an audio callback took.
+        - elapsed_ns (int): Time spent in the callback, in nanoseconds.
+        """
+        self.callbacks += 1
+        self.callback_ns_total += elapsed_ns
+        if elapsed_ns > self.callback_ns_max:
+            self.callback_ns_max = elapsed_ns
+
+    def stats(self) -> Dict[str, float]:
+        """
+        - Returns (dict): Callback timing, current levels and the noise floor.
+        """
+        return {
+            "callbacks": self.callbacks,
+            "callback_avg_us": (
+                self.callback_ns_total / self.callbacks / 1000
+                if self.callbacks
+                else 0.0
+            ),
+            "callback_max_us": self.callback_ns_max / 1000,
+            "average_block_samples": (
+                self.samples_seen / self.callbacks if self.callbacks else 0.0
+            ),
+            "level_dbfs": energy_to_dbfs(self.last_energy),
+            "noise_floor_dbfs": energy_to_dbfs(self.noise_energy),
+            "speaking": self.speaking,
+        }
+
+
+class PreRollBuffer:
+    """
+    Fixed-size ring of the most recent audio, so the start of an utterance (which
+    the VAD only notices a block or so late) still makes it to the recognizer.
+    Writes go straight into one preallocated bytearray through memoryview slices.
+    """
+
+    def __init__(self, capacity: int) -> None:
+        """
+        Sets up an empty ring.
+        - capacity (int): Size in bytes. Keep it a multiple of the sample width.
+        """
+        self.capacity = capacity
+        self.buffer = bytearray(capacity)
+        self.view = memoryview(self.buffer)
+        self.end = 0  # where the next write goes
+        self.size = 0
+
+    def write(self, block) -> None:
+        """
+        Appends a block, overwriting the oldest audio once full.
+        - block (buffer): Raw audio.
+        """
+        if self.capacity == 0:
+            return
+
+        data = memoryview(block).cast("B")
+        length = len(data)
+
+        if length >= self.capacity:
+            self.view[:] = data[length - self.capacity :]
+            self.end = 0
+            self.size = self.capacity
+            return
+
+        first = min(length, self.capacity - self.end)
+        self.view[self.end : self.end + first] = data[:first]
+        self.view[: length - first] = data[first:]
+
+        self.end = (self.end + length) % self.capacity
+        self.size = min(self.capacity, self.size + length)
+
+    def slices(self) -> List[memoryview]:
+        """
+        The buffered audio, oldest first, without copying. The views point into the
+        ring, so use them before the next write().
+        - Returns (List[memoryview]): One or two slices.
+        """
+        if self.size == 0:
+            return []
+
+        start = (self.end - self.size) % self.capacity
+        if start + self.size <= self.capacity:
+            return [self.view[start : start + self.size]]
+        return [self.view[start:], self.view[: self.end]]
+
+    def clear(self) -> None:
+        """
+        Forgets everything buffered.
+        """
+        self.size = 0
@@ -0,0 +1,236 @@
+"""
+Image input for vision models. Figures out what an image is from its first bytes,
+shrinks it to what the model can actually use, and caches the base64 payload so
+asking about the same screenshot again doesn't read and encode it all over again.
+"""
+
+import base64
+import hashlib
+import io
+import os
+import struct
+import threading
+from collections import OrderedDict
+from typing import BinaryIO, NamedTuple, Optional, Tuple
+
+from PIL import Image
+
+
+# base64 works on 3 byte groups, so chunks that are a multiple of 3 encode on their
+# own and can be joined without padding in the middle
+_CHUNK_SIZE = 3 * 256 * 1024
+
+# start-of-frame markers, minus DHT, JPG and DAC which share the range
+_JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+class EncodedImage(NamedTuple):
+    mime: str
+    data: str  # base64
+    width: int
+    height: int
+
+    @property
+    def url(self) -> str:
+        return f"data:{self.mime};base64,{self.data}"
+
+
+def _jpeg_size(file: BinaryIO) -> Tuple[int, int]:
+    """
+    Walks the JPEG segments up to the first start-of-frame, which has the size.
+    """
+    file.seek(2)
+    while True:
+        marker = file.read(2)
+        while marker[:1] == b"\xff" and marker[1:] == b"\xff":
+            marker = marker[1:] + file.read(1)  # fill bytes
+        if len(marker) < 2 or marker[0] != 0xFF:
+            raise ValueError("vision - broken JPEG")
+
+        if 0xD0 <= marker[1] <= 0xD9 or marker[1] == 0x01:
+            continue  # markers without a length
+
+        (length,) = struct.unpack(">H", file.read(2))
+        if marker[1] in _JPEG_SOF_MARKERS:
+            height, width = struct.unpack(">xHH", file.read(5))
+            return width, height
+        file.seek(length - 2, os.SEEK_CUR)
+
+
+def image_info(file: BinaryIO) -> Tuple[str, int, int]:
+    """
+    Reads the format and size out of an image's header, without decoding it.
+    - file (BinaryIO): The image, opened in binary mode.
+    - Returns (Tuple[str, int, int]): (mime type, width, height).
+    Raises ValueError for formats vision models don't take, and for files cut short.
+    """
+    try:
+        return _header_info(file)
+    except struct.error as e:
+        raise ValueError(f"vision - truncated image: {e}") from e
+
+
+def _header_info(file: BinaryIO) -> Tuple[str, int, int]:
+    file.seek(0)
+    header = file.read(32)
+
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        width, height = struct.unpack(">II", header[16:24])
+        return "image/png", width, height
+
+    if header.startswith(b"\xff\xd8\xff"):
+        return ("image/jpeg", *_jpeg_size(file))
+
+    if header[:6] in (b"GIF87a", b"GIF89a"):
+        width, height = struct.unpack("<HH", header[6:10])
+        return "image/gif", width, height
+
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        chunk = header[12:16]
+        if chunk == b"VP8 ":
+            width, height = struct.unpack("<HH", header[26:30])
+            return "image/webp", width & 0x3FFF, height & 0x3FFF
+        if chunk == b"VP8L":
+            bits = int.from_bytes(header[21:25], "little")
+            return "image/webp", (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b"VP8X":
+            width = int.from_bytes(header[24:27], "little") + 1
+            height = int.from_bytes(header[27:30], "little") + 1
+            return "image/webp", width, height
+
+    raise ValueError("vision - unsupported image format, use PNG, JPEG, GIF or WebP")
+
+
+class ImageEncoder:
+    """
+    Turns image files into base64 payloads for vision requests.
+    Payloads are cached by content hash, and file paths map to hashes by mtime and
+    size, so an unchanged file is a dict lookup and a copied or touched one only costs
+    a hash.
+    """
+
+    def __init__(
+        self,
+        max_side: int = 1120,
+        max_payload_bytes: int = 4 * 1024 * 1024,
+        quality: int = 85,
+        max_cache_bytes: int = 64 * 1024 * 1024,
+    ) -> None:
+        """
+        Sets up an empty cache.
+        - max_side (int): Longest side, in pixels, worth sending. Bigger images get
+          scaled down. The default is the vision model's tile size.
+        - max_payload_bytes (int): Images whose base64 would be bigger than this get
+          re-encoded as JPEG. Groq turns away bigger base64 images.
+        - quality (int): JPEG quality for re-encoded images.
+        - max_cache_bytes (int): Least recently used payloads get evicted past this.
+        """
+        self.max_side = max_side
+        self.max_payload_bytes = max_payload_bytes
+        self.quality = quality
+        self.max_cache_bytes = max_cache_bytes
+
+        self._digests: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+        self._payloads: "OrderedDict[str, EncodedImage]" = OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+
+    def _remember(self, stat_key: Tuple[str, int, int], digest: str, image=None):
+        with self._lock:
+            self._digests[stat_key] = digest
+            self._digests.move_to_end(stat_key)
+            while len(self._digests) > 1024:
+                self._digests.popitem(last=False)
+
+            if image is not None and digest not in self._payloads:
+                self._payloads[digest] = image
+                self._cached_bytes += len(image.data)
+                while self._cached_bytes > self.max_cache_bytes and self._payloads:
+                    _, evicted = self._payloads.popitem(last=False)
+                    self._cached_bytes -= len(evicted.data)
+
+    def _cached(self, digest: Optional[str]) -> Optional[EncodedImage]:
+        with self._lock:
+            image = self._payloads.get(digest)
+            if image is not None:
+                self._payloads.move_to_end(digest)
+            return image
+
+    def _downsample(self, path: str) -> Tuple[str, bytes, int, int]:
+        """
+        Scales an image down to max_side and re-encodes it.
+        - Returns (Tuple[str, bytes, int, int]): (mime type, encoded bytes, width, height).
+        Raises ValueError for images too big to decode safely.
+        """
+        try:
+            opened = Image.open(path)
+        except Image.DecompressionBombError as e:
+            raise ValueError(f"vision - {e}") from e
+
+        with opened as image:
+            image.draft("RGB", (self.max_side, self.max_side))  # cheap JPEG pre-scaling
+            image.thumbnail((self.max_side, self.max_side))
+
+            has_alpha = image.mode in ("RGBA", "LA") or (
+                image.mode == "P" and "transparency" in image.info
+            )
+            output = io.BytesIO()
+            if has_alpha:
+                image.save(output, format="PNG", optimize=True)
+                mime = "image/png"
+            else:
+                image.convert("RGB").save(
+                    output, format="JPEG", quality=self.quality, optimize=True
+                )
+                mime = "image/jpeg"
+
+            return mime, output.getvalue(), image.width, image.height
+
+    def encode(self, path: str) -> EncodedImage:
+        """
+        Gets the payload for an image, from the cache if the file hasn't changed.
+        - path (str): The image file.
+        - Returns (EncodedImage): mime type, base64 data, and the size that got sent.
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        stat_key = (path, stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            digest = self._digests.get(stat_key)
+        image = self._cached(digest)
+        if image is not None:
+            return image
+
+        with open(path, "rb") as file:
+            mime, width, height = image_info(file)
+
+            file.seek(0)
+            sha = hashlib.sha256()
+            for chunk in iter(lambda: file.read(_CHUNK_SIZE), b""):
+                sha.update(chunk)
+            digest = sha.hexdigest()
+
+            image = self._cached(digest)
+            if image is not None:
+                self._remember(stat_key, digest)
+                return image
+
+            too_big = max(width, height) > self.max_side
+            too_heavy = stat.st_size * 4 / 3 > self.max_payload_bytes
+            if too_big or too_heavy:
+                mime, data, width, height = self._downsample(path)
+                encoded = base64.b64encode(data).decode("ascii")
+            else:
+                file.seek(0)
+                encoded = "".join(
+                    base64.b64encode(chunk).decode("ascii")
+                    for chunk in iter(lambda: file.read(_CHUNK_SIZE), b"")
+                )
+
+        image = EncodedImage(mime, encoded, width, height)
+        self._remember(stat_key, digest, image)
+        return image
+
+
+image_encoder = ImageEncoder()
@@ -0,0 +1,10 @@
+"""
+The modules live flat in src/ and import each other by name, like main.py does.
+"""
+
+import os
+import sys
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+)
@@ -0,0 +1,123 @@
+"""
+RedisAnswerCache against fakeredis, so it runs without a Redis server.
+"""
+
+import time
+
+import fakeredis
+import pytest
+
+from cache import RedisAnswerCache, cache_key
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def cache(server):
+    return RedisAnswerCache(
+        namespace="test", max_entries=3, client=fakeredis.FakeRedis(server=server)
+    )
+
+
+def test_get_set(cache):
+    assert cache.get("missing") is None
+
+    before = time.time()
+    cache.set("key", "answer")
+    entry = cache.get("key")
+    assert entry["answer"] == "answer"
+    assert before <= entry["timestamp"] <= time.time()
+
+
+def test_set_goes_out_as_one_pipeline(cache):
+    cache.set("key", "answer", ttl=60)
+
+    assert cache.client.hget("test:key", "answer") == b"answer"
+    assert 0 < cache.client.ttl("test:key") <= 60
+    assert cache.client.zscore(cache.lru_key, "key") is not None
+
+
+def test_default_ttl(server):
+    forever = RedisAnswerCache(
+        namespace="test", default_ttl=None, client=fakeredis.FakeRedis(server=server)
+    )
+    forever.set("key", "answer")
+    assert forever.client.ttl("test:key") == -1
+
+    forever.set("short", "answer", ttl=0.2)
+    assert forever.client.ttl("test:short") == 1
+
+
+def test_expired_entries_leave_the_lru_set(cache):
+    cache.set("key", "answer", ttl=60)
+    cache.client.pexpire("test:key", 1)
+    time.sleep(0.01)
+
+    assert cache.get("key") is None
+    assert cache.client.zscore(cache.lru_key, "key") is None
+
+
+def test_evicts_least_recently_used(cache):
+    for key in ["a", "b", "c"]:
+        cache.set(key, key.upper())
+        time.sleep(0.001)  # lru scores are timestamps
+
+    cache.get("a")  # now b is the oldest
+    time.sleep(0.001)
+    cache.set("d", "D")
+
+    assert cache.get("b") is None
+    assert not cache.client.exists("test:b")
+    assert [cache.get(key)["answer"] for key in ["a", "c", "d"]] == ["A", "C", "D"]
+    assert cache.client.zcard(cache.lru_key) == 3
+
+
+def test_delete_and_clear(server, cache):
+    other = RedisAnswerCache(
+        namespace="other", client=fakeredis.FakeRedis(server=server)
+    )
+    other.set("key", "kept")
+    cache.set("a", "A")
+    cache.set("b", "B")
+
+    cache.delete("a")
+    assert cache.get("a") is None
+    assert cache.client.zscore(cache.lru_key, "a") is None
+
+    cache.clear()
+    assert cache.get("b") is None
+    assert other.get("key")["answer"] == "kept"
+
+
+def test_shared_between_processes(server, cache):
+    cache.set("key", "answer")
+    elsewhere = RedisAnswerCache(
+        namespace="test", client=fakeredis.FakeRedis(server=server)
+    )
+    assert elsewhere.get("key")["answer"] == "answer"
+
+
+def test_keys_depend_on_model_and_system_prompt(cache):
+    key = cache_key("What is Redis?", "llama", system="be brief")
+    cache.set(key, "a database")
+
+    assert cache.get(cache_key("what is redis", "llama", system="be brief"))
+    assert cache.get(cache_key("What is Redis?", "mixtral", system="be brief")) is None
+    assert cache.get(cache_key("What is Redis?", "llama", system="be wordy")) is None
+    assert cache.get(cache_key("What is Redis?", "llama")) is None
+
+
+def test_unreachable_server(server, cache):
+    cache.set("key", "answer")
+    server.connected = False
+
+    assert cache.get("key") is None
+    cache.set("other", "answer")  # logged, not raised
+    cache.delete("key")
+    cache.clear()
+
+    with pytest.raises(ConnectionError):
+        RedisAnswerCache(client=fakeredis.FakeRedis(server=server))
@@ -0,0 +1,114 @@
+"""
+TranscriptDispatcher policies and counters.
+"""
+
+import threading
+
+from dispatch import DispatchPolicy, TranscriptDispatcher
+
+
+def blocked_dispatcher(policy, max_pending=2, **kwargs):
+    """
+    A started dispatcher whose one worker is stuck on the first transcript until
+    release is set.
+    """
+    release = threading.Event()
+    busy = threading.Event()
+    handled = []
+
+    def handler(text):
+        busy.set()
+        release.wait(5)
+        handled.append(text)
+
+    dispatcher = TranscriptDispatcher(
+        handler, max_pending=max_pending, policy=policy, **kwargs
+    )
+    dispatcher.start()
+    dispatcher.submit("first")
+    busy.wait(5)
+    return dispatcher, release, handled
+
+
+def test_coalesce_merges_what_piles_up():
+    dispatcher, release, handled = blocked_dispatcher(DispatchPolicy.COALESCE)
+    for text in ["a", "b", "c"]:
+        assert dispatcher.submit(text)
+    assert list(dispatcher.pending) == ["a b c"]
+    assert dispatcher.stats["coalesced"] == 2
+
+    release.set()
+    with dispatcher.condition:
+        dispatcher.condition.wait_for(lambda: not dispatcher.pending, timeout=5)
+    dispatcher.stop()
+    assert handled == ["first", "a b c"]
+
+
+def test_drop_policies():
+    dispatcher, release, _ = blocked_dispatcher(DispatchPolicy.DROP_NEWEST)
+    assert [dispatcher.submit(text) for text in "abc"] == [True, True, False]
+    assert list(dispatcher.pending) == ["a", "b"]
+    release.set()
+    dispatcher.stop()
+
+    dispatcher, release, _ = blocked_dispatcher(DispatchPolicy.DROP_OLDEST)
+    assert all(dispatcher.submit(text) for text in "abc")
+    assert list(dispatcher.pending) == ["b", "c"]
+    assert dispatcher.stats["dropped"] == 1
+    release.set()
+    dispatcher.stop()
+
+
+def test_block_drops_after_the_timeout_or_on_stop():
+    dispatcher, release, _ = blocked_dispatcher(
+        DispatchPolicy.BLOCK, max_pending=1, block_timeout=0.05
+    )
+    assert dispatcher.submit("a")
+    assert not dispatcher.submit("b")
+
+    results = []
+    waiting = threading.Thread(
+        target=lambda: results.append(dispatcher.submit("c")), daemon=True
+    )
+    dispatcher.block_timeout = 5
+    waiting.start()
+    dispatcher.stop(wait=False)
+    waiting.join(5)
+    release.set()
+
+    assert results == [False]
+    assert list(dispatcher.pending) == []
+    assert dispatcher.stats["dropped"] == 2
+    assert not dispatcher.submit("after stop")
+
+
+def test_counters_add_up_under_load():
+    def handler(text):
+        if int(text) % 3 == 0:
+            raise RuntimeError(text)
+
+    dispatcher = TranscriptDispatcher(
+        handler, workers=4, max_pending=1000, policy=DispatchPolicy.BLOCK
+    )
+    dispatcher.start()
+    submitters = [
+        threading.Thread(
+            target=lambda start=start: [
+                dispatcher.submit(str(i)) for i in range(start, start + 250)
+            ]
+        )
+        for start in range(0, 1000, 250)
+    ]
+    for thread in submitters:
+        thread.start()
+    for thread in submitters:
+        thread.join()
+
+    with dispatcher.condition:
+        dispatcher.condition.wait_for(lambda: not dispatcher.pending, timeout=5)
+    dispatcher.stop()
+
+    stats = dispatcher.stats
+    assert stats["submitted"] == 1000
+    assert stats["handled"] + stats["errors"] == 1000
+    assert stats["errors"] == 334
@@ -0,0 +1,87 @@
+"""
+TrigramIndex and search_by_text have to find exactly what the difflib scan they
+replaced found.
+"""
+
+import random
+from difflib import get_close_matches
+
+import pytest
+
+from history import CompletionHistory
+from index import TrigramIndex
+
+
+WORDS = (
+    "what is the best way to learn python rust redis cache wifi of for ten "
+    "how do I fix my bike weather today tomorrow capital France Paris C++ C# "
+    "é ü 日本 2+2 2-2"
+).split()
+
+
+def corpus(rng: random.Random, size: int):
+    texts = []
+    for _ in range(size):
+        words = rng.choices(WORDS, k=rng.randint(1, 9))
+        text = " ".join(words)
+        if rng.random() < 0.3 and len(text) > 3:  # typo
+            i = rng.randrange(len(text) - 1)
+            text = text[:i] + text[i + 1] + text[i] + text[i + 2 :]
+        texts.append(text.capitalize() if rng.random() < 0.2 else text)
+    return texts
+
+
+def old_search_by_text(entries, text, cutoff):
+    """
+    search_by_text before the index, verbatim.
+    """
+    matches = []
+    for entry in entries:
+        for key in ["request", "answer"]:
+            if key in entry and isinstance(entry[key], str):
+                if get_close_matches(text, [entry[key]], n=1, cutoff=cutoff):
+                    matches.append(entry)
+                    break
+    return matches
+
+
+@pytest.mark.parametrize("cutoff", [0.3, 0.6, 0.8, 1.0])
+def test_index_matches_difflib(cutoff):
+    rng = random.Random(1)
+    texts = corpus(rng, 1000)
+    index = TrigramIndex()
+    for text in texts:
+        index.add(text)
+
+    for query in corpus(rng, 40) + ["of the", "a", "", "x" * 300]:
+        found = {doc_id for _, doc_id in index.search(query, texts.__getitem__, cutoff)}
+        expected = {
+            doc_id
+            for doc_id, text in enumerate(texts)
+            if get_close_matches(query, [text], n=1, cutoff=cutoff)
+        }
+        assert found == expected, query
+
+
+def test_search_by_text_matches_old_scan(tmp_path):
+    rng = random.Random(2)
+    requests, answers = corpus(rng, 800), corpus(rng, 800)
+    history = CompletionHistory(debug=False, history_directory=str(tmp_path))
+    history.conversation_history.extend(
+        {"request": request, "answer": answer}
+        for request, answer in zip(requests, answers)
+    )
+
+    for query in corpus(rng, 40):
+        assert history.search_by_text(query) == old_search_by_text(
+            history.conversation_history, query, 0.6
+        ), query
+
+
+def test_lossy_mode_is_opt_in():
+    assert TrigramIndex().max_candidates is None
+
+    index = TrigramIndex(max_candidates=4)
+    for text in ["the same thing"] * 10:
+        index.add(text)
+    assert len(index.search("the same thing", lambda i: "the same thing")) == 4
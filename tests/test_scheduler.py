@@ -0,0 +1,324 @@
+"""
+RequestScheduler against a Groq client whose HTTP transport is a local handler.
+"""
+
+import asyncio
+import json
+import tempfile
+import threading
+import time
+
+import httpx
+import pytest
+from groq import AsyncGroq, Groq, InternalServerError, RateLimitError
+
+import scheduler as scheduler_module
+from base import AvailableGroqModels, Model, ModelMode
+from cache import MemoryAnswerCache
+from history import CompletionHistory
+from scheduler import RequestScheduler, TokenBucket, parse_duration
+from semantic import SemanticIndex
+
+
+LARGE = "llama-3.1-70b-versatile"
+SMALL = "llama3-8b-8192"
+
+
+def completion(model: str, content: str = "hi") -> dict:
+    return {
+        "id": "test",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+    }
+
+
+def client(handler) -> Groq:
+    """
+    A Groq client that sends every request to handler(request, body).
+    """
+    return Groq(
+        api_key="test",
+        max_retries=0,
+        http_client=httpx.Client(
+            transport=httpx.MockTransport(
+                lambda request: handler(request, json.loads(request.content))
+            )
+        ),
+    )
+
+
+def scripted(*statuses):
+    """
+    A handler that answers with these statuses in turn, then 200 forever.
+    - Returns: The handler and the list of models it was asked for.
+    """
+    asked = []
+
+    def handler(request, body):
+        asked.append(body["model"])
+        if len(asked) <= len(statuses):
+            status, headers = statuses[len(asked) - 1]
+            return httpx.Response(
+                status, json={"error": {"message": "nope"}}, headers=headers
+            )
+        return httpx.Response(200, json=completion(body["model"]))
+
+    return handler, asked
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """
+    Records the scheduler's sleeps instead of sleeping.
+    """
+    slept = []
+    monkeypatch.setattr(scheduler_module.time, "sleep", slept.append)
+    return slept
+
+
+def ask(scheduler: RequestScheduler, model: str = LARGE):
+    return scheduler.create(
+        model=model, messages=[{"role": "user", "content": "hello"}]
+    )
+
+
+def test_parse_duration():
+    assert parse_duration("7.66s") == pytest.approx(7.66)
+    assert parse_duration("2m59.56s") == pytest.approx(179.56)
+    assert parse_duration("350ms") == pytest.approx(0.35)
+    assert parse_duration("3") == 3.0
+    assert parse_duration("") is None
+    assert parse_duration("soon") is None
+
+
+def test_retries_5xx_with_backoff(sleeps):
+    handler, asked = scripted((500, {}), (503, {}))
+    scheduler = RequestScheduler(client(handler), base_delay=0.5, fallbacks={})
+
+    assert ask(scheduler).choices[0].message.content == "hi"
+    assert asked == [LARGE] * 3
+    assert len(sleeps) == 2
+    assert 0 <= sleeps[0] <= 1.0 and 0 <= sleeps[1] <= 2.0  # full jitter
+    assert scheduler.stats()["retries"] == 2
+
+
+def test_429_waits_at_least_retry_after(sleeps):
+    handler, asked = scripted((429, {"retry-after": "2"}))
+    scheduler = RequestScheduler(client(handler), base_delay=0.01, fallbacks={})
+
+    ask(scheduler)
+    assert asked == [LARGE] * 2
+    assert sleeps == [2.0]
+
+
+def test_gives_up_after_max_attempts(sleeps):
+    handler, asked = scripted(*[(500, {})] * 10)
+    scheduler = RequestScheduler(client(handler), max_attempts=3, fallbacks={})
+
+    with pytest.raises(InternalServerError):
+        ask(scheduler)
+    assert len(asked) == 3
+
+
+def test_gives_up_when_backoff_passes_the_deadline(sleeps):
+    handler, asked = scripted((429, {"retry-after": "60"}))
+    scheduler = RequestScheduler(client(handler), deadline=5, fallbacks={})
+
+    with pytest.raises(RateLimitError):
+        ask(scheduler)
+    assert len(asked) == 1 and not sleeps
+
+
+def test_client_errors_are_not_retried(sleeps):
+    handler, asked = scripted((400, {}))
+    scheduler = RequestScheduler(client(handler), fallbacks={})
+
+    with pytest.raises(Exception):
+        ask(scheduler)
+    assert len(asked) == 1
+
+
+def test_429_falls_back_to_the_smaller_model(sleeps):
+    handler, asked = scripted((429, {}))
+    scheduler = RequestScheduler(client(handler))
+
+    assert ask(scheduler).model == SMALL
+    assert asked == [LARGE, SMALL]
+    assert not sleeps
+    assert scheduler.stats()["fallbacks"] == 1
+
+
+def test_hedge_fires_after_the_delay():
+    calls = []
+    lock = threading.Lock()
+
+    def handler(request, body):
+        with lock:
+            calls.append(time.monotonic())
+            first = len(calls) == 1
+        if first:
+            time.sleep(0.5)
+            return httpx.Response(200, json=completion(body["model"], "slow"))
+        return httpx.Response(200, json=completion(body["model"], "fast"))
+
+    scheduler = RequestScheduler(client(handler), hedge_after=0.1, fallbacks={})
+    started = time.monotonic()
+    try:
+        answer = ask(scheduler).choices[0].message.content
+        took = time.monotonic() - started
+    finally:
+        scheduler.close()
+
+    assert answer == "fast"
+    assert len(calls) == 2
+    assert calls[1] - calls[0] >= 0.1
+    assert took < 0.4
+    assert scheduler.stats()["hedges"] == 1
+    assert scheduler.stats()["hedge_wins"] == 1
+
+
+def test_no_hedge_when_the_answer_is_quick():
+    handler, asked = scripted()
+    scheduler = RequestScheduler(client(handler), hedge_after=0.2, fallbacks={})
+    try:
+        ask(scheduler)
+    finally:
+        scheduler.close()
+
+    assert len(asked) == 1
+    assert scheduler.stats()["hedges"] == 0
+
+
+def test_token_bucket():
+    bucket = TokenBucket()
+    assert bucket.take(100) == 0  # nothing known yet, let everything through
+
+    bucket.observe(limit=10, remaining=1, reset=9)  # refills 1 per second
+    assert bucket.wait_time(1) == 0
+    assert bucket.take(1) == 0
+    assert bucket.wait_time(1) == pytest.approx(1, abs=0.05)
+    assert bucket.take(2) == pytest.approx(2, abs=0.05)  # goes into debt
+
+    bucket.observe(limit=10, remaining=10, reset=None)
+    assert bucket.tokens < 0  # the server's count never raises the local one
+
+
+def test_throttles_from_rate_limit_headers(sleeps):
+    def handler(request, body):
+        return httpx.Response(
+            200,
+            json=completion(body["model"]),
+            headers={
+                "x-ratelimit-limit-requests": "10",
+                "x-ratelimit-remaining-requests": "0",
+                "x-ratelimit-reset-requests": "2s",  # 5 requests a second
+            },
+        )
+
+    scheduler = RequestScheduler(client(handler), fallbacks={})
+    ask(scheduler)
+    assert not sleeps
+
+    ask(scheduler)
+    ask(scheduler)
+    assert len(sleeps) == 2
+    assert sleeps[0] == pytest.approx(0.2, abs=0.05)
+    assert sleeps[1] == pytest.approx(0.4, abs=0.05)  # queued behind the first
+
+
+def test_rate_limited_past_the_deadline_falls_back(sleeps):
+    def handler(request, body):
+        return httpx.Response(
+            200,
+            json=completion(body["model"]),
+            headers={
+                "x-ratelimit-limit-requests": "10",
+                "x-ratelimit-remaining-requests": "0",
+                "x-ratelimit-reset-requests": "10m",
+            },
+        )
+
+    scheduler = RequestScheduler(client(handler), deadline=5)
+    ask(scheduler)
+    assert ask(scheduler).model == SMALL
+    assert not sleeps
+
+
+def test_async_retries_and_falls_back(monkeypatch):
+    statuses = [500, 429]
+    asked = []
+
+    async def handler(request):
+        body = json.loads(request.content)
+        asked.append(body["model"])
+        if statuses:
+            return httpx.Response(statuses.pop(0), json={"error": {"message": "no"}})
+        return httpx.Response(200, json=completion(body["model"]))
+
+    async def no_sleep(delay):
+        pass
+
+    monkeypatch.setattr(scheduler_module.asyncio, "sleep", no_sleep)
+    scheduler = RequestScheduler(
+        AsyncGroq(
+            api_key="test",
+            max_retries=0,
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        )
+    )
+
+    response = asyncio.run(
+        scheduler.acreate(model=LARGE, messages=[{"role": "user", "content": "hi"}])
+    )
+    assert response.model == SMALL
+    assert asked == [LARGE, LARGE, SMALL]
+
+
+def test_fallback_answers_are_not_cached(sleeps):
+    def handler(request, body):
+        if body["model"] == LARGE:
+            return httpx.Response(429, json={"error": {"message": "quota"}})
+        if body.get("stream"):
+            chunk = {
+                "id": "test",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body["model"],
+                "choices": [
+                    {"index": 0, "delta": {"content": "small"}, "finish_reason": None}
+                ],
+            }
+            return httpx.Response(
+                200,
+                headers={"content-type": "text/event-stream"},
+                content=f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n".encode(),
+            )
+        return httpx.Response(200, json=completion(body["model"], "small"))
+
+    cache = MemoryAnswerCache()
+    model = Model(
+        client=client(handler),
+        llm_model=AvailableGroqModels.LARGE,
+        history=CompletionHistory(debug=False, history_directory=tempfile.mkdtemp()),
+        answer_cache=cache,
+        mode=ModelMode.DATA,
+        confirm_generation=False,
+        semantic_index=SemanticIndex(None),
+    )
+    try:
+        assert model.completion("what is up") == "small"
+        assert "".join(model.stream_completion("what else")) == "small"
+    finally:
+        model.scheduler.close()
+
+    assert len(cache._entries) == 0
+    assert model.scheduler.stats()["fallbacks"] == 2
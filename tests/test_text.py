@@ -0,0 +1,97 @@
+"""
+to_speech_text's one-pass stripper has to give exactly what the markdown -> HTML ->
+text pipeline gives.
+"""
+
+import random
+
+import pytest
+
+from bench import markdown_corpus
+from text import SentenceSplitter, _render_markdown, to_speech_text
+
+
+GOLDEN = [
+    "",
+    "Just a plain sentence.",
+    "# Header\n\nSome text.",
+    "## Header with closing hashes ##",
+    "Some **bold**, some *italic*, some ***both*** and __underscores__.",
+    "Snake_case_names and 2 * 3 * 4 stay as they are.",
+    "A lone * star and a ** pair.",
+    "Run `pip install groq` first, or ``code with ` inside``.",
+    "See [the docs](https://example.com) or [this](https://example.com 'title').",
+    "An image ![alt text](https://example.com/a.png) in the middle.",
+    "Line one  \nline two\nline three",
+    "1. First\n2. Second\n3. Third",
+    "- one\n- two\n\n- loose three",
+    "* star item\n+ plus item",
+    "1. item\n\n    continued paragraph",
+    "```python\ndef f():\n    return 1\n```\n\nAfter the code.",
+    "Text\n```\nfenced right after text\n```",
+    "> A quote\n> over two lines",
+    "<div>raw html</div>",
+    "Escaped \\*stars\\* and \\`ticks\\`.",
+    "A [reference link][ref].\n\n[ref]: https://example.com",
+    "    indented code block\n\nText.",
+    "Title\n=====\n\nSub\n---",
+    "Above\n\n---\n\nBelow",
+    "Tabs\tin\tthe middle and\r\nWindows line ends.",
+    "Entities like &amp; and &#169; and <br> tags.",
+    "Unicode: café, naïve, 日本語, emoji 🎉.",
+    "Trailing spaces   \n\n\n\nand blank lines   ",
+    "C++ vs C# vs 2+2=4 and 5 - 3 = 2.",
+    "Ends with a question?",
+]
+
+FRAGMENTS = [
+    "plain words",
+    "**bold**",
+    "*italic*",
+    "_under_",
+    "`code`",
+    "[link](https://example.com)",
+    "![img](x.png)",
+    "# head",
+    "- item",
+    "1. item",
+    "```\nfenced\n```",
+    "  \n",
+    "\n",
+    "\n\n",
+    "a * b",
+    "***",
+    "> quote",
+    "snake_case",
+]
+
+
+@pytest.mark.parametrize("text", GOLDEN)
+def test_fast_path_matches_the_renderer(text):
+    assert to_speech_text(text) == _render_markdown(text)
+
+
+def test_fast_path_matches_the_renderer_on_generated_answers():
+    for text in markdown_corpus(200, seed=3):
+        assert to_speech_text(text) == _render_markdown(text), text
+
+
+def test_fast_path_matches_the_renderer_on_random_fragments():
+    rng = random.Random(0)
+    for _ in range(2000):
+        text = " ".join(rng.choices(FRAGMENTS, k=rng.randint(1, 8)))
+        assert to_speech_text(text) == _render_markdown(text), repr(text)
+
+
+def test_sentence_splitter_keeps_code_blocks_whole():
+    splitter = SentenceSplitter(min_length=5)
+    sentences = []
+    for chunk in ["Here it is. ", "```\nx = 1. y = 2.\n", "```\n\nDone now. Bye"]:
+        sentences += splitter.feed(chunk)
+
+    assert sentences == [
+        "Here it is.",
+        "```\nx = 1. y = 2.\n```",
+        "Done now.",
+    ]
+    assert splitter.flush() == "Bye"
@@ -0,0 +1,44 @@
+"""
+VoiceActivityDetector on synthetic blocks of constant level.
+"""
+
+import numpy
+
+from vad import VoiceActivityDetector, dbfs_to_energy
+
+BLOCK = 0.02  # seconds per block
+
+
+def block(dbfs: float, samples: int = 320) -> bytes:
+    amplitude = numpy.sqrt(dbfs_to_energy(dbfs))
+    return numpy.full(samples, amplitude, dtype=numpy.int16).tobytes()
+
+
+def run(vad: VoiceActivityDetector, levels, start: float = 0.0):
+    """
+    - Returns: (speaking, started, ended) per block.
+    """
+    return [
+        vad.process(block(level), start + i * BLOCK) for i, level in enumerate(levels)
+    ]
+
+
+def test_starts_and_ends_with_hangover():
+    vad = VoiceActivityDetector(hangover=0.1)
+    events = run(vad, [-70] * 10 + [-20] * 10 + [-70] * 10)
+
+    assert [i for i, (_, started, _) in enumerate(events) if started] == [10]
+    assert [i for i, (_, _, ended) in enumerate(events) if ended] == [25]
+
+
+def test_max_utterance_needs_a_release_before_the_next_onset():
+    vad = VoiceActivityDetector(max_utterance=0.2)
+    events = run(vad, [-70] * 10 + [-20] * 100)
+
+    assert sum(started for _, started, _ in events) == 1
+    assert sum(ended for _, _, ended in events) == 1
+    assert not vad.speaking  # still loud, but it's the same speech
+
+    # a pause and then speech again is a new utterance
+    events = run(vad, [-70] * 50 + [-20] * 5, start=10.0)
+    assert [i for i, (_, started, _) in enumerate(events) if started] == [50]
@@ -0,0 +1,41 @@
+"""
+ImageEncoder on small generated images.
+"""
+
+import pytest
+from PIL import Image
+
+from vision import ImageEncoder, image_info
+
+
+def save(tmp_path, size, name="image.png", mode="RGB"):
+    path = tmp_path / name
+    Image.new(mode, size, "white").save(path)
+    return str(path)
+
+
+def test_small_images_go_out_as_they_are(tmp_path):
+    path = save(tmp_path, (64, 32))
+    with open(path, "rb") as file:
+        assert image_info(file) == ("image/png", 64, 32)
+
+    image = ImageEncoder().encode(path)
+    assert (image.mime, image.width, image.height) == ("image/png", 64, 32)
+    assert ImageEncoder().encode(path).data == image.data
+
+
+def test_big_images_get_scaled_down(tmp_path):
+    image = ImageEncoder(max_side=100).encode(save(tmp_path, (400, 200)))
+    assert (image.mime, image.width, image.height) == ("image/jpeg", 100, 50)
+
+    transparent = save(tmp_path, (400, 200), "alpha.png", mode="RGBA")
+    image = ImageEncoder(max_side=100).encode(transparent)
+    assert (image.mime, image.width, image.height) == ("image/png", 100, 50)
+
+
+def test_decompression_bombs_are_a_value_error(tmp_path, monkeypatch):
+    path = save(tmp_path, (400, 400))
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 100)
+
+    with pytest.raises(ValueError):
+        ImageEncoder(max_side=100).encode(path)